@@ -0,0 +1,194 @@
+# backend/app/admission.py
+
+import datetime
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .config import settings
+
+
+class AdmissionRejectedError(Exception):
+    """処理中のジョブが上限に達していてジョブを受け付けられない場合に送出される"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        # 再送までに待つべき秒数（Retry-Afterヘッダーの値）
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Ticket:
+    """受け付けたジョブの待ち順（先に処理されるジョブの数）と、完了までの見込み時間"""
+    position: int
+    eta_seconds: float
+
+    @property
+    def estimated_completion_at(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.eta_seconds)
+
+
+@dataclass
+class _Entry:
+    device_id: str
+    admitted_at: float
+    # 生成中の別のジョブに相乗りしている（推論ワーカーのキューを使わない）
+    follower: bool = False
+
+
+class AdmissionController:
+    """
+    処理中（キューで待機中または生成中）のジョブの数を、全体とデバイスごとに制限する。
+    上限を超えるリクエストはキャンバスの保存や推論ワーカーへの登録の前に断り、
+    受け付けたジョブには待ち順と、最近のジョブの処理時間の移動平均から求めた完了までの見込み時間を返す。
+    制限はこのプロセスが登録したジョブについてのもの（uvicornのワーカーごと）。
+    """
+
+    def __init__(self, max_in_flight: int, max_per_device: int,
+                 initial_job_seconds: float, window: int):
+        # 0なら制限しない
+        self.max_in_flight = max_in_flight
+        self.max_per_device = max_per_device
+        # ジョブ1件あたりの処理時間（秒）の、直近window件の移動平均。計測するまでは初期値を使う
+        self.initial_job_seconds = initial_job_seconds
+        self._durations: deque = deque(maxlen=window)
+        self._total = 0.0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._per_device: Dict[str, int] = {}
+        self._queued = 0
+        # 推論ワーカーが最後にジョブを終えた時刻。次のジョブの処理時間はここから数える
+        self._last_completed: Optional[float] = None
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.samples = 0
+
+    def check(self, device_id: str):
+        """
+        ジョブを受け付けられるかどうかだけを確かめ、上限に達していればAdmissionRejectedErrorを送出する。
+        キャンバスのデコードなどの前に、混雑時のリクエストを素早く断るために使う（受け付け自体はadmitで行う）。
+        """
+        with self._lock:
+            self._check(device_id)
+
+    def admit(self, job_id: str, device_id: str) -> Ticket:
+        """ジョブを処理中として登録し、待ち順と見込み時間を返す。上限に達していればAdmissionRejectedErrorを送出する"""
+        with self._lock:
+            self._check(device_id)
+            position = self._queued
+            self._entries[job_id] = _Entry(device_id, time.monotonic())
+            self._per_device[device_id] = self._per_device.get(device_id, 0) + 1
+            self._queued += 1
+            self.admitted += 1
+            return Ticket(position, self._eta(position))
+
+    def follow(self, job_id: str, primary_job_id: str) -> Ticket:
+        """
+        生成中のジョブに相乗りしたジョブを、キューを使わないジョブとして付け替え、相乗り元の待ち順と見込み時間を返す。
+        デバイスごとの上限には数え続ける。
+        """
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry and not entry.follower:
+                entry.follower = True
+                self._queued -= 1
+            return self._ticket(primary_job_id)
+
+    def release(self, job_id: str):
+        """処理されずに終わったジョブ（登録の失敗や相乗りしていたジョブ）の登録を解除する"""
+        with self._lock:
+            self._remove(job_id)
+
+    def complete(self, job_id: str, succeeded: bool):
+        """
+        推論ワーカーが処理を終えたジョブの登録を解除し、成功したジョブの処理時間を移動平均に加える。
+        処理時間は、登録された時刻と直前のジョブが終わった時刻の遅い方から数える（キューでの待ち時間を含めない）。
+        バッチでまとめて処理されたジョブは、最初の1件が処理時間の全体を、残りが0を持つので、
+        バッチの大きさより十分長い窓で平均する。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._remove(job_id)
+            if entry and succeeded:
+                started = max(entry.admitted_at, self._last_completed or entry.admitted_at)
+                if len(self._durations) == self._durations.maxlen:
+                    self._total -= self._durations[0]
+                self._durations.append(now - started)
+                self._total += now - started
+                self.samples += 1
+            self._last_completed = now
+
+    @property
+    def job_seconds(self) -> float:
+        """ジョブ1件あたりの処理時間の移動平均（秒）"""
+        if not self._durations:
+            return self.initial_job_seconds
+        return self._total / len(self._durations)
+
+    def _check(self, device_id: str):
+        if self.max_per_device and self._per_device.get(device_id, 0) >= self.max_per_device:
+            self.rejected += 1
+            # そのデバイスの一番古いジョブが終わる頃に再送させる
+            oldest = next(job_id for job_id, e in self._entries.items() if e.device_id == device_id)
+            raise AdmissionRejectedError(
+                "このデバイスの画像生成が終わるまでお待ちください。",
+                self._retry_after(self._ticket(oldest).eta_seconds))
+        if self.max_in_flight and self._queued >= self.max_in_flight:
+            self.rejected += 1
+            # 平均してジョブ1件分の時間で空きができる
+            raise AdmissionRejectedError(
+                "現在混み合っています。しばらくしてから再度お試しください。",
+                self._retry_after(self.job_seconds))
+
+    def _ticket(self, job_id: str) -> Ticket:
+        """登録順で前にある（キューを使う）ジョブの数を待ち順とする"""
+        position = 0
+        for other_id, entry in self._entries.items():
+            if other_id == job_id:
+                break
+            if not entry.follower:
+                position += 1
+        return Ticket(position, self._eta(position))
+
+    def _eta(self, position: int) -> float:
+        return (position + 1) * self.job_seconds
+
+    @staticmethod
+    def _retry_after(seconds: float) -> int:
+        return max(1, math.ceil(seconds))
+
+    def _remove(self, job_id: str) -> Optional[_Entry]:
+        entry = self._entries.pop(job_id, None)
+        if entry is None:
+            return None
+        count = self._per_device[entry.device_id] - 1
+        if count:
+            self._per_device[entry.device_id] = count
+        else:
+            del self._per_device[entry.device_id]
+        if not entry.follower:
+            self._queued -= 1
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._queued,
+                "followers": len(self._entries) - self._queued,
+                "devices": len(self._per_device),
+                "job_seconds": round(self.job_seconds, 3),
+                "samples": self.samples,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+admission_controller = AdmissionController(
+    max_in_flight=settings.max_in_flight_jobs,
+    max_per_device=settings.max_in_flight_per_device,
+    initial_job_seconds=settings.initial_job_seconds,
+    window=settings.job_seconds_window,
+)
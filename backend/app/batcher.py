@@ -0,0 +1,154 @@
+# backend/app/batcher.py
+
+import asyncio
+import logging
+import queue
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .profiles import apply_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class GenerationParams:
+    """1回のパイプライン呼び出しにまとめられるかを決めるサンプリングパラメータ"""
+    num_inference_steps: int
+    guidance_scale: float
+    adapter_conditioning_scale: float
+    width: int
+    height: int
+    scheduler: str
+
+
+@dataclass
+class GenerationRequest:
+    """バッチ化の単位となる、準備済みの生成リクエスト"""
+    job: Any
+    prompt: str
+    negative_prompt: str
+    image: Image.Image
+    params: GenerationParams
+    # プロンプト埋め込みキャッシュから得た埋め込み（無い場合は文字列のままエンコードさせる）
+    embeddings: Optional[Any] = None
+
+
+class MicroBatcher:
+    """
+    一定時間（window）だけ待って到着したジョブをまとめ、
+    互換性のあるパラメータ同士を1回のパイプライン呼び出しで処理するスケジューラ。
+    パイプラインは呼び出し可能なオブジェクトであれば何でもよく、テストでは偽物に差し替えられる。
+    """
+
+    def __init__(self, window: float = 0.1, max_batch_size: int = 4):
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+
+    async def collect(self, queue: asyncio.Queue) -> List[Any]:
+        """
+        キューから最初のジョブを待ち、その後window秒以内に届いたジョブを
+        max_batch_sizeまでまとめて返す。
+        """
+        jobs = [await queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(jobs) < self.max_batch_size:
+            # 既に積まれているジョブは待たずに取り出す
+            try:
+                jobs.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return jobs
+
+    def collect_blocking(self, get: Callable[..., Any]) -> List[Any]:
+        """
+        collectのスレッド・プロセス版。getはqueue.Queue.getやmultiprocessing.Queue.getのような
+        block/timeout引数を取る関数で、最初の1件は無期限に待つ。
+        """
+        items = [get()]
+        deadline = time.monotonic() + self.window
+        while len(items) < self.max_batch_size:
+            try:
+                items.append(get(block=False))
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def group(self, requests: List[GenerationRequest]) -> List[List[GenerationRequest]]:
+        """パラメータが一致するリクエストを到着順を保ったままグループ化する"""
+        groups: Dict[GenerationParams, List[GenerationRequest]] = {}
+        for request in requests:
+            groups.setdefault(request.params, []).append(request)
+        batches = []
+        for group in groups.values():
+            for i in range(0, len(group), self.max_batch_size):
+                batches.append(group[i:i + self.max_batch_size])
+        return batches
+
+    def run(
+        self,
+        pipe,
+        batch: List[GenerationRequest],
+        callback: Optional[Callable] = None,
+    ) -> List[Tuple[GenerationRequest, Image.Image]]:
+        """
+        1つのバッチをまとめてパイプラインに渡し、各結果を元のリクエストと対応付けて返す。
+        callbackはステップ終了ごとに潜在変数と共に呼ばれる。
+        """
+        params = batch[0].params
+        logger.info(f"バッチ生成を開始: batch_size={len(batch)}, params={params}")
+        apply_scheduler(pipe, params.scheduler)
+        callback_kwargs = {}
+        if callback is not None:
+            callback_kwargs = {
+                "callback_on_step_end": callback,
+                "callback_on_step_end_tensor_inputs": ["latents"],
+            }
+        images = pipe(
+            **self._prompt_kwargs(batch),
+            image=[r.image for r in batch],
+            num_inference_steps=params.num_inference_steps,
+            guidance_scale=params.guidance_scale,
+            adapter_conditioning_scale=params.adapter_conditioning_scale,
+            width=params.width,
+            height=params.height,
+            **callback_kwargs
+        ).images
+        if len(images) != len(batch):
+            raise RuntimeError(
+                f"生成枚数がバッチサイズと一致しません: {len(images)} != {len(batch)}")
+        return list(zip(batch, images))
+
+    @staticmethod
+    def _prompt_kwargs(batch: List[GenerationRequest]) -> Dict[str, Any]:
+        """全リクエストに埋め込みがあればそれを連結して渡し、無ければ文字列を渡す"""
+        if not all(r.embeddings is not None for r in batch):
+            return {
+                "prompt": [r.prompt for r in batch],
+                "negative_prompt": [r.negative_prompt for r in batch],
+            }
+        import torch
+        return {
+            name: torch.cat([getattr(r.embeddings, name) for r in batch])
+            for name in ("prompt_embeds", "negative_prompt_embeds",
+                         "pooled_prompt_embeds", "negative_pooled_prompt_embeds")
+        }
@@ -0,0 +1,197 @@
+# backend/app/bus.py
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+from .config import settings
+from .hub import TRANSIENT_TYPES
+
+logger = logging.getLogger(__name__)
+
+# 受信した通知をこのプロセスのWebSocketへ配送する関数（NotificationHub.deliver）
+Deliver = Callable[[str, dict, Optional[int]], Awaitable[None]]
+
+# 通知バスの実装はどれも同じメソッドを持つ:
+#   start(deliver)               受信を始め、受け取った通知をdeliverに渡す
+#   publish(device_id, payload)  全てのプロセスへ通知を送る（送ったプロセス自身も受け取る）
+#   stop()
+# 再送対象の通知には、全てのプロセスで共通の単調増加するシーケンス番号をバスが付ける。
+
+
+class MemoryBus:
+    """プロセス内だけで配送するバス（uvicornのワーカーが1つの場合）。シーケンス番号はハブが付ける"""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+    async def publish(self, device_id: str, payload: dict):
+        if self._deliver is not None:
+            await self._deliver(device_id, payload, None)
+
+
+# シーケンス番号の採番と配信を1つのスクリプトで行い、配信の順番とシーケンス番号の順番を一致させる
+_REDIS_PUBLISH = """
+local seq = 0
+if ARGV[2] == "1" then
+    seq = redis.call("INCR", KEYS[1])
+end
+redis.call("PUBLISH", KEYS[2], seq .. " " .. ARGV[1])
+return seq
+"""
+
+
+class RedisBus:
+    """
+    RedisのPub/Subで全てのプロセスへ配送するバス。
+    購読が切れた場合は再接続するが、切れている間に配信された通知は受け取れない（クライアントの再接続時に再送できない）。
+    """
+
+    def __init__(self, url: str, channel: str):
+        self.url = url
+        self.channel = channel
+        self.seq_key = f"{channel}:seq"
+        self._client = None
+        self._script = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(self.url)
+        self._script = self._client.register_script(_REDIS_PUBLISH)
+        self._task = asyncio.create_task(self._listen(deliver))
+        logger.info(f"通知バス（Redis）を開始しました: channel={self.channel}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def publish(self, device_id: str, payload: dict):
+        message = json.dumps({"device_id": device_id, "payload": payload})
+        replay = "0" if payload.get("type") in TRANSIENT_TYPES else "1"
+        await self._script(keys=[self.seq_key, self.channel], args=[message, replay])
+
+    async def _listen(self, deliver: Deliver):
+        while True:
+            try:
+                async with self._client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        seq, body = message["data"].decode().split(" ", 1)
+                        body = json.loads(body)
+                        await deliver(body["device_id"], body["payload"], int(seq) or None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"通知バス（Redis）の購読が切れました。再接続します: {e}")
+                await asyncio.sleep(1)
+
+
+class SQLiteBus:
+    """
+    共有のSQLiteファイルに通知を書き込み、各プロセスがポーリングで読み出すバス。
+    Redisを用意しない開発環境や検証用（同じホストの複数ワーカー）。行のIDをシーケンス番号に使う。
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.05, retention: float = 300):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        # 1つの接続を書き込みと読み出しのスレッドで共有するため
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS notifications ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT NOT NULL, payload TEXT NOT NULL, "
+            "replay INTEGER NOT NULL, created_at REAL NOT NULL)")
+        return conn
+
+    async def start(self, deliver: Deliver):
+        self._conn = await asyncio.to_thread(self._connect)
+        last_id = (await asyncio.to_thread(
+            self._execute, "SELECT COALESCE(MAX(id), 0) FROM notifications"))[0][0]
+        self._task = asyncio.create_task(self._poll(deliver, last_id))
+        logger.info(f"通知バス（SQLite）を開始しました: path={self.path}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def publish(self, device_id: str, payload: dict):
+        replay = payload.get("type") not in TRANSIENT_TYPES
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO notifications (device_id, payload, replay, created_at) VALUES (?, ?, ?, ?)",
+            (device_id, json.dumps(payload), int(replay), time.time()))
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _poll(self, deliver: Deliver, last_id: int):
+        purged_at = time.monotonic()
+        while True:
+            try:
+                rows = await asyncio.to_thread(
+                    self._execute,
+                    "SELECT id, device_id, payload, replay FROM notifications WHERE id > ? ORDER BY id",
+                    (last_id,))
+                for row_id, device_id, payload, replay in rows:
+                    last_id = row_id
+                    await deliver(device_id, json.loads(payload), row_id if replay else None)
+                if time.monotonic() - purged_at > self.retention:
+                    purged_at = time.monotonic()
+                    await asyncio.to_thread(
+                        self._execute, "DELETE FROM notifications WHERE created_at < ?",
+                        (time.time() - self.retention,))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"通知バス（SQLite）の読み出しに失敗しました: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+def build_notification_bus(url: str):
+    """
+    NOTIFY_BUS_URL から通知バスを作る。
+    memory:// （既定、プロセス内のみ）/ redis://host:port/db / sqlite:///path/to/bus.db
+    """
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return MemoryBus()
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisBus(url, settings.notify_channel)
+    if scheme == "sqlite":
+        return SQLiteBus(url[len("sqlite:///"):], poll_interval=settings.notify_poll_ms / 1000)
+    raise ValueError(f"未対応の通知バスです: {url}")
+
+
+notification_bus = build_notification_bus(settings.notify_bus_url)
@@ -0,0 +1,140 @@
+# backend/app/config.py
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """環境変数を整数として読み込む（未設定・不正値の場合はデフォルト値）"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """環境変数を真偽値として読み込む（1/true/yes/on を真とみなす）"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class Settings:
+    """環境変数から読み込むアプリケーション設定"""
+
+    def __init__(self):
+        # データベースの接続先（SQLiteのほかPostgreSQLなどSQLAlchemyが対応するURL）
+        self.database_url = os.environ.get("DATABASE_URL", "sqlite:///./app.db")
+        # コネクションプールの大きさ（同時に読み書きするリクエスト・生成スレッドの数に合わせる）
+        self.db_pool_size = _env_int("DB_POOL_SIZE", 10)
+        self.db_max_overflow = _env_int("DB_MAX_OVERFLOW", 20)
+        self.db_pool_timeout = _env_int("DB_POOL_TIMEOUT", 30)
+        # SQLiteの設定: WALモード、ロック待ちの上限（ミリ秒）、メモリマップとページキャッシュの大きさ（MB）
+        self.sqlite_wal = _env_bool("SQLITE_WAL", True)
+        self.sqlite_busy_timeout_ms = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+        self.sqlite_mmap_mb = _env_int("SQLITE_MMAP_MB", 256)
+        self.sqlite_cache_mb = _env_int("SQLITE_CACHE_MB", 64)
+        # 推論ワーカーのジョブキューの最大長
+        self.job_queue_size = _env_int("JOB_QUEUE_SIZE", 32)
+        # マイクロバッチングの待ち時間（ミリ秒）と1回の最大バッチサイズ
+        self.batch_window_ms = _env_int("BATCH_WINDOW_MS", 100)
+        self.max_batch_size = _env_int("MAX_BATCH_SIZE", 4)
+        # プロンプト埋め込みキャッシュのメモリ上限（MB）と起動時の事前計算の有無
+        self.prompt_cache_max_mb = _env_int("PROMPT_CACHE_MAX_MB", 64)
+        self.prompt_cache_prewarm = _env_bool("PROMPT_CACHE_PREWARM", True)
+        # 生成結果キャッシュに保持するエントリ数の上限
+        self.result_cache_max_entries = _env_int("RESULT_CACHE_MAX_ENTRIES", 1024)
+        # デフォルトの生成プロファイルと、クライアントが指定できるステップ数の上限
+        self.default_profile = os.environ.get("DEFAULT_PROFILE", "standard")
+        self.max_inference_steps = _env_int("MAX_INFERENCE_STEPS", 50)
+        # 進捗プレビューを送るステップ間隔（0で無効）、プレビューの一辺の大きさ、
+        # プレビュー生成に使ってよい推論時間の割合（%）
+        self.preview_every = _env_int("PREVIEW_EVERY", 5)
+        self.preview_size = _env_int("PREVIEW_SIZE", 128)
+        self.preview_budget_percent = _env_int("PREVIEW_BUDGET_PERCENT", 3)
+        # プロセスの役割: all（API＋推論）/ api（APIのみ）/ worker（推論のみ）
+        self.app_role = os.environ.get("APP_ROLE", "all")
+        # APIプロセスと推論ワーカープロセスをつなぐローカルキューのアドレス（host:port またはUnixソケットのパス）
+        self.worker_address = os.environ.get("WORKER_ADDRESS", "127.0.0.1:8765")
+        # 接続の認証に使う共有の秘密鍵。受け取ったメッセージはunpickleされるので既定値は持たせず、
+        # api / worker の役割では設定されていなければ起動しない（require_worker_authkey）
+        self.worker_authkey = os.environ.get("WORKER_AUTHKEY", "").encode()
+        # パイプラインを作る関数（"module:callable"）。テストでは偽のパイプラインに差し替えられる
+        self.pipeline_factory = os.environ.get(
+            "PIPELINE_FACTORY", "app.image_generater:load_pipeline")
+        # 推論プールのワーカープロセスごとのデバイス（例: "cuda:0,cuda:1"）。
+        # 空なら推論スレッド1本で動かす
+        self.worker_devices = [
+            d.strip() for d in os.environ.get("WORKER_DEVICES", "").split(",") if d.strip()]
+        # ワーカープロセスのハートビートが途絶えたとみなすまでの秒数と、ジョブの最大試行回数
+        self.worker_heartbeat_timeout = _env_int("WORKER_HEARTBEAT_TIMEOUT", 60)
+        self.job_max_attempts = _env_int("JOB_MAX_ATTEMPTS", 3)
+        # 処理中（待機中・生成中）のジョブの上限。全体とデバイスごと（0なら制限しない）。
+        # 全体の上限は推論ワーカーのキューが満杯になる前に断れるよう、キューの長さ＋バッチ1回分にする
+        self.max_in_flight_jobs = _env_int(
+            "MAX_IN_FLIGHT_JOBS", self.job_queue_size + self.max_batch_size)
+        self.max_in_flight_per_device = _env_int("MAX_IN_FLIGHT_PER_DEVICE", 2)
+        # 完了までの見込み時間: 計測前に使うジョブ1件あたりの処理時間（秒）と、移動平均を取る直近のジョブの件数
+        self.initial_job_seconds = _env_int("INITIAL_JOB_SECONDS", 10)
+        self.job_seconds_window = _env_int("JOB_SECONDS_WINDOW", 32)
+        # GET /jobs/{image_id} のロングポーリングで待てる最大の秒数
+        self.job_max_wait = _env_int("JOB_MAX_WAIT", 60)
+        # キャンバスアップロードのサイズ上限（MB）と、受け付ける画像の一辺の最大ピクセル数
+        self.max_canvas_bytes = _env_int("MAX_CANVAS_MB", 16) * 1024 * 1024
+        self.max_canvas_side = _env_int("MAX_CANVAS_SIDE", 4096)
+        # キャンバスの前処理: none / binarize（二値化）/ edges（エッジ抽出）と、
+        # 解像度への合わせ方 stretch / pad / crop、それぞれのしきい値
+        self.preprocess_mode = os.environ.get("PREPROCESS_MODE", "binarize")
+        self.preprocess_fit = os.environ.get("PREPROCESS_FIT", "pad")
+        self.preprocess_threshold = _env_int("PREPROCESS_THRESHOLD", 200)
+        self.preprocess_edge_threshold = _env_int("PREPROCESS_EDGE_THRESHOLD", 64)
+        # 前処理済みキャンバスのキャッシュのメモリ上限（MB）
+        self.preprocess_cache_max_mb = _env_int("PREPROCESS_CACHE_MAX_MB", 64)
+        # 生成画像とキャンバス画像の保存形式（png / webp / jpeg / avif）と品質、
+        # PNGの圧縮レベル、エンコードに使うスレッド数
+        self.image_format = os.environ.get("IMAGE_FORMAT", "webp")
+        self.image_quality = _env_int("IMAGE_QUALITY", 90)
+        self.canvas_format = os.environ.get("CANVAS_FORMAT", "png")
+        self.canvas_quality = _env_int("CANVAS_QUALITY", 95)
+        self.png_compress_level = _env_int("PNG_COMPRESS_LEVEL", 1)
+        self.encode_workers = _env_int("ENCODE_WORKERS", 2)
+        # サムネイル（派生画像）の長辺のサイズ一覧と、保存形式・品質
+        self.thumbnail_sizes = [
+            int(s) for s in os.environ.get("THUMBNAIL_SIZES", "256,512").split(",") if s.strip().isdigit()]
+        self.thumbnail_format = os.environ.get("THUMBNAIL_FORMAT", "webp")
+        self.thumbnail_quality = _env_int("THUMBNAIL_QUALITY", 80)
+        # サムネイルのETagを覚えておく件数の上限
+        self.thumbnail_etag_cache_entries = _env_int("THUMBNAIL_ETAG_CACHE_ENTRIES", 4096)
+        # お題キャッシュを読み直す間隔（秒）。他のプロセスでの更新を反映するため。0なら無効化されるまで保持
+        self.topic_cache_ttl = _env_int("TOPIC_CACHE_TTL", 300)
+        # /register-devices で1回に登録できるデバイスの最大数
+        self.max_register_devices = _env_int("MAX_REGISTER_DEVICES", 500)
+        # WebSocket通知: 再接続時に再送するためデバイスごとに保持する通知の件数と、保持するデバイス数の上限
+        self.ws_outbox_size = _env_int("WS_OUTBOX_SIZE", 64)
+        self.ws_outbox_devices = _env_int("WS_OUTBOX_DEVICES", 10000)
+        # 接続ごとの送信キューの長さと1回の送信の待ち時間の上限（秒）。超えたクライアントは切断する
+        self.ws_send_queue_size = _env_int("WS_SEND_QUEUE_SIZE", 256)
+        self.ws_send_timeout = _env_int("WS_SEND_TIMEOUT", 10)
+        # pingを送る間隔（秒、0で無効）と、何も受信しない接続を切断するまでの秒数
+        self.ws_heartbeat_interval = _env_int("WS_HEARTBEAT_INTERVAL", 20)
+        self.ws_heartbeat_timeout = _env_int("WS_HEARTBEAT_TIMEOUT", 60)
+        # 通知をプロセス間で配送するバス: memory://（既定、uvicornのワーカーが1つの場合）/
+        # redis://host:port/db / sqlite:///path/to/bus.db（同じホストの複数ワーカー向けの簡易版）
+        self.notify_bus_url = os.environ.get("NOTIFY_BUS_URL", "memory://")
+        # Redisのチャンネル名（シーケンス番号のキーにも使う）と、SQLite版のポーリング間隔（ミリ秒）
+        self.notify_channel = os.environ.get("NOTIFY_CHANNEL", "ai-rakugaki:notifications")
+        self.notify_poll_ms = _env_int("NOTIFY_POLL_MS", 50)
+
+    def require_worker_authkey(self) -> bytes:
+        """APIプロセスと推論ワーカープロセスの接続に使う秘密鍵を返す。未設定ならRuntimeErrorを送出する"""
+        if not self.worker_authkey:
+            raise RuntimeError(
+                f"APP_ROLE={self.app_role} では、APIプロセスと推論ワーカープロセスで共有する秘密鍵を"
+                "WORKER_AUTHKEYに設定してください。")
+        return self.worker_authkey
+
+
+settings = Settings()
@@ -1,23 +1,39 @@
 # backend/app/crud.py
 
+import base64
 import datetime
-import random
 import uuid
-from typing import List, Optional
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Sequence,
+                    Tuple)
 
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
+from sqlalchemy import Select, Update, desc, event, func, select, tuple_, update
+from sqlalchemy.orm import Session, selectinload
 
 from . import models, schemas
+from .prompt_cache import embedding_cache
+from .topic_cache import CachedTopic, topic_cache
+
+# 作成・更新を行う関数はセッションにflushするだけで、コミットは呼び出し側（リクエストごとに1回）で行う。
+# IDや作成日時はクライアント側で決めるので、flush後にrefreshで読み直す必要はない。
+
+
+class NoTopicError(LookupError):
+    """割り当てられるお題が1つも無い場合に送出される"""
+
+
+def on_commit(db: Session, callback: Callable[[], None]):
+    """
+    セッションのコミットが完了した後にcallbackを1回呼ぶ。
+    コミット前にキャッシュを無効化すると、他のセッションが変更前の内容を読み直してしまうため。
+    """
+    event.listen(db, "after_commit", lambda session: callback(), once=True)
 
 
 def create_device(db: Session) -> models.Device:
     """新しいデバイスを作成し、デバイスIDを生成する"""
-    unique_id = str(uuid.uuid4())
-    db_device = models.Device(id=unique_id)
+    db_device = models.Device(id=str(uuid.uuid4()), created_at=datetime.datetime.utcnow())
     db.add(db_device)
-    db.commit()
-    db.refresh(db_device)
+    db.flush()
     return db_device
 
 
@@ -33,34 +49,67 @@ def create_topic(db: Session, topic: schemas.TopicCreate) -> models.Topic:
         id=topic_id,
         name=topic.name,
         prompt=topic.prompt,
-        negative_prompt=topic.negative_prompt
+        negative_prompt=topic.negative_prompt,
+        profile=topic.profile,
+        weight=topic.weight
     )
     db.add(db_topic)
-    db.commit()
-    db.refresh(db_topic)
+    db.flush()
+    on_commit(db, topic_cache.invalidate)
     return db_topic
 
 
-def get_random_topic(db: Session) -> Optional[models.Topic]:
-    """ランダムなお題を取得する"""
-    topics = db.query(models.Topic).all()
-    if not topics:
+def update_topic(db: Session, topic_id: str, topic: schemas.TopicCreate) -> Optional[models.Topic]:
+    """既存のトピックを更新し、コミット後にお題キャッシュと古いプロンプトの埋め込みキャッシュを無効化する"""
+    db_topic = db.query(models.Topic).filter(
+        models.Topic.id == topic_id).first()
+    if not db_topic:
         return None
-    return random.choice(topics)
+    old_prompt, old_negative_prompt = db_topic.prompt, db_topic.negative_prompt
+    db_topic.name = topic.name
+    db_topic.prompt = topic.prompt
+    db_topic.negative_prompt = topic.negative_prompt
+    db_topic.profile = topic.profile
+    db_topic.weight = topic.weight
+    db.flush()
 
+    def invalidate():
+        topic_cache.invalidate()
+        embedding_cache.invalidate(old_prompt, old_negative_prompt)
 
-def create_image(db: Session, image: schemas.ImageCreate) -> models.Image:
-    """新しい画像エントリを作成する"""
-    image_id = str(uuid.uuid4())
-    db_image = models.Image(
-        id=image_id,
+    on_commit(db, invalidate)
+    return db_topic
+
+
+def get_topics(db: Session) -> List[models.Topic]:
+    """全てのトピックを取得する"""
+    return db.query(models.Topic).all()
+
+
+def get_random_topic(db: Session) -> Optional[CachedTopic]:
+    """
+    重みに比例した確率でお題を1つ選ぶ。
+    お題一覧はtopic_cacheに保持され、キャッシュが有効な間はデータベースを読まない。
+    """
+    return topic_cache.choose(db)
+
+
+def new_image(image: schemas.ImageCreate) -> models.Image:
+    """画像エントリのオブジェクトを作る（IDとリクエスト日時はここで決める）"""
+    return models.Image(
+        id=str(uuid.uuid4()),
         device_id=image.device_id,
         topic_id=image.topic_id,
-        negative_prompt=image.negative_prompt
+        negative_prompt=image.negative_prompt,
+        request_time=datetime.datetime.utcnow()
     )
+
+
+def create_image(db: Session, image: schemas.ImageCreate) -> models.Image:
+    """新しい画像エントリを作成する"""
+    db_image = new_image(image)
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    db.flush()
     return db_image
 
 
@@ -72,8 +121,7 @@ def update_generated_image(
         models.Image.id == image_id).first()
     if db_image:
         db_image.generated_image_filename = generated_image_filename
-        db.commit()
-        db.refresh(db_image)
+        db.flush()
     return db_image
 
 
@@ -88,5 +136,213 @@ def get_latest_image(db: Session, device_id: str) -> Optional[models.Image]:
 
 
 def get_images_by_device(db: Session, device_id: str) -> List[models.Image]:
-    """指定されたデバイスIDに関連する全ての画像を取得する"""
-    return db.query(models.Image).filter(models.Image.device_id == device_id).order_by(desc(models.Image.request_time)).all()
+    """指定されたデバイスIDに関連する全ての画像を取得する（お題はまとめて1回のクエリで読み込む）"""
+    return (
+        db.query(models.Image)
+        .options(selectinload(models.Image.topic))
+        .filter(models.Image.device_id == device_id)
+        .order_by(desc(models.Image.request_time), desc(models.Image.id))
+        .all()
+    )
+
+
+def new_job(job, status: str = models.JOB_QUEUED) -> models.Job:
+    """GenerationJob からジョブの記録を作る（完了済みで作る場合は終了日時も入れる）"""
+    now = datetime.datetime.utcnow()
+    finished = status not in models.UNFINISHED_JOB_STATUSES
+    return models.Job(
+        id=job.job_id,
+        image_id=job.image_id,
+        device_id=job.device_id,
+        status=status,
+        attempts=job.attempts,
+        profile=job.profile,
+        cache_key=job.cache_key,
+        canvas_digest=job.canvas_digest,
+        created_at=now,
+        finished_at=now if finished else None,
+    )
+
+
+def mark_jobs_running(db: Session, job_ids: List[str]):
+    """ジョブを処理中にし、試行回数を増やす"""
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id.in_(job_ids))
+        .values(status=models.JOB_RUNNING, attempts=models.Job.attempts + 1,
+                started_at=datetime.datetime.utcnow(), error=None)
+    )
+
+
+def finish_job(db: Session, job_id: str, error: Optional[str] = None):
+    """
+    ジョブを成功（errorがNone）または失敗で終える。
+    既に終わっているジョブは変更しないので、推論ワーカーとAPIの両方から記録しても最初の結果が残る。
+    """
+    db.execute(finish_job_query(job_id, error))
+
+
+def finish_job_query(job_id: str, error: Optional[str] = None) -> Update:
+    return (
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status.in_(models.UNFINISHED_JOB_STATUSES))
+        .values(status=models.JOB_FAILED if error else models.JOB_SUCCEEDED,
+                error=error, finished_at=datetime.datetime.utcnow())
+    )
+
+
+def get_unfinished_jobs(db: Session) -> List[models.Job]:
+    """
+    待機中・処理中のジョブを登録順に取得する。
+    status IN (...) だと完了済みのジョブを含む全件走査になりやすいため、状態ごとに (status, created_at) の
+    インデックスで取得してから並べ替える。
+    """
+    jobs = []
+    for status in models.UNFINISHED_JOB_STATUSES:
+        jobs += db.scalars(
+            select(models.Job)
+            .where(models.Job.status == status)
+            .order_by(models.Job.created_at)
+        )
+    return sorted(jobs, key=lambda job: job.created_at)
+
+
+def latest_job_query(image_id: str) -> Select:
+    """画像エントリの最新のジョブと、生成画像のファイル名を取得するクエリ"""
+    return (
+        select(models.Job, models.Image.generated_image_filename)
+        .join(models.Image, models.Image.id == models.Job.image_id)
+        .where(models.Job.image_id == image_id)
+        .order_by(desc(models.Job.created_at))
+        .limit(1)
+    )
+
+
+class InvalidCursorError(ValueError):
+    """ページネーションのカーソルが不正な場合に送出される"""
+
+
+def encode_cursor(timestamp: datetime.datetime, row_id: str) -> str:
+    """(日時, id) をクライアントに渡す不透明なカーソルに変換する"""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        request_time, image_id = raw.split("|", 1)
+        return datetime.datetime.fromisoformat(request_time), image_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursorError(f"カーソルが不正です: {cursor}") from e
+
+
+def images_page_query(device_id: str, limit: int, cursor: Optional[str] = None) -> Select:
+    """
+    指定されたデバイスIDの画像を新しい順に（次のページの有無を判定するため）limit+1件取得するクエリ。
+    同期版と非同期版（crud_async）で共有する。
+    """
+    query = (
+        select(models.Image)
+        .options(selectinload(models.Image.topic))
+        .where(models.Image.device_id == device_id)
+    )
+    if cursor:
+        request_time, image_id = decode_cursor(cursor)
+        query = query.where(tuple_(models.Image.request_time, models.Image.id) < (request_time, image_id))
+    return query.order_by(desc(models.Image.request_time), desc(models.Image.id)).limit(limit + 1)
+
+
+def split_images_page(images: Sequence[models.Image], limit: int) -> Tuple[List[models.Image], Optional[str]]:
+    """limit+1件の取得結果を、そのページの画像と次のページのカーソルに分ける"""
+    next_cursor = None
+    if len(images) > limit:
+        last = images[limit - 1]
+        next_cursor = encode_cursor(last.request_time, last.id)
+    return list(images[:limit]), next_cursor
+
+
+def get_images_page(
+    db: Session, device_id: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[models.Image], Optional[str]]:
+    """
+    指定されたデバイスIDの画像を新しい順に最大limit件取得し、次のページのカーソルと共に返す。
+    (request_time, id) の行値比較によるキーセットページネーションで、インデックスをカーソルの位置から
+    範囲検索するため、深いページでもそれより前のページの行は読まない。
+    お題はselectinloadでページごとに1回のクエリでまとめて読み込む。
+    """
+    images = db.execute(images_page_query(device_id, limit, cursor)).scalars().all()
+    return split_images_page(images, limit)
+
+
+def device_page_query(limit: int, cursor: Optional[str] = None) -> Select:
+    """デバイスを登録順に（次のページの有無を判定するため）limit+1件取得するクエリ"""
+    query = select(models.Device.id, models.Device.created_at)
+    if cursor:
+        created_at, device_id = decode_cursor(cursor)
+        query = query.where(tuple_(models.Device.created_at, models.Device.id) > (created_at, device_id))
+    return query.order_by(models.Device.created_at, models.Device.id).limit(limit + 1)
+
+
+def device_stats_query(device_ids: List[str]) -> Select:
+    """指定したデバイスの画像の枚数と最新のリクエスト日時を1回で集計するクエリ"""
+    return (
+        select(models.Image.device_id, func.count(models.Image.id),
+               func.max(models.Image.request_time))
+        .where(models.Image.device_id.in_(device_ids))
+        .group_by(models.Image.device_id)
+    )
+
+
+def to_device_summaries(
+    devices: Sequence[Any], stats: Dict[str, Tuple[int, Optional[datetime.datetime]]]
+) -> List[schemas.DeviceSummary]:
+    return [
+        schemas.DeviceSummary(
+            id=d.id,
+            created_at=d.created_at,
+            image_count=stats.get(d.id, (0, None))[0],
+            latest_request_time=stats.get(d.id, (0, None))[1],
+        )
+        for d in devices
+    ]
+
+
+def split_device_page(devices: Sequence[Any], limit: int) -> Tuple[Sequence[Any], Optional[str]]:
+    """limit+1件の取得結果を、そのページのデバイスと次のページのカーソルに分ける"""
+    if len(devices) > limit:
+        devices = devices[:limit]
+        return devices, encode_cursor(devices[-1].created_at, devices[-1].id)
+    return devices, None
+
+
+def get_device_summaries(
+    db: Session, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[schemas.DeviceSummary], Optional[str]]:
+    """
+    デバイスを登録順に最大limit件取得し、画像の枚数と最新のリクエスト日時を集計して返す。
+    (created_at, id) によるキーセットページネーションで、画像やお題のリレーションは読み込まない。
+    """
+    devices, next_cursor = split_device_page(db.execute(device_page_query(limit, cursor)).all(), limit)
+    if not devices:
+        return [], None
+
+    # ページ内のデバイスの画像だけを1回の集計クエリで数える
+    stats = {
+        device_id: (count, latest)
+        for device_id, count, latest in db.execute(device_stats_query([d.id for d in devices]))
+    }
+    return to_device_summaries(devices, stats), next_cursor
+
+
+def iter_device_summaries(
+    db: Session, batch_size: int = 500, cursor: Optional[str] = None
+) -> Iterator[schemas.DeviceSummary]:
+    """全デバイスの集計をbatch_size件ずつ読み込みながら順に返す（メモリ使用量はバッチサイズで頭打ちになる）"""
+    while True:
+        summaries, cursor = get_device_summaries(db, batch_size, cursor)
+        yield from summaries
+        # 読み込んだ行をセッションに溜め込まない
+        db.expunge_all()
+        if cursor is None:
+            return
@@ -0,0 +1,156 @@
+# backend/app/crud_async.py
+
+import datetime
+import uuid
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import crud, models, schemas
+from .topic_cache import CachedTopic, topic_cache
+
+# リクエストハンドラ用の非同期版。クエリの組み立てとカーソルの処理はcrudと共有する。
+# crudと同じく作成・更新はflushまでで、コミットはハンドラがリクエストごとに1回行う。
+# 非同期セッションでは遅延読み込みができないので、レスポンスで使うリレーション（お題）は先に読み込んでおく。
+
+
+async def create_device(db: AsyncSession) -> models.Device:
+    """新しいデバイスを作成する"""
+    db_device = models.Device(id=str(uuid.uuid4()), created_at=datetime.datetime.utcnow())
+    db.add(db_device)
+    await db.flush()
+    return db_device
+
+
+async def register_devices(
+    db: AsyncSession, count: int
+) -> List[Tuple[models.Device, models.Image, CachedTopic]]:
+    """
+    count台のデバイスと、それぞれにランダムなお題を割り当てた最初の画像エントリを作成する。
+    全ての行を1回のflushでまとめて挿入する。お題が1つも無ければNoTopicErrorを送出する。
+    """
+    topics = await db.run_sync(lambda session: [topic_cache.choose(session) for _ in range(count)])
+    if not topics or topics[0] is None:
+        raise crud.NoTopicError("割り当てられるお題がありません。")
+    now = datetime.datetime.utcnow()
+    registered = []
+    for topic in topics:
+        db_device = models.Device(id=str(uuid.uuid4()), created_at=now)
+        db_image = crud.new_image(schemas.ImageCreate(
+            device_id=db_device.id,
+            topic_id=topic.id,
+            negative_prompt=topic.negative_prompt
+        ))
+        registered.append((db_device, db_image, topic))
+    db.add_all([device for device, _, _ in registered])
+    db.add_all([image for _, image, _ in registered])
+    await db.flush()
+    return registered
+
+
+async def get_device(db: AsyncSession, device_id: str) -> Optional[models.Device]:
+    """デバイスIDからデバイスを取得する"""
+    return await db.get(models.Device, device_id)
+
+
+async def get_random_topic(db: AsyncSession) -> Optional[CachedTopic]:
+    """重みに比例した確率でお題を1つ選ぶ（キャッシュが有効な間はデータベースを読まない）"""
+    return await db.run_sync(topic_cache.choose)
+
+
+async def create_image(db: AsyncSession, image: schemas.ImageCreate) -> models.Image:
+    """新しい画像エントリを作成する（お題は読み込まないので、レスポンスにはキャッシュのお題を使う）"""
+    db_image = crud.new_image(image)
+    db.add(db_image)
+    await db.flush()
+    return db_image
+
+
+async def update_generated_image(
+    db: AsyncSession, image_id: str, generated_image_filename: str
+) -> Optional[models.Image]:
+    """生成後の画像ファイル名を更新する"""
+    db_image = await db.get(models.Image, image_id)
+    if db_image:
+        db_image.generated_image_filename = generated_image_filename
+        await db.flush()
+    return db_image
+
+
+async def create_job(db: AsyncSession, job, status: str = models.JOB_QUEUED) -> models.Job:
+    """ジョブの記録を作成する"""
+    db_job = crud.new_job(job, status)
+    db.add(db_job)
+    await db.flush()
+    return db_job
+
+
+async def finish_job(db: AsyncSession, job_id: str, error: Optional[str] = None):
+    """crud.finish_job の非同期版"""
+    await db.execute(crud.finish_job_query(job_id, error))
+
+
+async def get_latest_job(db: AsyncSession, image_id: str) -> Optional[Tuple[models.Job, Optional[str]]]:
+    """画像エントリの最新のジョブと生成画像のファイル名を取得する（ジョブが無ければNone）"""
+    row = (await db.execute(crud.latest_job_query(image_id))).first()
+    return tuple(row) if row else None
+
+
+async def get_image_by_id(db: AsyncSession, image_id: str) -> Optional[models.Image]:
+    """指定された画像IDの画像をお題と共に取得する"""
+    result = await db.execute(
+        select(models.Image)
+        .options(selectinload(models.Image.topic))
+        .where(models.Image.id == image_id)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_latest_image(db: AsyncSession, device_id: str) -> Optional[models.Image]:
+    """指定されたデバイスIDの最新の画像をお題と共に取得する"""
+    result = await db.execute(
+        select(models.Image)
+        .options(selectinload(models.Image.topic))
+        .where(models.Image.device_id == device_id)
+        .order_by(desc(models.Image.request_time))
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_images_page(
+    db: AsyncSession, device_id: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[models.Image], Optional[str]]:
+    """crud.get_images_page の非同期版"""
+    result = await db.execute(crud.images_page_query(device_id, limit, cursor))
+    return crud.split_images_page(result.scalars().all(), limit)
+
+
+async def get_device_summaries(
+    db: AsyncSession, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[schemas.DeviceSummary], Optional[str]]:
+    """crud.get_device_summaries の非同期版"""
+    result = await db.execute(crud.device_page_query(limit, cursor))
+    devices, next_cursor = crud.split_device_page(result.all(), limit)
+    if not devices:
+        return [], None
+    stats = {
+        device_id: (count, latest)
+        for device_id, count, latest in await db.execute(
+            crud.device_stats_query([d.id for d in devices]))
+    }
+    return crud.to_device_summaries(devices, stats), next_cursor
+
+
+async def iter_device_summaries(
+    db: AsyncSession, batch_size: int = 500, cursor: Optional[str] = None
+) -> AsyncIterator[schemas.DeviceSummary]:
+    """crud.iter_device_summaries の非同期版"""
+    while True:
+        summaries, cursor = await get_device_summaries(db, batch_size, cursor)
+        for summary in summaries:
+            yield summary
+        if cursor is None:
+            return
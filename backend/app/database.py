@@ -2,19 +2,106 @@
 
 from pathlib import Path
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# データベースURLの設定（SQLiteを使用）
-DATABASE_URL = "sqlite:///./app.db"
+from .config import settings
 
-# エンジンの作成
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  # SQLite特有の設定
-    pool_pre_ping=True  # 接続の健全性を確認
-)
+# データベースURLの設定（環境変数DATABASE_URL、未設定ならSQLite）
+DATABASE_URL = settings.database_url
+
+
+def is_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite"
+
+
+# 非同期エンジンで使うドライバ（DATABASE_URLの同期ドライバから置き換える）
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def to_async_url(url: URL) -> URL:
+    """同期ドライバのURLを、同じデータベースに接続する非同期ドライバのURLに変換する"""
+    if url.get_driver_name() in ("aiosqlite", "asyncpg", "psycopg"):
+        return url
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"非同期ドライバが不明なデータベースです: {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def _is_sqlite_memory(url: URL) -> bool:
+    return url.database in (None, "", ":memory:") or "mode=memory" in str(url)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    SQLiteの接続ごとに設定を適用する。
+    WALモードでは読み込みが書き込みを待たなくなり、synchronous=NORMALでコミットごとのfsyncを減らす。
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if settings.sqlite_wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_mb) * 1024 * 1024}")
+        # 負の値はKiB単位での指定
+        cursor.execute(f"PRAGMA cache_size={-int(settings.sqlite_cache_mb) * 1024}")
+    finally:
+        cursor.close()
+
+
+def _engine_options(url: URL) -> dict:
+    options = {"pool_pre_ping": True}  # 接続の健全性を確認
+    if is_sqlite(url):
+        # SQLite特有の設定（複数のスレッドから同じ接続を使う）
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout_ms / 1000,
+        }
+        if _is_sqlite_memory(url):
+            return options
+        Path(url.database).parent.mkdir(parents=True, exist_ok=True)
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+    )
+    return options
+
+
+def build_engine(database_url: str) -> Engine:
+    """
+    設定に従ってエンジンを作成する。
+    SQLiteのファイルデータベースでは接続ごとにプラグマを適用し、保存先のディレクトリも作る。
+    PostgreSQLなどではコネクションプールの設定だけを渡す。
+    """
+    url = make_url(database_url)
+    engine = create_engine(url, **_engine_options(url))
+    if is_sqlite(url) and not _is_sqlite_memory(url):
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
+def build_async_engine(database_url: str) -> AsyncEngine:
+    """
+    build_engineと同じ設定の非同期エンジンを作成する（SQLiteはaiosqlite、PostgreSQLはasyncpg）。
+    リクエストハンドラはこちらを使い、スレッドプールを占有せずにイベントループ上で待つ。
+    """
+    url = to_async_url(make_url(database_url))
+    engine = create_async_engine(url, **_engine_options(url))
+    if is_sqlite(url) and not _is_sqlite_memory(url):
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
+# エンジンの作成（同期エンジンは推論ワーカーのスレッドと初期化処理、非同期エンジンはリクエストハンドラで使う）
+engine = build_engine(DATABASE_URL)
+async_engine = build_async_engine(DATABASE_URL)
 
 # セッションローカルの作成
 SessionLocal = sessionmaker(
@@ -22,6 +109,13 @@ SessionLocal = sessionmaker(
     autoflush=False,
     bind=engine
 )
+# コミット後も属性を読めるよう（読み直しのためのI/Oを起こさないよう）期限切れにしない
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 # ベースクラスの定義
 Base = declarative_base()
@@ -29,7 +123,10 @@ Base = declarative_base()
 # 画像保存用ディレクトリの定義
 saved_images_dir = Path("saved-images")
 generated_images_dir = Path("generated-images")
+# サムネイルなどの派生画像の保存先
+derivatives_dir = Path("derivatives")
 
 # ディレクトリが存在しない場合は作成
 saved_images_dir.mkdir(parents=True, exist_ok=True)
 generated_images_dir.mkdir(parents=True, exist_ok=True)
+derivatives_dir.mkdir(parents=True, exist_ok=True)
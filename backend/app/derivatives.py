@@ -0,0 +1,156 @@
+# backend/app/derivatives.py
+
+import datetime
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from . import database, utils
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 派生画像の元になる画像の種類と、その保存先ディレクトリ
+SOURCES: Dict[str, Path] = {
+    "generated": database.generated_images_dir,
+    "canvas": database.saved_images_dir,
+}
+
+
+class UnknownDerivativeError(LookupError):
+    """存在しない種類・サイズの派生画像が要求された場合に送出される"""
+
+
+# 作成中の派生画像ごとのロックと、それを使っているスレッドの数（誰も使わなくなったら消す）
+_locks: Dict[str, List] = {}
+_locks_lock = threading.Lock()
+# 派生画像のETag（パス → (更新時刻, ETag)）。最近使ったものから上限件数まで保持する
+_etags: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+_etags_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """同じ派生画像を複数のスレッドが同時に作らないようにする"""
+    key = str(path)
+    with _locks_lock:
+        entry = _locks.get(key)
+        if entry is None:
+            entry = _locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[key]
+
+
+def derivative_path(kind: str, filename: str, size: int) -> Path:
+    """派生画像の保存先（derivatives/<種類>/<サイズ>/<元画像の名前>.<形式>）"""
+    ext = utils.IMAGE_FORMATS[utils.thumbnail_format][1]
+    return database.derivatives_dir / kind / str(size) / f"{Path(filename).stem}{ext}"
+
+
+def source_path(kind: str, filename: str) -> Path:
+    if kind not in SOURCES:
+        raise UnknownDerivativeError(f"不明な画像の種類です: {kind}")
+    # パス区切りを含むファイル名で保存先ディレクトリの外を参照させない
+    if Path(filename).name != filename or filename.startswith("."):
+        raise UnknownDerivativeError(f"不正なファイル名です: {filename}")
+    return SOURCES[kind] / filename
+
+
+def _write(image: Image.Image, path: Path, size: int):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    utils.write_image(thumbnail, path, utils.thumbnail_format, settings.thumbnail_quality)
+
+
+def generate_all(kind: str, filename: str, image: Image.Image):
+    """
+    生成直後の画像から、設定された全サイズの派生画像を作る。
+    元画像をディスクから読み直さずに済むよう、メモリ上の画像を受け取る。
+    """
+    for size in settings.thumbnail_sizes:
+        path = derivative_path(kind, filename, size)
+        try:
+            with _locked(path):
+                _write(image, path, size)
+        except Exception as e:
+            logger.exception(f"派生画像の作成に失敗しました: {path}, {e}")
+
+
+def ensure(kind: str, filename: str, size: int) -> Path:
+    """
+    派生画像のパスを返す。まだ無いか、元画像の方が新しければ（キャンバスの描き直しなど）作り直して保存する。
+    元画像が無ければFileNotFoundErrorを送出する。
+    """
+    if size not in settings.thumbnail_sizes:
+        raise UnknownDerivativeError(f"対応していないサイズです: {size}")
+    source = source_path(kind, filename)
+    if kind == "canvas":
+        utils.wait_canvas_written(source)
+    source_mtime = source.stat().st_mtime_ns
+    path = derivative_path(kind, filename, size)
+    with _locked(path):
+        if not path.exists() or path.stat().st_mtime_ns < source_mtime:
+            with Image.open(source) as image:
+                image.load()
+                _write(image, path, size)
+            logger.info(f"派生画像を作成しました: {path}")
+    return path
+
+
+def etag_for(path: Path) -> str:
+    """派生画像の内容から強いETagを求める（更新時刻が変わらない限り計算し直さない）"""
+    key = str(path)
+    mtime = path.stat().st_mtime_ns
+    with _etags_lock:
+        cached = _etags.get(key)
+        if cached and cached[0] == mtime:
+            _etags.move_to_end(key)
+            return cached[1]
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:32]
+    etag = f'"{digest}"'
+    with _etags_lock:
+        _etags[key] = (mtime, etag)
+        _etags.move_to_end(key)
+        while len(_etags) > settings.thumbnail_etag_cache_entries:
+            _etags.popitem(last=False)
+    return etag
+
+
+def media_type() -> str:
+    return f"image/{utils.thumbnail_format}"
+
+
+def source_version(kind: str, updated_at: Optional[datetime.datetime]) -> Optional[str]:
+    """
+    キャンバスのように同じファイル名で描き直される画像について、URLに付けるバージョンを
+    データベースに記録した保存日時から求める（レスポンスの組み立て中にディスクを読まない）。
+    生成画像はファイル名が毎回異なるのでバージョンは不要。保存日時が無ければ（古いエントリ）付けない。
+    """
+    if kind != "canvas" or updated_at is None:
+        return None
+    return updated_at.strftime("%Y%m%d%H%M%S%f")
+
+
+def thumbnail_urls(kind: str, filename: Optional[str],
+                   updated_at: Optional[datetime.datetime] = None) -> Dict[str, str]:
+    """ImageResponseに含める派生画像のURL（サイズ → URL）"""
+    if not filename:
+        return {}
+    version = source_version(kind, updated_at)
+    query = f"?v={version}" if version else ""
+    return {str(size): f"/thumbnails/{kind}/{size}/{filename}{query}"
+            for size in settings.thumbnail_sizes}
@@ -0,0 +1,63 @@
+# backend/app/dispatcher.py
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from . import generation
+from .admission import admission_controller
+from .result_cache import result_cache
+from .worker import GenerationJob, JobResult
+
+logger = logging.getLogger(__name__)
+
+
+class JobDispatcher:
+    """
+    推論ワーカー（同一プロセス内・別プロセスのどちらでも）から届いたジョブのイベントと結果を
+    WebSocketへ配送する。結果キャッシュの更新と、相乗りしているジョブへのファンアウト、
+    処理中のジョブの登録の解除（処理時間の計測）もここで行う。
+    """
+
+    def __init__(self, send: Callable[[str, dict], Awaitable[None]]):
+        self._send = send
+
+    async def on_event(self, job: GenerationJob, payload: dict):
+        """進捗・プレビューのイベントを、ジョブと相乗りしているジョブのデバイスへ送る"""
+        for target in [job, *result_cache.followers_of(job.cache_key)]:
+            await self._send(target.device_id, {**payload, "imageId": target.image_id})
+
+    async def on_result(self, result: JobResult):
+        """ジョブの結果を結果キャッシュとジョブの記録に反映し、完了（失敗）通知を送る"""
+        job = result.job
+        loop = asyncio.get_running_loop()
+        if result.filename is None:
+            followers = result_cache.fail(job.cache_key)
+            admission_controller.complete(job.job_id, succeeded=False)
+            for follower in followers:
+                admission_controller.release(follower.job_id)
+                logger.error(
+                    f"相乗り元のジョブが失敗しました: image_id={follower.image_id}, job_id={job.job_id}")
+            # 推論ワーカーが記録できずに終わった場合（プロセスの異常終了など）に備えて、ここでも記録する
+            error = result.error or "画像の生成に失敗しました。"
+            await loop.run_in_executor(None, generation.record_job_failures, [job, *followers], error)
+            for target in [job, *followers]:
+                await self._send(target.device_id, {
+                    "type": "failed", "imageId": target.image_id, "jobId": target.job_id, "error": error})
+            return
+
+        followers = result_cache.complete(job.cache_key, result.filename)
+        admission_controller.complete(job.job_id, succeeded=True)
+        if result.notification:
+            await self._send(job.device_id, result.notification)
+            logger.info(f"WebSocket経由で通知を送信しました: device_id={job.device_id}")
+
+        for follower in followers:
+            admission_controller.release(follower.job_id)
+            # 相乗りしていた画像エントリにも同じ生成画像を割り当てる
+            notification = await loop.run_in_executor(
+                None, generation.assign_result, follower.image_id, result.filename, follower.job_id)
+            if notification:
+                await self._send(follower.device_id, notification)
+                logger.info(
+                    f"相乗りしていたジョブに通知を送信しました: device_id={follower.device_id}")
@@ -0,0 +1,347 @@
+# backend/app/generation.py
+
+import logging
+import os
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from . import crud, database, derivatives, utils
+from .batcher import GenerationParams, GenerationRequest, MicroBatcher
+from .model_loader import model_loader
+from .preprocess import canvas_preprocessor
+from .profiles import GenerationProfile, resolve_profile
+from .progress import make_reporter
+from .prompt_cache import embedding_cache
+from .result_cache import compute_result_key
+from .worker import GenerationJob, JobResult, PendingResult
+
+logger = logging.getLogger(__name__)
+
+
+def generation_params(profile: GenerationProfile) -> GenerationParams:
+    """生成プロファイルからパイプラインに渡すサンプリングパラメータを作る"""
+    return GenerationParams(
+        num_inference_steps=profile.num_inference_steps,
+        guidance_scale=profile.guidance_scale,
+        adapter_conditioning_scale=profile.adapter_conditioning_scale,
+        width=profile.width,
+        height=profile.height,
+        scheduler=profile.scheduler,
+    )
+
+
+def sampling_params(profile: GenerationProfile) -> Dict[str, Any]:
+    """結果キャッシュのキーに含めるサンプリングパラメータ"""
+    params = asdict(generation_params(profile))
+    params["seed"] = None
+    params["preprocess"] = canvas_preprocessor.signature
+    return params
+
+
+def prepare_canvas(image: Image.Image, profile: GenerationProfile,
+                   digest: Optional[str] = None) -> Image.Image:
+    """
+    キャンバスをアダプターの入力（プロファイルの解像度・二値化やエッジ抽出などの前処理済み）に揃える。
+    digestを渡すと、同じキャンバスの前処理結果をキャッシュから再利用する。
+    """
+    return canvas_preprocessor(image, profile.width, profile.height, digest)
+
+
+def result_key_for(db_image, canvas_digest: str, profile: GenerationProfile) -> str:
+    """画像エントリとキャンバスのダイジェストから結果キャッシュのキーを求める"""
+    return compute_result_key(
+        canvas_digest,
+        prompt=db_image.topic.prompt,
+        negative_prompt=db_image.negative_prompt or "",
+        params=sampling_params(profile),
+    )
+
+
+def build_notification(db_image, generated_image_filename: str) -> dict:
+    """WebSocket通知用の辞書を組み立てる"""
+    generated_image_url = f"http://localhost:8000/generated-images/{generated_image_filename}"
+    canvas_image_url = f"http://localhost:8000/saved-images/{db_image.canvas_image_filename}"
+    topic = db_image.topic.name if db_image.topic else ""
+
+    return {
+        "type": "completed",
+        "imageId": db_image.id,
+        "canvasImageUrl": canvas_image_url,
+        "generatedImageUrl": generated_image_url,
+        "topic": topic,
+    }
+
+
+def prepare_request(db: Session, job) -> Optional[GenerationRequest]:
+    """ジョブに対応する画像エントリとキャンバス画像を読み込み、生成リクエストを組み立てる"""
+    db_image = crud.get_image_by_id(db, job.image_id)
+    if not db_image:
+        logger.error(f"画像ID {job.image_id} に対応する画像が見つかりません。")
+        return None
+    if not db_image.topic:
+        logger.error(f"画像ID {job.image_id} に対応するトピックが見つかりません。")
+        return None
+
+    prompt = db_image.topic.prompt
+    negative_prompt = db_image.negative_prompt or ""
+    logger.info(f"画像生成開始: image_id={job.image_id}, prompt={prompt}")
+
+    # リクエスト、お題、サーバーデフォルトの順にプロファイルを決める
+    profile = resolve_profile(job.profile, db_image.topic.profile)
+
+    if job.canvas is not None:
+        # save_canvas でデコード・リサイズ済みのキャンバスをそのまま使う
+        image, job.canvas = job.canvas, None
+    else:
+        # 再起動後の再投入や別プロセスの推論ワーカーではディスクから読み込む
+        image = load_canvas(db_image, profile, job.canvas_digest)
+        if image is None:
+            return None
+
+    return GenerationRequest(
+        job=job,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        image=image,
+        params=generation_params(profile),
+    )
+
+
+def load_canvas(db_image, profile: GenerationProfile, digest: Optional[str] = None) -> Optional[Image.Image]:
+    """
+    保存済みのキャンバス画像をディスクから読み込み、アダプターの入力に揃える。
+    同じキャンバスの前処理結果がキャッシュにあればディスクを読まない。
+    """
+    cached = canvas_preprocessor.lookup(digest, profile.width, profile.height)
+    if cached is not None:
+        return cached
+
+    canvas_file_path = os.path.join(
+        database.saved_images_dir, db_image.canvas_image_filename)
+    # 非同期の書き込みが終わっていなければ待つ
+    utils.wait_canvas_written(canvas_file_path)
+    if not os.path.exists(canvas_file_path):
+        logger.error(f"キャンバス画像ファイルが存在しません: {canvas_file_path}")
+        return None
+
+    # キャンバス画像を開く
+    try:
+        with Image.open(canvas_file_path) as image:
+            image.load()
+            return prepare_canvas(image, profile, digest)
+    except Exception as e:
+        logger.exception(f"キャンバス画像の読み込みに失敗しました: {e}")
+        return None
+
+
+def finalize_request(request: GenerationRequest, gen_image: Image.Image) -> JobResult:
+    """
+    生成画像をエンコードして保存し、データベースを更新してジョブの結果を返す。
+    推論スレッドではなくエンコード用のスレッドで実行されるので、専用のセッションを使う。
+    結果（通知）はファイルが完全に書き込まれてから返る。
+    """
+    result = save_result(request, gen_image)
+    if result.error:
+        record_job_failures([result.job], result.error)
+    return result
+
+
+def save_result(request: GenerationRequest, gen_image: Image.Image) -> JobResult:
+    """生成画像を保存し、画像エントリとジョブの記録を1つのトランザクションで更新する"""
+    job = request.job
+    try:
+        generated_file_path = utils.save_generated_image(
+            gen_image, database.generated_images_dir)
+        if not generated_file_path:
+            logger.error("生成画像の保存に失敗しました。")
+            return JobResult(job=job, error="生成画像の保存に失敗しました。")
+        # サムネイルは通知を遅らせないよう、別のタスクとしてメモリ上の生成画像から作る
+        utils.encode_async(derivatives.generate_all, "generated",
+                           generated_file_path.name, gen_image)
+
+        # データベースを更新
+        db = database.SessionLocal()
+        try:
+            db_image = crud.update_generated_image(
+                db, job.image_id, generated_file_path.name)
+            if not db_image:
+                logger.error(f"画像ID {job.image_id} の更新に失敗しました。")
+                return JobResult(job=job, error="画像エントリの更新に失敗しました。")
+            crud.finish_job(db, job.job_id)
+            # コミットで属性が期限切れになる前に通知を組み立てる（読み直しのSELECTを省く）
+            notification = build_notification(db_image, generated_file_path.name)
+            db.commit()
+            logger.info(f"データベースを更新しました: {generated_file_path.name}")
+        finally:
+            db.close()
+    except Exception as e:
+        logger.exception(
+            f"画像生成プロセス中にエラーが発生しました: image_id={job.image_id}, error={e}")
+        return JobResult(job=job, error=str(e))
+
+    return JobResult(
+        job=job,
+        filename=generated_file_path.name,
+        notification=notification,
+    )
+
+
+def assign_result(image_id: str, generated_image_filename: str,
+                  job_id: Optional[str] = None) -> Optional[dict]:
+    """
+    既存の生成画像を画像エントリに割り当て、WebSocket通知用の辞書を返す。
+    結果キャッシュのヒット時や、相乗りしていたジョブの完了時に使う。job_idを渡すとそのジョブを成功で終える。
+    """
+    db = database.SessionLocal()
+    try:
+        db_image = crud.update_generated_image(
+            db, image_id, generated_image_filename)
+        if not db_image:
+            logger.error(f"画像ID {image_id} の更新に失敗しました。")
+            return None
+        if job_id:
+            crud.finish_job(db, job_id)
+        notification = build_notification(db_image, generated_image_filename)
+        db.commit()
+        return notification
+    finally:
+        db.close()
+
+
+def record_job_failures(jobs: list, error: str):
+    """ジョブを失敗として記録する（記録に失敗してもジョブの結果の配送は続ける）"""
+    db = database.SessionLocal()
+    try:
+        for job in jobs:
+            crud.finish_job(db, job.job_id, error)
+        db.commit()
+    except Exception as e:
+        logger.exception(f"ジョブの失敗を記録できませんでした: job_ids={[job.job_id for job in jobs]}, error={e}")
+    finally:
+        db.close()
+
+
+def load_unfinished_jobs(max_attempts: int) -> List[GenerationJob]:
+    """
+    前回のプロセスが終了した時に待機中・処理中だったジョブを読み込む（起動時の再投入用）。
+    試行回数が上限に達しているジョブは失敗として記録し、再投入しない。
+    """
+    db = database.SessionLocal()
+    try:
+        jobs = []
+        for db_job in crud.get_unfinished_jobs(db):
+            if db_job.attempts >= max_attempts:
+                crud.finish_job(db, db_job.id, "再起動後の再試行回数が上限に達しました。")
+                continue
+            jobs.append(GenerationJob(
+                image_id=db_job.image_id,
+                device_id=db_job.device_id,
+                job_id=db_job.id,
+                attempts=db_job.attempts,
+                profile=db_job.profile,
+                cache_key=db_job.cache_key,
+                canvas_digest=db_job.canvas_digest,
+            ))
+        db.commit()
+        return jobs
+    finally:
+        db.close()
+
+
+def attach_embeddings(pipe, request: GenerationRequest):
+    """キャッシュ済みのプロンプト埋め込みをリクエストに付与する（エンコーダを持たないパイプラインでは何もしない）"""
+    if not hasattr(pipe, "encode_prompt"):
+        return
+    from .image_generater import model_id
+    try:
+        request.embeddings = embedding_cache.get(
+            pipe, request.prompt, request.negative_prompt, model_id)
+    except Exception as e:
+        logger.exception(f"プロンプト埋め込みの取得に失敗しました。文字列のまま生成します: {e}")
+
+
+def prewarm_embeddings(pipe=None):
+    """全お題のプロンプト埋め込みを事前計算する。推論ワーカーのスレッド上で実行される"""
+    if pipe is None:
+        pipe = model_loader.get_pipe()
+    if not hasattr(pipe, "encode_prompt"):
+        return
+    from .image_generater import model_id
+    db = database.SessionLocal()
+    try:
+        pairs = [(topic.prompt, topic.negative_prompt or "")
+                 for topic in crud.get_topics(db)]
+    finally:
+        db.close()
+    embedding_cache.prewarm(pipe, pairs, model_id)
+
+
+def run_generation_batch(
+    jobs: list,
+    emit: Optional[Callable[[Any, dict], None]] = None,
+    batcher: Optional[MicroBatcher] = None,
+    pipe=None,
+) -> List[Union[JobResult, PendingResult]]:
+    """
+    まとめて取り出されたジョブ群を処理する。推論ワーカーのスレッド上で同期的に実行され、
+    ジョブごとの結果（失敗時はerror付き）のリストを返す。生成に成功したジョブの結果は、
+    エンコードと保存が終わると完了するPendingResultとして返す（推論スレッドはそれを待たずに次のバッチに進める）。
+    emitが渡された場合は、生成中の進捗とプレビューを (job, payload) で逐次送信する。
+    """
+    batcher = batcher or MicroBatcher()
+    if pipe is None:
+        if not model_loader.is_ready:
+            # 読み込みに失敗した場合、溜まっていたジョブと以降のジョブは生成せずに失敗として返す
+            logger.error(
+                f"パイプラインが利用できないためジョブを失敗させます: job_ids={[job.job_id for job in jobs]}")
+            return [JobResult(job=job, error="画像生成パイプラインの読み込みに失敗しました。") for job in jobs]
+        pipe = model_loader.get_pipe()
+
+    results: List[JobResult] = []
+    db = database.SessionLocal()
+    try:
+        try:
+            crud.mark_jobs_running(db, [job.job_id for job in jobs])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.exception(f"ジョブの開始を記録できませんでした: {e}")
+
+        requests = []
+        for job in jobs:
+            try:
+                request = prepare_request(db, job)
+            except Exception as e:
+                logger.exception(
+                    f"生成リクエストの準備に失敗しました: image_id={job.image_id}, error={e}")
+                request = None
+            if request:
+                attach_embeddings(pipe, request)
+                requests.append(request)
+            else:
+                results.append(JobResult(job=job, error="生成リクエストの準備に失敗しました。"))
+
+        for batch in batcher.group(requests):
+            # 画像生成を実行（パイプラインはこのスレッドが専有する）
+            reporter = make_reporter(
+                [r.job for r in batch], batch[0].params.num_inference_steps, emit)
+            try:
+                outputs = batcher.run(pipe, batch, callback=reporter)
+            except Exception as e:
+                logger.exception(f"画像生成に失敗しました: {e}")
+                results.extend(JobResult(job=r.job, error=str(e)) for r in batch)
+                continue
+
+            for request, gen_image in outputs:
+                # エンコードと保存は推論スレッドを塞がないよう、エンコード用のスレッドで行う
+                results.append(PendingResult(
+                    request.job, utils.encode_async(finalize_request, request, gen_image)))
+    finally:
+        db.close()
+    for result in results:
+        if isinstance(result, JobResult) and result.error:
+            record_job_failures([result.job], result.error)
+    return results
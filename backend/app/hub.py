@@ -0,0 +1,284 @@
+# backend/app/hub.py
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 再接続時に再送しない一時的なイベント（次のイベントで置き換わるもの）。シーケンス番号も付けない
+TRANSIENT_TYPES = {"progress", "preview"}
+
+
+class Connection:
+    """
+    1本のWebSocket接続。送信は接続ごとのキューと送信タスクで行い、遅いクライアントが他の接続の送信を待たせないようにする。
+    """
+
+    def __init__(self, device_id: str, websocket: WebSocket, queue_size: int):
+        self.device_id = device_id
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def enqueue(self, text: str) -> bool:
+        """送信キューに積む。キューがあふれた（クライアントが受信に追いつかない）場合はFalse"""
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+
+class _Channel:
+    """デバイスごとの接続の集合と、再送用の送信済みメッセージ（シーケンス番号付き）"""
+
+    def __init__(self, outbox_size: int):
+        self.connections: Set[Connection] = set()
+        self.outbox: Deque[Tuple[int, str]] = deque(maxlen=outbox_size)
+        self.seq = 0
+        # outboxからあふれて捨てたメッセージのうち最新のシーケンス番号
+        self.dropped = 0
+
+    def append(self, seq: int, text: str):
+        if len(self.outbox) == self.outbox.maxlen:
+            self.dropped = self.outbox[0][0]
+        self.outbox.append((seq, text))
+        self.seq = seq
+
+    def replay_after(self, last_seq: int) -> Tuple[List[str], bool]:
+        """
+        last_seqより後のメッセージと、再送しきれないかどうか（古いメッセージが既に破棄されている、
+        またはサーバーの再起動などでシーケンス番号がlast_seqより戻っている）を返す
+        """
+        messages = [text for seq, text in self.outbox if seq > last_seq]
+        return messages, last_seq > self.seq or self.dropped > last_seq
+
+
+class NotificationHub:
+    """
+    デバイスへの通知をWebSocketで配送するハブ。
+    - 1つのデバイスに複数の接続（複数のタブや端末）を持てる
+    - 再送対象のメッセージにはシーケンス番号（seq）を付けて直近outbox_size件を保持し、
+      再接続したクライアントが last_seq を渡すとそれより後のメッセージを再送する。
+      seqは通知バスが付けたもの（プロセス間で共通）を使い、付いていなければデバイスごとに連番を付ける
+    - heartbeat_interval秒ごとにpingを送り、heartbeat_timeout秒何も受信していない接続を切断する
+    """
+
+    def __init__(
+        self,
+        outbox_size: int = 64,
+        max_devices: int = 10000,
+        queue_size: int = 256,
+        send_timeout: float = 10,
+        heartbeat_interval: float = 20,
+        heartbeat_timeout: float = 60,
+    ):
+        self.outbox_size = outbox_size
+        self.max_devices = max_devices
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self._channels: "OrderedDict[str, _Channel]" = OrderedDict()
+        # 画像エントリごとの、次の通知を待っているロングポーリング
+        self._watchers: Dict[str, Set[asyncio.Future]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        # 切断などのバックグラウンドのタスク（完了するまで参照を持っておく）
+        self._tasks: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.replayed = 0
+        self.reaped = 0
+
+    def _channel(self, device_id: str) -> _Channel:
+        channel = self._channels.get(device_id)
+        if channel is None:
+            channel = self._channels[device_id] = _Channel(self.outbox_size)
+            self._evict()
+        self._channels.move_to_end(device_id)
+        return channel
+
+    def _evict(self):
+        """接続が無く長く使われていないデバイスの送信済みメッセージを捨てる"""
+        while len(self._channels) > self.max_devices:
+            for device_id, channel in self._channels.items():
+                if not channel.connections:
+                    del self._channels[device_id]
+                    break
+            else:
+                return
+
+    async def connect(self, device_id: str, websocket: WebSocket, last_seq: Optional[int] = None) -> Connection:
+        """
+        接続を受け入れて登録する。最初に現在のシーケンス番号を知らせるhelloを送り、
+        last_seqが渡された場合はそれより後のメッセージを続けて再送する。
+        """
+        await websocket.accept()
+        connection = Connection(device_id, websocket, self.queue_size)
+        channel = self._channel(device_id)
+        replay, truncated = channel.replay_after(last_seq) if last_seq is not None else ([], False)
+        # helloと再送分を積んでから登録するので、新しいメッセージが再送分より先に届くことはない
+        connection.enqueue(json.dumps({"type": "hello", "seq": channel.seq, "truncated": truncated}))
+        for text in replay[-(self.queue_size - 1):]:
+            connection.enqueue(text)
+        channel.connections.add(connection)
+        connection.task = asyncio.create_task(self._writer(connection))
+        self.replayed += len(replay)
+        logger.info(
+            f"WebSocket接続確立: device_id={device_id}, connections={len(channel.connections)}, "
+            f"last_seq={last_seq}, replayed={len(replay)}")
+        return connection
+
+    async def serve(self, device_id: str, websocket: WebSocket, last_seq: Optional[int] = None):
+        """接続を登録し、クライアントが切断するか、ハブが切断するまで受信を続ける"""
+        connection = await self.connect(device_id, websocket, last_seq)
+        try:
+            while not connection.closed:
+                await websocket.receive_text()
+                # 受信した内容（pongなど）は使わず、接続が生きていることだけを記録する
+                self.touch(connection)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            # ハブが切断した接続での受信エラーは記録しない
+            if not connection.closed:
+                logger.exception(f"WebSocket接続エラー: {e}")
+        finally:
+            await self.disconnect(connection)
+
+    def touch(self, connection: Connection):
+        """クライアントからの受信（pongなど）を記録する"""
+        connection.last_seen = time.monotonic()
+
+    async def disconnect(self, connection: Connection, code: int = 1000):
+        """接続を登録から外し、送信タスクを止めてソケットを閉じる"""
+        if connection.closed:
+            return
+        connection.closed = True
+        channel = self._channels.get(connection.device_id)
+        if channel is not None:
+            channel.connections.discard(connection)
+        if connection.task is not None and connection.task is not asyncio.current_task():
+            connection.task.cancel()
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            # 既に閉じられている
+            pass
+        logger.info(f"WebSocket接続切断: device_id={connection.device_id}")
+
+    async def deliver(self, device_id: str, payload: dict, seq: Optional[int] = None):
+        """
+        このプロセスに接続しているデバイスの全ての接続へメッセージを送る
+        （送信キューに積むだけで、実際の送信は接続ごとの送信タスクが並行して行う）。
+        一時的なイベント以外はシーケンス番号を付けて保持し、接続が無い間に送ったものも再接続時に再送できるようにする。
+        """
+        if payload.get("type") in TRANSIENT_TYPES:
+            channel = self._channels.get(device_id)
+            if channel is None or not channel.connections:
+                return
+            text = json.dumps(payload)
+        else:
+            channel = self._channel(device_id)
+            seq = seq if seq is not None else channel.seq + 1
+            if seq <= channel.seq:
+                # 同じメッセージを重複して受け取った
+                return
+            text = json.dumps({**payload, "seq": seq})
+            channel.append(seq, text)
+            self._wake(payload.get("imageId"))
+        for connection in list(channel.connections):
+            if not connection.enqueue(text):
+                logger.warning(f"送信キューがあふれたため接続を切断します: device_id={device_id}")
+                self._create_task(self.disconnect(connection, code=1013))
+        self.sent += 1
+
+    def _create_task(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def watch(self, image_id: str) -> asyncio.Future:
+        """画像エントリについての次の通知（完了・失敗）で完了するFutureを返す。使い終わったらunwatchする"""
+        future = asyncio.get_running_loop().create_future()
+        self._watchers.setdefault(image_id, set()).add(future)
+        return future
+
+    def unwatch(self, image_id: str, future: asyncio.Future):
+        watchers = self._watchers.get(image_id)
+        if watchers is not None:
+            watchers.discard(future)
+            if not watchers:
+                del self._watchers[image_id]
+
+    def _wake(self, image_id: Optional[str]):
+        for future in self._watchers.pop(image_id, ()) if image_id else ():
+            if not future.done():
+                future.set_result(None)
+
+    async def _writer(self, connection: Connection):
+        try:
+            while True:
+                text = await connection.queue.get()
+                await asyncio.wait_for(connection.websocket.send_text(text), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"メッセージ送信に失敗したため接続を切断します: device_id={connection.device_id}, error={e!r}")
+            await self.disconnect(connection, code=1011)
+
+    async def _heartbeat_loop(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for channel in list(self._channels.values()):
+                for connection in list(channel.connections):
+                    if now - connection.last_seen > self.heartbeat_timeout:
+                        self.reaped += 1
+                        logger.info(f"応答の無い接続を切断します: device_id={connection.device_id}")
+                        await self.disconnect(connection, code=1001)
+                    else:
+                        connection.enqueue(ping)
+
+    def start(self):
+        if self._heartbeat is None and self.heartbeat_interval > 0:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for task in list(self._tasks):
+            task.cancel()
+        for channel in list(self._channels.values()):
+            for connection in list(channel.connections):
+                await self.disconnect(connection, code=1001)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "devices": len(self._channels),
+            "connections": sum(len(c.connections) for c in self._channels.values()),
+            "sent": self.sent,
+            "replayed": self.replayed,
+            "reaped": self.reaped,
+        }
+
+
+notification_hub = NotificationHub(
+    outbox_size=settings.ws_outbox_size,
+    max_devices=settings.ws_outbox_devices,
+    queue_size=settings.ws_send_queue_size,
+    send_timeout=settings.ws_send_timeout,
+    heartbeat_interval=settings.ws_heartbeat_interval,
+    heartbeat_timeout=settings.ws_heartbeat_timeout,
+)
@@ -4,13 +4,14 @@ import uuid
 
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
+from . import crud, migrations, models, schemas
 from .database import engine
 
 
 def init_db():
-    """データベースを初期化し、初期データを追加する"""
+    """データベースを初期化（新しいテーブルの作成と既存のデータベースのマイグレーション）し、初期データを追加する"""
     models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
 
     # 初期お題データの追加（必要に応じて）
     with Session(bind=engine) as db:
@@ -36,6 +37,7 @@ def init_db():
             ]
             for topic in initial_topics:
                 crud.create_topic(db, topic)
+            db.commit()
             print("初期お題データを追加しました。")
         else:
             print("既にお題データが存在します。初期化をスキップします。")
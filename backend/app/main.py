@@ -2,24 +2,56 @@
 
 import asyncio
 import datetime
-import json
 import logging
 import os
 import uuid
-from typing import Dict, List, Optional
+from typing import List, Optional
 
-from fastapi import (BackgroundTasks, Depends, FastAPI, HTTPException, Query,
-                     WebSocket, WebSocketDisconnect, status)
+from fastapi import (Depends, FastAPI, HTTPException, Query, Request, Response,
+                     WebSocket, status)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
-from sqlalchemy.orm import Session
-
-from . import crud, database, image_generater, models, schemas, utils
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import UploadFile
+from starlette.requests import ClientDisconnect
+
+from . import (crud, crud_async, database, derivatives, generation, models,
+               schemas, utils, worker_main)
+from .admission import AdmissionRejectedError, admission_controller
+from .bus import notification_bus
+from .config import settings
+from .dispatcher import JobDispatcher
+from .hub import notification_hub
+from .model_loader import ModelState
+from .preprocess import canvas_preprocessor
+from .profiles import UnknownProfileError, resolve_profile
+from .prompt_cache import embedding_cache
+from .remote import RemoteInferenceWorker, parse_address
+from .result_cache import image_digest, result_cache
+from .topic_cache import topic_cache
+from .worker import GenerationJob, QueueFullError
 
 app = FastAPI()
 
-# 画像保存ディレクトリをマウント
+# 内容が変わらないURLに付けるCache-Control
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# パイプラインの読み込み中・推論ワーカーに接続できない間に、再送を促すまでの秒数
+PIPELINE_RETRY_AFTER = 5
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """ファイル名が毎回異なり内容が変わらない画像（生成画像）を、ブラウザに長期間キャッシュさせる静的ファイル配信"""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+# 画像保存ディレクトリをマウント（キャンバスは同じファイル名で描き直されるので通常の配信）
 app.mount(
     "/saved-images",
     StaticFiles(directory=database.saved_images_dir),
@@ -27,7 +59,7 @@ app.mount(
 )
 app.mount(
     "/generated-images",
-    StaticFiles(directory=database.generated_images_dir),
+    ImmutableStaticFiles(directory=database.generated_images_dir),
     name="generated-images",
 )
 
@@ -57,133 +89,194 @@ def on_startup():
     import app.init_db
 
     app.init_db.init_db()
-    # パイプラインの初期化
-    logger.info("画像生成パイプラインを初期化中...")
-    global pipe, canny_detector
-    try:
-        from .image_generater import canny_detector, pipe
-        logger.info("画像生成パイプラインが正常に初期化されました。")
-    except Exception as e:
-        logger.exception(f"画像生成パイプラインの初期化に失敗しました: {e}")
-        raise e
+
+
+@app.on_event("startup")
+async def start_inference_worker():
+    if settings.app_role == "api":
+        # 推論ワーカープロセスへの接続を開始する（接続できるまで再試行を続ける）
+        await inference_worker.start()
+    else:
+        await worker_main.start_inference(inference_worker)
+
+
+@app.on_event("shutdown")
+async def stop_inference_worker():
+    await inference_worker.stop()
+
+
+@app.on_event("startup")
+async def start_notification_hub():
+    notification_hub.start()
+    # 他のワーカープロセスで完了したジョブの通知も、このプロセスに接続しているWebSocketへ届ける
+    await notification_bus.start(notification_hub.deliver)
+
+
+@app.on_event("shutdown")
+async def stop_notification_hub():
+    await notification_bus.stop()
+    await notification_hub.stop()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    await database.async_engine.dispose()
 
 # Dependency
 
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-# WebSocket接続管理クラス
+# 推論ワーカーからのイベントと結果を、通知バスを介して（どのプロセスに接続していても）WebSocketへ配送する
+dispatcher = JobDispatcher(send=notification_bus.publish)
 
+# 推論ワーカー: APIのみの役割では別プロセスのワーカーへ、それ以外は同一プロセス内の推論スレッドへジョブを渡す
+if settings.app_role == "api":
+    inference_worker = RemoteInferenceWorker(
+        parse_address(settings.worker_address),
+        settings.require_worker_authkey(),
+        on_event=dispatcher.on_event,
+        on_result=dispatcher.on_result,
+    )
+else:
+    inference_worker = worker_main.build_inference_worker(
+        on_event=dispatcher.on_event,
+        on_result=dispatcher.on_result,
+    )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
 
-    async def connect(self, device_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[device_id] = websocket
-        logger.info(f"WebSocket接続確立: device_id={device_id}")
+def pipeline_status():
+    """画像生成パイプラインの状態とエラー内容を返す（APIのみの役割では推論ワーカープロセスの状態）"""
+    return inference_worker.pipeline_state, inference_worker.pipeline_error
 
-    def disconnect(self, device_id: str):
-        if device_id in self.active_connections:
-            del self.active_connections[device_id]
-            logger.info(f"WebSocket接続切断: device_id={device_id}")
+# ヘルスチェックエンドポイント
 
-    async def send_message(self, device_id: str, message: str):
-        websocket = self.active_connections.get(device_id)
-        if websocket:
-            try:
-                await websocket.send_text(message)
-                logger.info(
-                    f"メッセージを送信: device_id={device_id}, message={message}")
-            except Exception as e:
-                logger.exception(f"メッセージ送信に失敗しました: {e}")
 
+@app.get("/healthz", response_model=schemas.HealthResponse)
+async def healthz():
+    """
+    プロセスが応答できるかどうかだけを返すエンドポイント（liveness）
+    """
+    return schemas.HealthResponse(status="ok")
 
-manager = ConnectionManager()
+
+@app.get("/readyz", response_model=schemas.ReadinessResponse)
+async def readyz(response: Response):
+    """
+    画像生成パイプラインの読み込み状態を返すエンドポイント（readiness）。
+    読み込み中または失敗時は503を返す。
+    """
+    state, error = pipeline_status()
+    ready = state == ModelState.READY.value
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return schemas.ReadinessResponse(
+        status="ready" if ready else "not_ready",
+        pipeline_state=state,
+        queued_jobs=inference_worker.qsize,
+        detail=error,
+        workers=inference_worker.health(),
+        admission=admission_controller.stats(),
+    )
 
 # デバイス登録エンドポイント
 
 
 @app.post("/register-device", response_model=schemas.DeviceResponse)
-def register_device(db: Session = Depends(get_db)):
+async def register_device(db: AsyncSession = Depends(get_db)):
     """
     デバイスを登録し、一意のデバイスIDと初期データを返すエンドポイント
     """
+    return (await register_in_transaction(db, 1))[0]
+
+
+@app.post("/register-devices", response_model=schemas.RegisterDevicesResponse)
+async def register_devices(request: schemas.RegisterDevicesRequest, db: AsyncSession = Depends(get_db)):
+    """
+    会場のキオスクなどをまとめて準備するため、count台のデバイスを1つのトランザクションで登録するエンドポイント。
+    各デバイスには /register-device と同じくランダムなお題の画像エントリが1つずつ作られる。
+    """
+    devices = await register_in_transaction(db, request.count)
+    logger.info(f"デバイスをまとめて登録しました: count={len(devices)}")
+    return schemas.RegisterDevicesResponse(devices=devices)
+
+
+async def register_in_transaction(db: AsyncSession, count: int) -> List[schemas.DeviceResponse]:
+    """
+    デバイスと最初の画像エントリを作成して1回だけコミットする。
+    途中で失敗した場合はコミットせずに終わるので、画像エントリの無いデバイスは残らない。
+    """
     try:
-        db_device = crud.create_device(db)
-        db_topic = crud.get_random_topic(db)
-        if not db_topic:
-            raise HTTPException(status_code=500, detail="お題の取得に失敗しました。")
-
-        # 画像エントリを作成
-        db_image = crud.create_image(db, schemas.ImageCreate(
-            device_id=db_device.id,
-            topic_id=db_topic.id,
-            negative_prompt=db_topic.negative_prompt
-        ))
-
-        return schemas.DeviceResponse(
-            id=db_device.id,
-            created_at=db_device.created_at,
-            images=[schemas.ImageResponse.from_orm(db_image)]
-        )
+        registered = await crud_async.register_devices(db, count)
+        await db.commit()
+    except crud.NoTopicError as e:
+        logger.error(f"お題の取得に失敗しました: {e}")
+        raise HTTPException(status_code=500, detail="お題の取得に失敗しました。")
     except Exception as e:
         logger.exception(f"デバイス登録中にエラーが発生しました: {e}")
         raise HTTPException(status_code=500, detail="デバイスの登録中にエラーが発生しました。")
+    return [registered_device_response(*entry) for entry in registered]
+
+
+def registered_device_response(db_device, db_image, topic) -> schemas.DeviceResponse:
+    """登録したデバイスのレスポンス（お題はキャッシュの値を使い、データベースを読み直さない）"""
+    image = schemas.ImageResponse(
+        **schemas.ImageBase.model_validate(db_image).model_dump(),
+        topic=schemas.TopicResponse.model_validate(topic),
+    )
+    return schemas.DeviceResponse(id=db_device.id, created_at=db_device.created_at, images=[image])
 
 # デバイス検証エンドポイント
 
 
 @app.post("/verify-device", response_model=schemas.DeviceVerifyResponse)
-def verify_device(request: schemas.DeviceVerifyRequest, db: Session = Depends(get_db)):
+async def verify_device(request: schemas.DeviceVerifyRequest, db: AsyncSession = Depends(get_db)):
     """
     クライアントから送信されたデバイスIDが存在するかを確認し、存在する場合はデバイス情報と最新の画像エントリを返すエンドポイント
     """
-    db_device = crud.get_device(db, request.device_id)
+    db_device = await crud_async.get_device(db, request.device_id)
     if not db_device:
         logger.warning(f"デバイスIDが存在しません: device_id={request.device_id}")
         raise HTTPException(status_code=404, detail="デバイスIDが存在しません。")
 
     # 最新の画像エントリを取得
-    latest_image = crud.get_latest_image(db, request.device_id)
+    latest_image = await crud_async.get_latest_image(db, request.device_id)
     if not latest_image:
         raise HTTPException(
             status_code=404, detail="指定されたデバイスIDに関連する画像が見つかりません。")
 
-    # デバイス情報と最新画像をレスポンスに含める
-    device_response = schemas.DeviceVerifyResponse.from_orm(db_device)
-    device_response.images = [schemas.ImageResponse.from_orm(latest_image)]
-
-    return device_response
+    # デバイス情報と最新画像をレスポンスに含める（デバイスの全画像は読み込まない）
+    return schemas.DeviceVerifyResponse(
+        id=db_device.id,
+        created_at=db_device.created_at,
+        images=[schemas.ImageResponse.from_orm(latest_image)]
+    )
 
 # 新しいトピック取得エンドポイント
 
 
 @app.post("/get-new-topic", response_model=schemas.GetNewTopicResponse)
-def get_new_topic(request: schemas.GetNewTopicRequest, db: Session = Depends(get_db)):
+async def get_new_topic(request: schemas.GetNewTopicRequest, db: AsyncSession = Depends(get_db)):
     """
     指定されたデバイスIDに対して新しいトピックをランダムに選択し、関連する画像エントリを作成します。
     """
-    db_device = crud.get_device(db, request.device_id)
+    db_device = await crud_async.get_device(db, request.device_id)
     if not db_device:
         logger.warning(f"デバイスIDが存在しません: device_id={request.device_id}")
         raise HTTPException(status_code=404, detail="デバイスIDが存在しません。")
 
-    db_topic = crud.get_random_topic(db)
+    db_topic = await crud_async.get_random_topic(db)
     if not db_topic:
         raise HTTPException(status_code=500, detail="お題の取得に失敗しました。")
 
-    db_image = crud.create_image(db, schemas.ImageCreate(
+    db_image = await crud_async.create_image(db, schemas.ImageCreate(
         device_id=request.device_id,
         topic_id=db_topic.id,
         negative_prompt=db_topic.negative_prompt
     ))
+    await db.commit()
 
     logger.info(
         f"新しいお題を割り当てました: device_id={request.device_id}, topic_id={db_topic.id}")
@@ -197,186 +290,439 @@ def get_new_topic(request: schemas.GetNewTopicRequest, db: Session = Depends(get
 # キャンバス画像保存エンドポイント
 
 
+def check_pipeline_ready():
+    """
+    画像生成パイプラインが使えなければ503で断る。読み込み中や推論ワーカーに接続できない間は
+    Retry-Afterを付けて再送を促し、読み込みに失敗している場合は付けない。
+    """
+    state, error = pipeline_status()
+    if state == ModelState.READY.value:
+        return
+    logger.warning(f"画像生成パイプラインが利用できません: state={state}, error={error}")
+    if state == ModelState.FAILED.value:
+        raise HTTPException(status_code=503, detail="画像生成を利用できません。")
+    raise HTTPException(
+        status_code=503, detail="画像生成の準備中です。しばらくしてから再度お試しください。",
+        headers={"Retry-After": str(PIPELINE_RETRY_AFTER)})
+
+
 @app.post("/save-canvas", response_model=schemas.SaveCanvasResponse)
-def save_canvas(
+async def save_canvas(
     request: schemas.SaveCanvasRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    キャンバス画像を保存し、画像生成を非同期で開始するエンドポイント
+    キャンバス画像を保存し、画像生成ジョブを推論ワーカーに登録して即座に返すエンドポイント。
+    Base64のデコードと前処理はスレッドプールで行い、イベントループを止めない。
     """
-    db_image = crud.get_image_by_id(db, request.image_id)
-    if not db_image or db_image.device_id != request.device_id:
-        logger.warning(
-            f"画像エントリが見つかりません: image_id={request.image_id}, device_id={request.device_id}")
-        raise HTTPException(status_code=404, detail="画像エントリが見つかりません。")
+    db_image, profile = await resolve_canvas_target(
+        db, request.device_id, request.image_id, request.profile)
+    check_admission(request.device_id)
 
-    # 画像データをデコードして保存
-    image_filename = f"{db_image.id}.png"
+    # 画像データをデコードし、ディスクへの書き込みはバックグラウンドで行う
+    image_filename = utils.canvas_filename(db_image.id)
     image_path = os.path.join(database.saved_images_dir, image_filename)
     try:
         # `utils.save_image`がPIL Imageオブジェクトを返すと仮定
-        image = utils.save_image(request.image_data, database.saved_images_dir)
-        image.save(image_path)
+        image = await run_in_threadpool(
+            utils.save_image, request.image_data, database.saved_images_dir)
+        utils.save_canvas_async(image, image_path)
         db_image.canvas_image_filename = image_filename
-        db.commit()
-        logger.info(f"キャンバス画像を保存しました: {image_filename}")
+        db_image.canvas_updated_at = datetime.datetime.utcnow()
     except Exception as e:
         logger.exception(f"キャンバス画像の保存に失敗しました: {e}")
         raise HTTPException(status_code=500, detail="キャンバス画像の保存に失敗しました。")
 
-    # 画像生成をバックグラウンドタスクとして開始
-    background_tasks.add_task(process_image_generation,
-                              db_image.id, db_image.device_id)
+    # 推論ワーカーにはディスクを経由せず、アダプターの入力に揃えたキャンバスを渡す
+    def prepare():
+        digest = image_digest(image)
+        return digest, generation.prepare_canvas(image, profile, digest)
+
+    digest, canvas = await run_in_threadpool(prepare)
+    return await enqueue_generation(db, db_image, profile, image_filename, digest, canvas)
+
+
+@app.post("/save-canvas/upload", response_model=schemas.SaveCanvasResponse)
+async def upload_canvas(
+    request: Request,
+    device_id: str = Query(...),
+    image_id: str = Query(...),
+    profile: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    キャンバス画像をバイナリ（Content-Type: image/png の生データ、またはmultipart/form-dataの
+    fileフィールド）で受け取り、再エンコードせずに保存して画像生成ジョブを登録するエンドポイント。
+    Base64のデータURLを使う /save-canvas と同じレスポンスを返す。
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.max_canvas_bytes:
+        raise HTTPException(status_code=413, detail="キャンバス画像が大きすぎます。")
+
+    db_image, resolved = await resolve_canvas_target(db, device_id, image_id, profile)
+    check_admission(device_id)
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form(max_files=1)
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail="fileフィールドがありません。")
+        chunks = iter_upload(upload)
+    elif content_type.startswith("image/png"):
+        chunks = request.stream()
+    else:
+        raise HTTPException(
+            status_code=415, detail="image/png または multipart/form-data で送信してください。")
+
+    image_filename = f"{db_image.id}.png"
+    try:
+        stored = await utils.store_png_stream(
+            chunks, database.saved_images_dir / image_filename,
+            max_bytes=settings.max_canvas_bytes, max_side=settings.max_canvas_side)
+    except utils.CanvasTooLargeError as e:
+        logger.warning(f"キャンバス画像が大きすぎます: image_id={image_id}, {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except utils.InvalidCanvasError as e:
+        logger.warning(f"キャンバス画像が不正です: image_id={image_id}, {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        logger.warning(f"キャンバス画像の受信中に切断されました: image_id={image_id}")
+        raise HTTPException(status_code=400, detail="キャンバス画像の受信中に切断されました。")
+    except OSError as e:
+        logger.exception(f"キャンバス画像の保存に失敗しました: {e}")
+        raise HTTPException(status_code=500, detail="キャンバス画像の保存に失敗しました。")
+
+    db_image.canvas_image_filename = image_filename
+    db_image.canvas_updated_at = datetime.datetime.utcnow()
+    return await enqueue_generation(db, db_image, resolved, image_filename, stored.digest)
+
+
+async def iter_upload(upload: UploadFile, chunk_size: int = 64 * 1024):
+    """multipartでアップロードされたファイルをチャンクごとに読み出す"""
+    while chunk := await upload.read(chunk_size):
+        yield chunk
+
+
+def too_many_requests(e: AdmissionRejectedError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def check_admission(device_id: str):
+    """処理中のジョブが上限に達していれば、キャンバスをデコード・保存する前に429（Retry-After付き）で断る"""
+    try:
+        admission_controller.check(device_id)
+    except AdmissionRejectedError as e:
+        logger.warning(f"処理中のジョブが上限に達しています: device_id={device_id}, retry_after={e.retry_after}")
+        raise too_many_requests(e)
+
+
+async def resolve_canvas_target(db: AsyncSession, device_id: str, image_id: str,
+                                profile_name: Optional[str]):
+    """キャンバスを保存する画像エントリと生成プロファイルを求める（見つからなければ404、不正なプロファイルは400）"""
+    db_image = await crud_async.get_image_by_id(db, image_id)
+    if not db_image or db_image.device_id != device_id:
+        logger.warning(
+            f"画像エントリが見つかりません: image_id={image_id}, device_id={device_id}")
+        raise HTTPException(status_code=404, detail="画像エントリが見つかりません。")
+
+    # 生成プロファイルを決定（ステップ数はサーバーの上限で切り詰められる）
+    try:
+        profile = resolve_profile(profile_name, db_image.topic.profile)
+    except UnknownProfileError as e:
+        logger.warning(f"生成プロファイルが不正です: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return db_image, profile
+
+
+async def ensure_canvas_written(image_filename: str):
+    """キャンバス画像の非同期の書き込みの完了を待ち、保存できていなければ500を返す"""
+    image_path = database.saved_images_dir / image_filename
+
+    def wait():
+        utils.wait_canvas_written(image_path)
+        return image_path.exists()
+
+    if not await run_in_threadpool(wait):
+        raise HTTPException(status_code=500, detail="キャンバス画像の保存に失敗しました。")
+
+
+async def enqueue_generation(db: AsyncSession, db_image, profile, image_filename: str,
+                             canvas_digest: str, canvas: Optional[Image.Image] = None) -> schemas.SaveCanvasResponse:
+    """
+    保存済みのキャンバスに対して、結果キャッシュを確認してから画像生成ジョブを登録する。
+    canvasを渡すと、同一プロセス内の推論ワーカーはディスクから読み直さずにそれを使う。
+    呼び出し側で変更した画像エントリ（キャンバスのファイル名）も含めて、ここで1回だけコミットする。
+    """
+    cache_key = generation.result_key_for(db_image, canvas_digest, profile)
+    job = GenerationJob(image_id=db_image.id, device_id=db_image.device_id,
+                        profile=profile.name, cache_key=cache_key,
+                        canvas_digest=canvas_digest, canvas=canvas)
+    # 同じキャンバス・お題・パラメータの生成結果があれば即座に返す
+    cached_filename = result_cache.lookup(cache_key)
+    if cached_filename:
+        if (database.generated_images_dir / cached_filename).exists():
+            await crud_async.update_generated_image(db, db_image.id, cached_filename)
+            await crud_async.create_job(db, job, status=models.JOB_SUCCEEDED)
+            await db.commit()
+            notification = generation.build_notification(
+                db_image, cached_filename)
+            # 通知に含めるキャンバス画像のURLが読めるよう、書き込みの完了を待つ
+            await run_in_threadpool(
+                utils.wait_canvas_written, os.path.join(database.saved_images_dir, image_filename))
+            await notification_bus.publish(db_image.device_id, notification)
+            logger.info(
+                f"生成結果キャッシュにヒットしました: image_id={db_image.id}, {cached_filename}")
+            return schemas.SaveCanvasResponse(
+                success=True,
+                file_name=image_filename,
+                generated_image_url=notification["generatedImageUrl"],
+                job_id=job.job_id
+            )
+        result_cache.forget(cache_key)
+
+    # パイプラインが使えない間は、いつまでも終わらないジョブを溜めないよう登録せずに断る
+    check_pipeline_ready()
+
+    if not inference_worker.carries_canvas:
+        # 別プロセスの推論ワーカーはジョブのキャンバスを受け取れずディスクから読むので、
+        # 書き込み（fsyncと置き換え）が終わってからジョブを登録する
+        job.canvas = None
+        await ensure_canvas_written(image_filename)
+
+    # 処理中のジョブの上限を確かめてから受け付ける（check_admissionの後に他のリクエストが受け付けられた場合に備える）
+    try:
+        ticket = admission_controller.admit(job.job_id, db_image.device_id)
+    except AdmissionRejectedError as e:
+        logger.warning(f"処理中のジョブが上限に達しています: image_id={db_image.id}, retry_after={e.retry_after}")
+        raise too_many_requests(e)
 
-    # 生成画像URLはバックグラウンドタスクで生成されるため、現時点ではNone
+    # 推論ワーカーが画像エントリ（キャンバスのファイル名）とジョブの記録を読めるよう、ジョブの登録前にコミットする
+    try:
+        await crud_async.create_job(db, job)
+        await db.commit()
+    except Exception:
+        admission_controller.release(job.job_id)
+        raise
+
+    # 同じキーのジョブが生成中ならそれに相乗りし、そうでなければ推論ワーカーのキューに登録
+    primary = result_cache.begin(cache_key, job)
+    if primary:
+        # 相乗りするジョブは生成を行わないのでキャンバスを保持しない
+        job.canvas = None
+        ticket = admission_controller.follow(job.job_id, primary.job_id)
+        logger.info(
+            f"生成中のジョブに相乗りしました: image_id={db_image.id}, job_id={primary.job_id}")
+        return schemas.SaveCanvasResponse(
+            success=True,
+            file_name=image_filename,
+            job_id=primary.job_id,
+            queue_position=ticket.position,
+            eta_seconds=round(ticket.eta_seconds, 1),
+            estimated_completion_at=ticket.estimated_completion_at
+        )
+    try:
+        # 別プロセスの推論ワーカーは受理の応答を待つので、イベントループの外で登録する
+        await run_in_threadpool(inference_worker.submit, job)
+    except QueueFullError:
+        logger.warning(f"ジョブキューが満杯です: image_id={db_image.id}")
+        result_cache.fail(cache_key)
+        admission_controller.release(job.job_id)
+        await crud_async.finish_job(db, job.job_id, "ジョブキューが満杯でした。")
+        await db.commit()
+        raise HTTPException(
+            status_code=503, detail="現在混み合っています。しばらくしてから再度お試しください。",
+            headers={"Retry-After": str(max(1, round(admission_controller.job_seconds)))})
+
+    # 生成画像URLは推論ワーカーで生成されるため、現時点ではNone
     generated_image_url = None
 
     logger.info(
-        f"キャンバス画像を保存しました: {image_filename}, 生成画像URL: {generated_image_url}")
+        f"キャンバス画像を保存しました: {image_filename}, job_id={job.job_id}, "
+        f"position={ticket.position}, eta={ticket.eta_seconds:.1f}s")
 
     return schemas.SaveCanvasResponse(
         success=True,
         file_name=image_filename,
-        generated_image_url=generated_image_url
+        generated_image_url=generated_image_url,
+        job_id=job.job_id,
+        queue_position=ticket.position,
+        eta_seconds=round(ticket.eta_seconds, 1),
+        estimated_completion_at=ticket.estimated_completion_at
+    )
+
+# ロングポーリング中に、通知を受け取れなかった場合に備えてデータベースを読み直す間隔（秒）
+JOB_POLL_INTERVAL = 2.0
+
+
+@app.get("/jobs/{image_id}", response_model=schemas.JobResponse)
+async def get_job(image_id: str, wait: int = Query(0, ge=0, le=settings.job_max_wait)):
+    """
+    画像エントリの最新の生成ジョブの状態を返すエンドポイント。
+    waitを指定すると、ジョブが終わる（succeeded / failed）か wait 秒経つまで待ってから返す（ロングポーリング）。
+    WebSocketを使えないクライアント向けの代わり。
+    """
+    deadline = asyncio.get_running_loop().time() + wait
+    # 読み込みと待機の間に届いた通知を取りこぼさないよう、先に待ち受けを登録する
+    waiter = notification_hub.watch(image_id)
+    try:
+        while True:
+            # 待っている間データベースの接続を占有しないよう、読み込むたびにセッションを閉じる
+            async with database.AsyncSessionLocal() as db:
+                row = await crud_async.get_latest_job(db, image_id)
+            if row is None:
+                raise HTTPException(status_code=404, detail="ジョブが見つかりません。")
+            db_job, generated_image_filename = row
+            remaining = deadline - asyncio.get_running_loop().time()
+            if db_job.status not in models.UNFINISHED_JOB_STATUSES or remaining <= 0:
+                break
+            await asyncio.wait((waiter,), timeout=min(remaining, JOB_POLL_INTERVAL))
+            if waiter.done():
+                waiter = notification_hub.watch(image_id)
+    finally:
+        notification_hub.unwatch(image_id, waiter)
+
+    return schemas.JobResponse(
+        job_id=db_job.id,
+        image_id=db_job.image_id,
+        status=db_job.status,
+        attempts=db_job.attempts,
+        error=db_job.error,
+        created_at=db_job.created_at,
+        started_at=db_job.started_at,
+        finished_at=db_job.finished_at,
+        generated_image_filename=generated_image_filename,
+    )
+
+# サムネイル取得エンドポイント
+
+
+@app.get("/thumbnails/{kind}/{size}/{filename}")
+def get_thumbnail(kind: str, size: int, filename: str, request: Request,
+                  v: Optional[str] = Query(None)):
+    """
+    生成画像（kind=generated）またはキャンバス（kind=canvas）の派生画像を返すエンドポイント。
+    初回の要求時に作成して保存し、以降は保存済みのファイルを返す。
+    内容から求めた強いETagを付け、If-None-Matchが一致すれば304を返す。
+    生成画像と、バージョン（v）付きのキャンバスのURLは内容が変わらないので長期間キャッシュさせる。
+    """
+    try:
+        path = derivatives.ensure(kind, filename, size)
+    except (derivatives.UnknownDerivativeError, FileNotFoundError) as e:
+        logger.warning(f"派生画像を作成できません: kind={kind}, size={size}, filename={filename}, {e}")
+        raise HTTPException(status_code=404, detail="画像が見つかりません。")
+
+    etag = derivatives.etag_for(path)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if kind == "generated" or v else "no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(path, media_type=derivatives.media_type(), headers=headers)
+
+# キャッシュ統計取得エンドポイント
+
+
+@app.get("/cache-stats", response_model=schemas.CacheStatsResponse)
+async def get_cache_stats():
+    """
+    生成結果キャッシュ、プロンプト埋め込みキャッシュ、前処理済みキャンバスのキャッシュ、お題キャッシュの統計を返すエンドポイント
+    """
+    return schemas.CacheStatsResponse(
+        result_cache=result_cache.stats(),
+        prompt_cache=embedding_cache.stats(),
+        preprocess_cache=canvas_preprocessor.stats(),
+        topic_cache=topic_cache.stats(),
     )
 
 # デバイス一覧取得エンドポイント
 
 
-@app.get("/list-devices", response_model=List[schemas.DeviceResponse])
-def list_devices(db: Session = Depends(get_db)):
+@app.get("/list-devices", response_model=schemas.ListDevicesResponse)
+async def list_devices(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    登録されている全デバイスの一覧を取得するエンドポイント
+    登録されているデバイスの一覧を、画像の枚数と最新のリクエスト日時の要約付きで取得するエンドポイント。
+    format=json ではlimit件ずつ返し、続きはnext_cursorをcursorに指定して取得する。
+    format=ndjson では（cursor以降の）全デバイスを1行1デバイスのNDJSONとしてストリーミングする。
     """
-    devices = db.query(models.Device).all()
-    return [schemas.DeviceResponse.from_orm(device) for device in devices]
+    try:
+        if fmt == "ndjson":
+            # 先頭のページを読んでカーソルを検証してからストリーミングを始める
+            await crud_async.get_device_summaries(db, 1, cursor)
+            return StreamingResponse(
+                stream_device_summaries(cursor), media_type="application/x-ndjson")
+        devices, next_cursor = await crud_async.get_device_summaries(db, limit, cursor)
+    except crud.InvalidCursorError as e:
+        logger.warning(f"カーソルが不正です: {e}")
+        raise HTTPException(status_code=400, detail="カーソルが不正です。")
+    return schemas.ListDevicesResponse(devices=devices, next_cursor=next_cursor)
+
+
+async def stream_device_summaries(cursor: Optional[str]):
+    # レスポンスの送信中も使い続けるので、リクエストのセッションとは別に開く
+    async with database.AsyncSessionLocal() as db:
+        async for summary in crud_async.iter_device_summaries(db, cursor=cursor):
+            yield summary.model_dump_json() + "\n"
 
 # デバイスごとの画像一覧取得エンドポイント
 
 
 @app.get("/images/{device_id}", response_model=schemas.GetImagesResponse)
-def get_images(device_id: str, db: Session = Depends(get_db)):
+async def get_images(
+    device_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    指定されたデバイスIDに関連する全ての画像を取得するエンドポイント
+    指定されたデバイスIDに関連する画像を新しい順にlimit件ずつ取得するエンドポイント。
+    続きはレスポンスのnext_cursorをcursorに指定して取得する。
     """
-    db_device = crud.get_device(db, device_id)
+    db_device = await crud_async.get_device(db, device_id)
     if not db_device:
         logger.warning(f"デバイスIDが存在しません: device_id={device_id}")
         raise HTTPException(status_code=404, detail="デバイスIDが存在しません。")
 
-    images = crud.get_images_by_device(db, device_id)
-    if not images:
+    try:
+        images, next_cursor = await crud_async.get_images_page(db, device_id, limit, cursor)
+    except crud.InvalidCursorError as e:
+        logger.warning(f"カーソルが不正です: device_id={device_id}, {e}")
+        raise HTTPException(status_code=400, detail="カーソルが不正です。")
+    if not images and not cursor:
         return schemas.GetImagesResponse(
             success=False, detail="指定されたデバイスIDに関連する画像が見つかりません。"
         )
 
     image_responses = [schemas.ImageResponse.from_orm(img) for img in images]
-    return schemas.GetImagesResponse(success=True, images=image_responses)
+    return schemas.GetImagesResponse(
+        success=True, images=image_responses, next_cursor=next_cursor)
 
 # WebSocketエンドポイント
 
 
 @app.websocket("/ws/{device_id}")
-async def websocket_endpoint(websocket: WebSocket, device_id: str, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, device_id: str, last_seq: Optional[int] = Query(None, ge=0)):
     """
-    指定されたデバイスIDに対応するWebSocket接続を管理するエンドポイント
+    指定されたデバイスIDに対応するWebSocket接続を管理するエンドポイント。
+    1つのデバイスに複数の接続を持てる。再接続時に最後に受け取ったseqをlast_seqに渡すと、
+    切断中に送られた通知が再送される。クライアントはサーバーのpingに応答する（何かを送る）こと。
     """
     try:
-        # デバイスIDの検証
-        db_device = crud.get_device(db, device_id)
+        # デバイスIDの検証（接続している間データベースの接続を占有しないよう、検証が済んだらセッションを閉じる）
+        async with database.AsyncSessionLocal() as db:
+            db_device = await crud_async.get_device(db, device_id)
         if not db_device:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid device_id")
             logger.warning(f"WebSocket接続拒否: 無効なdevice_id={device_id}")
             return
-
-        await manager.connect(device_id, websocket)
-        while True:
-            data = await websocket.receive_text()
-            # 必要に応じてメッセージの処理を実装
-    except WebSocketDisconnect:
-        manager.disconnect(device_id)
     except Exception as e:
         logger.exception(f"WebSocket接続エラー: {e}")
-        manager.disconnect(device_id)
-
-# バックグラウンドタスクとして画像生成を処理
-
-
-async def process_image_generation(image_id: str, device_id: str):
-    """
-    キャンバス画像を基にAIによる画像生成を行い、生成画像を保存してWebSocket経由で通知する
-    """
-    db = database.SessionLocal()
-    try:
-        db_image = crud.get_image_by_id(db, image_id)
-        if not db_image:
-            logger.error(f"画像ID {image_id} に対応する画像が見つかりません。")
-            return
-        if not db_image.topic:
-            logger.error(f"画像ID {image_id} に対応するトピックが見つかりません。")
-            return
-
-        prompt = db_image.topic.prompt
-        negative_prompt = db_image.negative_prompt or ""
-        logger.info(f"画像生成開始: image_id={image_id}, prompt={prompt}")
-
-        SAVED_IMAGES_DIR = database.saved_images_dir
-        GENERATED_IMAGES_DIR = database.generated_images_dir
-        canvas_file_path = os.path.join(
-            SAVED_IMAGES_DIR, db_image.canvas_image_filename)
-        if not os.path.exists(canvas_file_path):
-            logger.error(f"キャンバス画像ファイルが存在しません: {canvas_file_path}")
-            return
-
-        # キャンバス画像を開く
-        try:
-            image = Image.open(canvas_file_path).convert("RGB")
-        except Exception as e:
-            logger.exception(f"キャンバス画像の読み込みに失敗しました: {e}")
-            return
-
-        # 画像生成を実行
-        try:
-            global pipe, canny_detector
-            gen_image = pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                image=image,
-                num_inference_steps=100,
-                guidance_scale=6.5,
-                adapter_conditioning_scale=0.7
-            ).images[0]
-        except Exception as e:
-            logger.exception(f"画像生成に失敗しました: {e}")
-            return
-
-        # 生成画像を保存
-        generated_file_path = utils.save_generated_image(
-            gen_image, GENERATED_IMAGES_DIR)
-        if not generated_file_path:
-            logger.error("生成画像の保存に失敗しました。")
-            return
-        logger.info(f"生成画像を保存しました: {generated_file_path}")
-
-        # データベースを更新
-        crud.update_generated_image(db, image_id, generated_file_path.name)
-        logger.info(f"データベースを更新しました: {generated_file_path.name}")
-
-        # WebSocketを通じてフロントエンドに通知
-        generated_image_url = f"http://localhost:8000/generated-images/{generated_file_path.name}"
-        canvas_image_url = f"http://localhost:8000/saved-images/{db_image.canvas_image_filename}"
-        topic = db_image.topic.name if db_image.topic else ""
-
-        notification = {
-            "canvasImageUrl": canvas_image_url,
-            "generatedImageUrl": generated_image_url,
-            "topic": topic,
-        }
-        await manager.send_message(device_id, json.dumps(notification))
-        logger.info(f"WebSocket経由で通知を送信しました: device_id={device_id}")
-    except Exception as e:
-        logger.exception(f"画像生成プロセス中にエラーが発生しました: {e}")
-    finally:
-        db.close()
+        return
+    await notification_hub.serve(device_id, websocket, last_seq)
@@ -0,0 +1,104 @@
+# backend/app/migrations.py
+
+import logging
+from dataclasses import dataclass
+from typing import Callable, List
+
+from sqlalchemy import (Column, Index, Integer, MetaData, Table, inspect, select,
+                        text)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# 適用済みのスキーマバージョンを1行だけ保持するテーブル（モデルのメタデータには含めない）
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("version", Integer, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    スキーマの変更1つ分。applyは新しくcreate_allで作られたデータベースに対しても安全なように、
+    既にある列やインデックスは作らない（冪等に）書く。
+    """
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def add_column(conn: Connection, table: Table, name: str):
+    """モデルに定義された列がテーブルに無ければ追加する"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if name in existing:
+        return
+    ddl = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def create_index(conn: Connection, index: Index):
+    index.create(conn, checkfirst=True)
+
+
+def _index(table: Table, name: str) -> Index:
+    return next(ix for ix in table.indexes if ix.name == name)
+
+
+topics = models.Topic.__table__
+images = models.Image.__table__
+devices = models.Device.__table__
+jobs = models.Job.__table__
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "topics.profile を追加", lambda conn: add_column(conn, topics, "profile")),
+    Migration(2, "topics.weight を追加", lambda conn: add_column(conn, topics, "weight")),
+    Migration(3, "images.canvas_updated_at を追加", lambda conn: add_column(conn, images, "canvas_updated_at")),
+    Migration(4, "images (device_id, request_time, id) のインデックスを追加",
+              lambda conn: create_index(conn, _index(images, "ix_images_device_request_time"))),
+    Migration(5, "devices (created_at, id) のインデックスを追加",
+              lambda conn: create_index(conn, _index(devices, "ix_devices_created_at_id"))),
+    Migration(6, "jobs テーブルとインデックスを追加", lambda conn: jobs.create(conn, checkfirst=True)),
+]
+
+
+def _lock(conn: Connection):
+    """
+    複数のプロセス（uvicornの複数ワーカーなど）が同時に起動しても、マイグレーションを1つずつ適用させる。
+    SQLiteでは書き込みロックを先に取り、PostgreSQLではアドバイザリロックを使う。
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif dialect == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(4242019)"))
+
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def upgrade(engine: Engine) -> int:
+    """未適用のマイグレーションを順に適用し、適用後のスキーマバージョンを返す"""
+    with engine.connect() as conn:
+        _lock(conn)
+        version = current_version(conn)
+        pending = [m for m in MIGRATIONS if m.version > version]
+        if not pending:
+            conn.rollback()
+            return version
+        schema_version.create(conn, checkfirst=True)
+        for migration in pending:
+            logger.info(f"マイグレーションを適用します: {migration.version} {migration.description}")
+            migration.apply(conn)
+        conn.execute(schema_version.delete())
+        conn.execute(schema_version.insert().values(version=pending[-1].version))
+        conn.commit()
+    logger.info(f"スキーマバージョンを更新しました: {version} -> {pending[-1].version}")
+    return pending[-1].version
@@ -0,0 +1,84 @@
+# backend/app/model_loader.py
+
+import asyncio
+import enum
+import importlib
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ModelState(str, enum.Enum):
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+
+def load_factory(path: str) -> Callable[..., Any]:
+    """"module:callable" 形式の文字列からパイプラインを作る関数を遅延インポートする"""
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "load_pipeline")
+
+
+def default_pipeline_factory():
+    """PIPELINE_FACTORY（デフォルトは image_generater.load_pipeline）でパイプラインを読み込む"""
+    return load_factory(settings.pipeline_factory)()
+
+
+class ModelLoader:
+    """
+    画像生成パイプラインをバックグラウンドで読み込み、その状態（loading/ready/failed）を管理する。
+    読み込みは推論ワーカーのスレッド上で行われるため、APIの起動を待たせない。
+    """
+
+    def __init__(self, factory: Callable[[], Any] = default_pipeline_factory):
+        self._factory = factory
+        self.state = ModelState.LOADING
+        self.error: Optional[str] = None
+        self.pipe: Any = None
+        self.load_seconds: Optional[float] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == ModelState.READY
+
+    def start(self, run: Callable[[Callable], Awaitable[Any]]):
+        """runで指定された実行先（推論スレッド）でパイプラインの読み込みを開始する"""
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._load(run))
+
+    async def wait_ready(self):
+        """パイプラインの読み込みが終わる（成功または失敗する）まで待つ。結果はstateで確かめる"""
+        await self._ready.wait()
+
+    def get_pipe(self):
+        if not self.is_ready:
+            raise RuntimeError(f"パイプラインが利用できません: state={self.state.value}")
+        return self.pipe
+
+    async def _load(self, run: Callable[[Callable], Awaitable[Any]]):
+        logger.info("画像生成パイプラインを初期化中...")
+        started = time.monotonic()
+        try:
+            self.pipe = await run(self._factory)
+        except Exception as e:
+            self.state = ModelState.FAILED
+            self.error = str(e)
+            logger.exception(f"画像生成パイプラインの初期化に失敗しました: {e}")
+            # 待っている推論ワーカーを起こし、溜まっているジョブを失敗させる
+            self._ready.set()
+            return
+        self.load_seconds = time.monotonic() - started
+        self.state = ModelState.READY
+        self._ready.set()
+        logger.info(
+            f"画像生成パイプラインが正常に初期化されました: {self.load_seconds:.1f}秒")
+
+
+model_loader = ModelLoader()
@@ -2,8 +2,8 @@
 
 import datetime
 
-from sqlalchemy import (Column, DateTime, ForeignKey, String, Text,
-                        UniqueConstraint)
+from sqlalchemy import (Column, DateTime, Float, ForeignKey, Index, Integer,
+                        String, Text, UniqueConstraint)
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -17,6 +17,11 @@ class Device(Base):
     images = relationship("Image", back_populates="device",
                           cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # デバイス一覧のキーセットページング（created_at, id の昇順）用
+        Index("ix_devices_created_at_id", "created_at", "id"),
+    )
+
 
 class Topic(Base):
     __tablename__ = "topics"
@@ -25,6 +30,10 @@ class Topic(Base):
     name = Column(String(100), unique=True, nullable=False)
     prompt = Column(Text, nullable=False)
     negative_prompt = Column(Text, nullable=True)
+    # お題ごとの生成プロファイル名（NULLならサーバーのデフォルト）
+    profile = Column(String(32), nullable=True)
+    # ランダムに選ばれる時の重み（0なら選ばれない）
+    weight = Column(Float, nullable=False, default=1.0, server_default="1")
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     images = relationship("Image", back_populates="topic")
@@ -37,6 +46,8 @@ class Image(Base):
     device_id = Column(String, ForeignKey("devices.id"), nullable=False)
     topic_id = Column(String, ForeignKey("topics.id"), nullable=False)
     canvas_image_filename = Column(String, nullable=True)
+    # キャンバスを保存した日時（同じファイル名で描き直されるので、サムネイルのURLのバージョンに使う）
+    canvas_updated_at = Column(DateTime, nullable=True)
     generated_image_filename = Column(String, nullable=True)
     request_time = Column(DateTime, default=datetime.datetime.utcnow)
     negative_prompt = Column(Text, nullable=True)
@@ -46,4 +57,45 @@ class Image(Base):
 
     __table_args__ = (
         UniqueConstraint('device_id', 'id', name='unique_device_image'),
+        # デバイスごとの最新画像・履歴のページング（request_time, id の降順）用
+        Index("ix_images_device_request_time", "device_id", "request_time", "id"),
+    )
+
+
+# 生成ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+# 再起動時に再投入する（まだ終わっていない）状態
+UNFINISHED_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class Job(Base):
+    """
+    画像生成ジョブ1回分の記録。APIがキューに登録する時に作り、推論ワーカーが状態を更新する。
+    同じ画像エントリに対してキャンバスを描き直すたびに新しいジョブが作られる。
+    """
+    __tablename__ = "jobs"
+
+    # GenerationJob.job_id
+    id = Column(String, primary_key=True)
+    image_id = Column(String, ForeignKey("images.id"), nullable=False)
+    device_id = Column(String, ForeignKey("devices.id"), nullable=False)
+    status = Column(String(16), nullable=False, default=JOB_QUEUED)
+    # 生成を開始した回数（推論ワーカーのクラッシュや再起動で再投入されると増える）
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    profile = Column(String(32), nullable=True)
+    cache_key = Column(String, nullable=True)
+    canvas_digest = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # 画像エントリごとの最新のジョブの取得用
+        Index("ix_jobs_image_created_at", "image_id", "created_at"),
+        # 起動時に未完了のジョブを登録順に読み込む用
+        Index("ix_jobs_status_created_at", "status", "created_at"),
     )
@@ -0,0 +1,370 @@
+# backend/app/pool.py
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from .config import settings
+from .worker import GenerationJob, JobResult, PendingResult, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_process_main(index: int, device: str, factory_path: str, job_queue, event_queue,
+                         window: float, max_batch_size: int):
+    """
+    推論プールのワーカープロセスのエントリポイント。
+    自分専用のパイプラインをdeviceに読み込み、親プロセスがこのプロセスに割り当てたジョブをjob_queueから取り出して処理する。
+    """
+    from . import generation
+    from .batcher import MicroBatcher
+    from .model_loader import load_factory
+
+    logging.basicConfig(level=logging.INFO)
+
+    def heartbeat():
+        while True:
+            event_queue.put(("heartbeat", index, None))
+            time.sleep(1.0)
+
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+
+    try:
+        pipe = load_factory(factory_path)(device)
+    except Exception as e:
+        logger.exception(f"パイプラインの読み込みに失敗しました: worker={index}, device={device}")
+        event_queue.put(("failed", index, str(e)))
+        return
+    event_queue.put(("ready", index, None))
+
+    if settings.prompt_cache_prewarm:
+        try:
+            generation.prewarm_embeddings(pipe)
+        except Exception as e:
+            logger.exception(f"プロンプト埋め込みの事前計算に失敗しました: {e}")
+
+    def emit(job: GenerationJob, payload: dict):
+        event_queue.put(("event", index, (job.to_message(), payload)))
+
+    def send_result(result: JobResult):
+        event_queue.put(("result", index, {
+            "job_id": result.job.job_id,
+            "filename": result.filename,
+            "notification": result.notification,
+            "error": result.error,
+        }))
+
+    def send_pending(pending: PendingResult, _future):
+        send_result(pending.result())
+
+    batcher = MicroBatcher(window=window, max_batch_size=max_batch_size)
+    while True:
+        jobs = [GenerationJob.from_message(m)
+                for m in batcher.collect_blocking(job_queue.get)]
+        # 処理を始めたことを通知し、クラッシュ時に親プロセスが試行回数を数えられるようにする
+        event_queue.put(("started", index, [job.job_id for job in jobs]))
+        results = generation.run_generation_batch(
+            jobs, emit=emit, batcher=batcher, pipe=pipe)
+        for result in results:
+            if isinstance(result, PendingResult):
+                # エンコードと保存が終わり次第（失敗しても）、エンコード用のスレッドから結果を送る
+                result.future.add_done_callback(functools.partial(send_pending, result))
+            else:
+                send_result(result)
+
+
+@dataclass
+class _Slot:
+    """プール内の1つのワーカープロセスの状態"""
+    index: int
+    device: str
+    process: Optional[multiprocessing.Process] = None
+    # このプロセス専用のジョブキュー（再起動のたびに作り直す）
+    job_queue: Any = None
+    state: str = "starting"
+    error: Optional[str] = None
+    restarts: int = 0
+    # 再起動を待っている（監視の対象外）
+    restarting: bool = False
+    last_heartbeat: float = field(default_factory=time.monotonic)
+    # このプロセスに割り当てて結果がまだ届いていないジョブと、そのうち処理を始めたジョブ
+    inflight: Set[str] = field(default_factory=set)
+    started: Set[str] = field(default_factory=set)
+
+    @property
+    def waiting(self) -> int:
+        """割り当て済みで、まだ処理を始めていないジョブの数"""
+        return len(self.inflight) - len(self.started)
+
+
+class InferencePool:
+    """
+    デバイスごとに1つずつ推論ワーカープロセスを立て、ジョブを各プロセス専用のキューへ割り当てる推論プール。
+    ジョブは割り当てた時点からプロセスごとに追跡し、各プロセスのハートビートを監視して、
+    クラッシュしたプロセスは再起動し、割り当てていたジョブを他のプロセス（または再起動後のプロセス）へ再投入する。
+    InferenceWorkerと同じ口（start / stop / submit / qsize / health）を持つ。
+    """
+
+    # ジョブはプロセス間で受け渡すのでキャンバスを持たせられない（ワーカープロセスはディスクから読む）
+    carries_canvas = False
+
+    def __init__(
+        self,
+        devices: List[str],
+        on_event: Callable[[GenerationJob, dict], Awaitable[None]],
+        on_result: Callable[[JobResult], Awaitable[None]],
+        maxsize: int = 32,
+        factory_path: Optional[str] = None,
+        window: float = 0.1,
+        max_batch_size: int = 4,
+        heartbeat_timeout: float = 60.0,
+        max_attempts: int = 3,
+        monitor_interval: float = 1.0,
+    ):
+        self._slots = [_Slot(index=i, device=d) for i, d in enumerate(devices)]
+        self._on_event = on_event
+        self._on_result = on_result
+        self._maxsize = maxsize
+        self._factory_path = factory_path or settings.pipeline_factory
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._heartbeat_timeout = heartbeat_timeout
+        self._max_attempts = max_attempts
+        self._monitor_interval = monitor_interval
+        # spawnにするとCUDAを使う親プロセスからでも安全に子プロセスを作れる
+        self._ctx = multiprocessing.get_context("spawn")
+        self._event_queue = self._ctx.Queue()
+        self._jobs: Dict[str, GenerationJob] = {}
+        # どのプロセスにも割り当てていないジョブ（登録順）
+        self._pending: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        # 結果の配送と再起動のタスク（完了するまで参照を持っておく）
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = False
+
+    @property
+    def qsize(self) -> int:
+        with self._lock:
+            return self._qsize()
+
+    def _qsize(self) -> int:
+        return len(self._pending) + sum(slot.waiting for slot in self._slots)
+
+    @property
+    def pipeline_state(self) -> str:
+        states = {slot.state for slot in self._slots}
+        if states & {"ready", "busy"}:
+            return "ready"
+        if states == {"failed"}:
+            return "failed"
+        return "loading"
+
+    @property
+    def pipeline_error(self) -> Optional[str]:
+        errors = [slot.error for slot in self._slots if slot.error]
+        return "; ".join(errors) if errors else None
+
+    def health(self) -> List[Dict[str, Any]]:
+        """各ワーカープロセスの状態を返す"""
+        now = time.monotonic()
+        return [{
+            "index": slot.index,
+            "device": slot.device,
+            "pid": slot.process.pid if slot.process else None,
+            "state": slot.state,
+            "restarts": slot.restarts,
+            "inflight": len(slot.inflight),
+            "heartbeat_age": round(now - slot.last_heartbeat, 1),
+        } for slot in self._slots]
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for slot in self._slots:
+            self._spawn(slot)
+        threading.Thread(target=self._event_loop,
+                         name="pool-events", daemon=True).start()
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logger.info(f"推論プールを開始しました: devices={[s.device for s in self._slots]}")
+
+    async def stop(self):
+        self._stopping = True
+        if self._monitor_task:
+            self._monitor_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        for slot in self._slots:
+            if slot.process and slot.process.is_alive():
+                slot.process.terminate()
+        logger.info("推論プールを停止しました。")
+
+    def submit(self, job: GenerationJob) -> GenerationJob:
+        """ジョブを登録し、空いているワーカープロセスに割り当てる。キューが満杯の場合はQueueFullErrorを送出する"""
+        with self._lock:
+            if self._qsize() >= self._maxsize:
+                raise QueueFullError("ジョブキューが満杯です。")
+            self._jobs[job.job_id] = job
+            self._pending.append(job.job_id)
+            self._dispatch()
+        logger.info(
+            f"ジョブをキューに追加しました: job_id={job.job_id}, image_id={job.image_id}, qsize={self.qsize}")
+        return job
+
+    def _dispatch(self):
+        """
+        未割り当てのジョブを、読み込みが済んでいて待ちの少ないワーカープロセスに割り当てる（self._lockを持って呼ぶ）。
+        各プロセスには処理中のバッチとは別に、次のバッチ1回分までを待たせておく。
+        """
+        while self._pending:
+            candidates = [slot for slot in self._slots
+                          if slot.state in ("ready", "busy") and not slot.restarting
+                          and slot.waiting < self._max_batch_size]
+            if not candidates:
+                return
+            slot = min(candidates, key=lambda s: len(s.inflight))
+            job = self._jobs.get(self._pending.popleft())
+            if job is None:
+                continue
+            slot.inflight.add(job.job_id)
+            slot.job_queue.put(job.to_message())
+
+    def _spawn(self, slot: _Slot):
+        slot.job_queue = self._ctx.Queue()
+        slot.process = self._ctx.Process(
+            target=_worker_process_main,
+            args=(slot.index, slot.device, self._factory_path, slot.job_queue,
+                  self._event_queue, self._window, self._max_batch_size),
+            name=f"inference-{slot.index}",
+            daemon=True,
+        )
+        slot.process.start()
+        slot.state = "starting"
+        slot.last_heartbeat = time.monotonic()
+        logger.info(
+            f"推論ワーカープロセスを起動しました: worker={slot.index}, device={slot.device}, pid={slot.process.pid}")
+
+    def _create_task(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _event_loop(self):
+        """ワーカープロセスからのイベントを受け取り、イベントループ上で処理する"""
+        while not self._stopping:
+            try:
+                kind, index, data = self._event_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._handle, kind, index, data)
+
+    def _handle(self, kind: str, index: int, data):
+        slot = self._slots[index]
+        if slot.restarting:
+            # 再起動を待っているプロセスの残りのイベント（割り当てていたジョブは再投入済み）
+            return
+        slot.last_heartbeat = time.monotonic()
+        if kind == "event":
+            message, payload = data
+            job = self._jobs.get(message["job_id"]) or GenerationJob.from_message(message)
+            self._create_task(self._on_event(job, payload))
+            return
+        job = None
+        with self._lock:
+            if kind == "ready":
+                slot.state, slot.error = "ready", None
+            elif kind == "failed":
+                slot.state, slot.error = "failed", data
+            elif kind == "started":
+                slot.started.update(job_id for job_id in data if job_id in slot.inflight)
+                slot.state = "busy"
+            elif kind == "result":
+                slot.inflight.discard(data["job_id"])
+                slot.started.discard(data["job_id"])
+                if not slot.inflight:
+                    slot.state = "ready"
+                job = self._jobs.pop(data["job_id"], None)
+            self._dispatch()
+        if job is not None:
+            result = JobResult(job=job, filename=data["filename"],
+                               notification=data["notification"], error=data["error"])
+            self._create_task(self._on_result(result))
+
+    async def _monitor(self):
+        """ワーカープロセスの生存とハートビートを監視し、異常があれば再起動する"""
+        while True:
+            await asyncio.sleep(self._monitor_interval)
+            now = time.monotonic()
+            for slot in self._slots:
+                if slot.restarting:
+                    continue
+                alive = slot.process is not None and slot.process.is_alive()
+                stale = now - slot.last_heartbeat > self._heartbeat_timeout
+                if alive and not stale:
+                    continue
+                if alive:
+                    logger.error(f"ハートビートが途絶えました: worker={slot.index}")
+                    slot.process.kill()
+                    slot.process.join(timeout=5)
+                else:
+                    logger.error(
+                        f"推論ワーカープロセスが終了しました: worker={slot.index}, exitcode={slot.process.exitcode}")
+                await self._recover(slot)
+
+    async def _recover(self, slot: _Slot):
+        """
+        割り当てていたジョブを再投入し、ワーカープロセスの再起動を予約する。
+        処理を始めていたジョブだけを試行として数え、上限に達したジョブは失敗として返す。
+        再起動までの待ち時間は他のプロセスの監視を止めないよう、別のタスクで待つ。
+        """
+        exhausted = []
+        with self._lock:
+            slot.restarting = True
+            # 登録順を保ったまま、未割り当てのジョブより先に処理させる
+            requeue = []
+            for job_id, job in self._jobs.items():
+                if job_id not in slot.inflight:
+                    continue
+                if job_id in slot.started:
+                    job.attempts += 1
+                    if job.attempts >= self._max_attempts:
+                        exhausted.append(job)
+                        continue
+                requeue.append(job_id)
+            for job in exhausted:
+                self._jobs.pop(job.job_id, None)
+            self._pending.extendleft(reversed(requeue))
+            slot.inflight.clear()
+            slot.started.clear()
+            slot.restarts += 1
+            # 読み込みに失敗し続けるワーカーは再起動の間隔を空ける
+            delay = min(60, 2 ** min(slot.restarts, 6)) if slot.state == "failed" else 0
+            if slot.state != "failed":
+                slot.state = "restarting"
+            self._dispatch()
+        if requeue:
+            logger.warning(f"ジョブを再投入しました: worker={slot.index}, job_ids={requeue}")
+        for job in exhausted:
+            logger.error(f"ジョブの再試行回数が上限に達しました: job_id={job.job_id}")
+            await self._on_result(JobResult(job=job, error="推論ワーカーが繰り返し異常終了しました。"))
+        self._create_task(self._restart(slot, delay))
+
+    async def _restart(self, slot: _Slot, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        if self._stopping:
+            return
+        # 前のプロセスのキューに残っていたジョブは再投入済みなので、キューごと捨てる
+        slot.job_queue.cancel_join_thread()
+        slot.job_queue.close()
+        self._spawn(slot)
+        slot.restarting = False
@@ -0,0 +1,186 @@
+# backend/app/preprocess.py
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_MODES = ("none", "binarize", "edges")
+FIT_MODES = ("stretch", "pad", "crop")
+
+# ITU-R BT.601 の輝度係数
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class InvalidPreprocessError(ValueError):
+    """前処理の設定が不正な場合に送出される"""
+
+
+def to_array(image: Image.Image) -> np.ndarray:
+    """キャンバスを白地に合成したRGBのfloat32配列（H, W, 3）に変換する"""
+    if image.mode == "RGBA" or (image.mode == "P" and "transparency" in image.info):
+        rgba = np.asarray(image.convert("RGBA"), dtype=np.float32)
+        alpha = rgba[..., 3:4] / 255.0
+        return rgba[..., :3] * alpha + 255.0 * (1.0 - alpha)
+    return np.asarray(image.convert("RGB"), dtype=np.float32)
+
+
+def to_gray(rgb: np.ndarray) -> np.ndarray:
+    return rgb @ _LUMA
+
+
+def fit(array: np.ndarray, width: int, height: int, mode: str) -> np.ndarray:
+    """
+    配列を (height, width) に合わせる。stretch は縦横比を無視して拡縮、
+    pad は縦横比を保って収まるように縮小し白で余白を埋め、crop は覆うように拡縮して中央を切り出す。
+    """
+    src_h, src_w = array.shape[:2]
+    if mode == "stretch":
+        size = (width, height)
+    else:
+        scale = (min if mode == "pad" else max)(width / src_w, height / src_h)
+        size = (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+    if size != (src_w, src_h):
+        # 拡縮だけはPILのC実装に任せる（uint8に丸めてから渡す）
+        resized = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).resize(size, Image.BILINEAR)
+        array = np.asarray(resized, dtype=np.float32)
+
+    h, w = array.shape[:2]
+    if mode == "pad" and (w, h) != (width, height):
+        out = np.full((height, width) + array.shape[2:], 255.0, dtype=np.float32)
+        top, left = (height - h) // 2, (width - w) // 2
+        out[top:top + h, left:left + w] = array
+        return out
+    if mode == "crop" and (w, h) != (width, height):
+        top, left = (h - height) // 2, (w - width) // 2
+        return array[top:top + height, left:left + width]
+    return array
+
+
+def binarize(gray: np.ndarray, threshold: int) -> np.ndarray:
+    """しきい値より暗い画素（線）を白、それ以外を黒にする（スケッチアダプターの入力は黒地に白線）"""
+    return np.where(gray < threshold, 255, 0).astype(np.uint8)
+
+
+def sobel_edges(gray: np.ndarray, threshold: int) -> np.ndarray:
+    """Sobelフィルタの勾配の大きさがしきい値を超える画素を白にする"""
+    p = np.pad(gray, 1, mode="edge")
+    gx = (p[:-2, 2:] + 2 * p[1:-1, 2:] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[1:-1, :-2] + p[2:, :-2])
+    gy = (p[2:, :-2] + 2 * p[2:, 1:-1] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[:-2, 1:-1] + p[:-2, 2:])
+    return np.where(np.hypot(gx, gy) > threshold, 255, 0).astype(np.uint8)
+
+
+def _as_rgb(image: Image.Image) -> Image.Image:
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+CacheKey = Tuple[str, int, int, str]
+
+
+class CanvasPreprocessor:
+    """
+    キャンバスをアダプターの入力に変換する前処理。
+    解像度への拡縮（stretch / pad / crop）と、二値化またはエッジ抽出をNumPyのベクトル演算で行う。
+    結果はキャンバスのダイジェストごとにLRUキャッシュし、再試行や同じキャンバスでの再生成では前処理を省く。
+    """
+
+    def __init__(self, mode: str = "binarize", fit_mode: str = "pad", threshold: int = 200,
+                 edge_threshold: int = 64, max_bytes: int = 64 * 1024 * 1024):
+        if mode not in PREPROCESS_MODES:
+            raise InvalidPreprocessError(f"不明な前処理です: {mode}（{', '.join(PREPROCESS_MODES)}）")
+        if fit_mode not in FIT_MODES:
+            raise InvalidPreprocessError(f"不明なフィット方法です: {fit_mode}（{', '.join(FIT_MODES)}）")
+        self.mode = mode
+        self.fit_mode = fit_mode
+        self.threshold = threshold
+        self.edge_threshold = edge_threshold
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Image.Image]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def signature(self) -> str:
+        """結果キャッシュのキーに含める前処理の設定"""
+        threshold = {"binarize": self.threshold, "edges": self.edge_threshold}.get(self.mode, 0)
+        return f"{self.mode}:{self.fit_mode}:{threshold}"
+
+    def __call__(self, image: Image.Image, width: int, height: int,
+                 digest: Optional[str] = None) -> Image.Image:
+        """前処理済みのRGB画像を返す。digestを渡すとキャッシュを使う"""
+        if digest is not None:
+            cached = self.lookup(digest, width, height)
+            if cached is not None:
+                return cached
+        with self._lock:
+            self.misses += 1
+        result = self.process(image, width, height)
+        if digest is not None:
+            self._put((digest, width, height, self.signature), result)
+        return _as_rgb(result)
+
+    def lookup(self, digest: Optional[str], width: int, height: int) -> Optional[Image.Image]:
+        """キャッシュ済みの前処理結果を返す（無ければNone）"""
+        if digest is None:
+            return None
+        key = (digest, width, height, self.signature)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _as_rgb(entry)
+
+    def process(self, image: Image.Image, width: int, height: int) -> Image.Image:
+        array = to_array(image)
+        if self.mode != "none":
+            array = to_gray(array)
+        array = fit(array, width, height, self.fit_mode)
+        if self.mode == "binarize":
+            return Image.fromarray(binarize(array, self.threshold), "L")
+        if self.mode == "edges":
+            return Image.fromarray(sobel_edges(array, self.edge_threshold), "L")
+        return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8), "RGB")
+
+    def _put(self, key: CacheKey, image: Image.Image):
+        # 二値化・エッジ抽出の結果は1チャンネルのまま保持し、取り出す時にRGBにする
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.width * old.height * len(old.getbands())
+            self._entries[key] = image
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+            }
+
+
+canvas_preprocessor = CanvasPreprocessor(
+    mode=settings.preprocess_mode,
+    fit_mode=settings.preprocess_fit,
+    threshold=settings.preprocess_threshold,
+    edge_threshold=settings.preprocess_edge_threshold,
+    max_bytes=settings.preprocess_cache_max_mb * 1024 * 1024,
+)
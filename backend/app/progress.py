@@ -0,0 +1,123 @@
+# backend/app/progress.py
+
+import base64
+import logging
+import time
+from io import BytesIO
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# SDXLの潜在変数（4ch）をRGBへ近似する線形射影の係数とバイアス
+SDXL_LATENT_RGB_FACTORS = np.array([
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+], dtype=np.float32)
+SDXL_LATENT_RGB_BIAS = np.array([0.1084, -0.0175, -0.0011], dtype=np.float32)
+
+
+def latents_to_previews(latents, size: int) -> List[Image.Image]:
+    """VAEを使わず、線形射影で潜在変数から低解像度のプレビュー画像を作る"""
+    array = latents.detach().float().cpu().numpy() if hasattr(
+        latents, "detach") else np.asarray(latents, dtype=np.float32)
+    # (B, 4, h, w) -> (B, h, w, 3)
+    rgb = np.einsum("bchw,cr->bhwr", array, SDXL_LATENT_RGB_FACTORS)
+    rgb += SDXL_LATENT_RGB_BIAS
+    rgb = np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+    previews = []
+    for item in rgb:
+        preview = Image.fromarray(item, mode="RGB")
+        preview.thumbnail((size, size))
+        previews.append(preview)
+    return previews
+
+
+def encode_preview(image: Image.Image, quality: int = 70) -> str:
+    """プレビュー画像をJPEGのデータURLにする"""
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+class ProgressReporter:
+    """
+    パイプラインのステップ終了コールバック（callback_on_step_end）として使い、
+    バッチ内の各ジョブに進捗とETAを、k ステップごとにプレビューを送る。
+    プレビューの生成時間が推論時間のbudget割合を超える場合はスキップする。
+    """
+
+    def __init__(
+        self,
+        jobs: list,
+        total_steps: int,
+        emit: Callable[[Any, dict], None],
+        preview_every: int = 0,
+        preview_size: int = 128,
+        budget: float = 0.03,
+    ):
+        self.jobs = jobs
+        self.total_steps = total_steps
+        self.emit = emit
+        self.preview_every = preview_every
+        self.preview_size = preview_size
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.preview_time = 0.0
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        try:
+            self._report(step, callback_kwargs.get("latents"))
+        except Exception as e:
+            logger.exception(f"進捗の送信に失敗しました: {e}")
+        return callback_kwargs
+
+    def _report(self, step: int, latents):
+        done = step + 1
+        elapsed = time.monotonic() - self.started_at
+        eta = elapsed / done * (self.total_steps - done)
+        for job in self.jobs:
+            self.emit(job, {
+                "type": "progress",
+                "step": done,
+                "totalSteps": self.total_steps,
+                "eta": round(eta, 2),
+            })
+
+        if latents is None or not self._preview_due(done, elapsed):
+            return
+        started = time.monotonic()
+        previews = latents_to_previews(latents, self.preview_size)
+        for job, preview in zip(self.jobs, previews):
+            self.emit(job, {
+                "type": "preview",
+                "step": done,
+                "image": encode_preview(preview),
+            })
+        self.preview_time += time.monotonic() - started
+
+    def _preview_due(self, done: int, elapsed: float) -> bool:
+        if self.preview_every <= 0 or done % self.preview_every != 0 or done == self.total_steps:
+            return False
+        # プレビューにかけた時間が予算を超えていれば送らない
+        return self.preview_time <= elapsed * self.budget
+
+
+def make_reporter(jobs: list, total_steps: int, emit: Optional[Callable[[Any, dict], None]]) -> Optional[ProgressReporter]:
+    """設定に従ってProgressReporterを作る（送信先が無ければNone）"""
+    if emit is None:
+        return None
+    return ProgressReporter(
+        jobs,
+        total_steps,
+        emit,
+        preview_every=settings.preview_every,
+        preview_size=settings.preview_size,
+        budget=settings.preview_budget_percent / 100,
+    )
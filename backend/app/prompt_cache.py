@@ -0,0 +1,136 @@
+# backend/app/prompt_cache.py
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PromptEmbeddings:
+    """SDXLの2つのテキストエンコーダから得られる埋め込み一式"""
+    prompt_embeds: Any
+    negative_prompt_embeds: Any
+    pooled_prompt_embeds: Any
+    negative_pooled_prompt_embeds: Any
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            t.element_size() * t.nelement()
+            for t in (self.prompt_embeds, self.negative_prompt_embeds,
+                      self.pooled_prompt_embeds, self.negative_pooled_prompt_embeds)
+            if t is not None
+        )
+
+
+CacheKey = Tuple[str, str, str]
+
+
+class PromptEmbeddingCache:
+    """
+    (prompt, negative_prompt, model_id) をキーにプロンプト埋め込みを保持するLRUキャッシュ。
+    保持している埋め込みの合計バイト数がmax_bytesを超えると古いものから破棄する。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, PromptEmbeddings]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, pipe, prompt: str, negative_prompt: str, model_id: str) -> PromptEmbeddings:
+        """キャッシュから埋め込みを取り出す。無ければパイプラインのエンコーダで計算して登録する"""
+        key = (prompt, negative_prompt, model_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._encode(pipe, prompt, negative_prompt)
+        self._put(key, entry)
+        return entry
+
+    def invalidate(self, prompt: Optional[str] = None, negative_prompt: Optional[str] = None):
+        """指定したプロンプトまたはネガティブプロンプトを含むエントリを破棄する"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == prompt or key[1] == negative_prompt:
+                    self._nbytes -= self._entries.pop(key).nbytes
+        logger.info(f"プロンプト埋め込みキャッシュを無効化しました: prompt={prompt}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def prewarm(self, pipe, pairs: Iterable[Tuple[str, str]], model_id: str):
+        """(prompt, negative_prompt) の組を事前にエンコードしてキャッシュに載せる"""
+        count = 0
+        for prompt, negative_prompt in pairs:
+            self.get(pipe, prompt, negative_prompt or "", model_id)
+            count += 1
+        logger.info(
+            f"プロンプト埋め込みを事前計算しました: {count}件, {self._nbytes / 1024 / 1024:.1f}MB")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+            }
+
+    def _encode(self, pipe, prompt: str, negative_prompt: str) -> PromptEmbeddings:
+        (
+            prompt_embeds,
+            negative_prompt_embeds,
+            pooled_prompt_embeds,
+            negative_pooled_prompt_embeds,
+        ) = pipe.encode_prompt(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+        )
+        return PromptEmbeddings(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+        )
+
+    def _put(self, key: CacheKey, entry: PromptEmbeddings):
+        size = entry.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = entry
+            self._nbytes += size
+            while self._nbytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+
+embedding_cache = PromptEmbeddingCache(
+    max_bytes=settings.prompt_cache_max_mb * 1024 * 1024)
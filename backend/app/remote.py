@@ -0,0 +1,282 @@
+# backend/app/remote.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from .worker import GenerationJob, JobResult, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+Address = Union[str, Tuple[str, int]]
+
+
+class WorkerUnavailableError(QueueFullError):
+    """推論ワーカープロセスに接続できずジョブを受け付けられない場合に送出される"""
+
+
+def parse_address(value: str) -> Address:
+    """"host:port" はTCP、それ以外はUnixソケットのパスとして解釈する"""
+    if "/" not in value and ":" in value:
+        host, port = value.rsplit(":", 1)
+        return (host, int(port))
+    return value
+
+
+class _Peer:
+    """送信をスレッド間で排他するための接続のラッパー"""
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.alive = True
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        if not self.alive:
+            return False
+        try:
+            with self.lock:
+                self.conn.send(message)
+            return True
+        except (OSError, EOFError, ValueError):
+            self.alive = False
+            return False
+
+
+class WorkerServer:
+    """
+    推論ワーカープロセス側の待ち受け。APIプロセスから届いたジョブをInferenceWorkerに渡し、
+    進捗と結果をジョブを登録したAPIプロセスへ送り返す。
+    """
+
+    def __init__(self, address: Address, authkey: bytes, status: Callable[[], Dict[str, Any]],
+                 status_interval: float = 1.0):
+        self._address = address
+        self._authkey = authkey
+        self._status = status
+        self._status_interval = status_interval
+        self._worker = None
+        self._peers: list = []
+        self._owners: Dict[str, _Peer] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[Listener] = None
+
+    def attach(self, worker):
+        self._worker = worker
+
+    async def serve_forever(self):
+        """接続の受け付けを開始し、定期的に状態をAPIプロセスへ送り続ける"""
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            # 前回のプロセスが残したUnixソケットを削除する
+            os.unlink(self._address)
+        self._listener = Listener(self._address, authkey=self._authkey)
+        logger.info(f"推論ワーカーが待ち受けを開始しました: address={self._address}")
+        threading.Thread(target=self._accept_loop,
+                         name="worker-accept", daemon=True).start()
+        while True:
+            self._broadcast({"type": "status", **self._status()})
+            await asyncio.sleep(self._status_interval)
+
+    async def on_event(self, job: GenerationJob, payload: dict):
+        peer = self._owner_of(job.job_id)
+        if peer:
+            peer.send({"type": "event", "job": job.to_message(), "payload": payload})
+
+    async def on_result(self, result: JobResult):
+        with self._lock:
+            peer = self._owners.pop(result.job.job_id, None)
+        message = {
+            "type": "result",
+            "job": result.job.to_message(),
+            "filename": result.filename,
+            "notification": result.notification,
+            "error": result.error,
+        }
+        # 登録元のAPIプロセスが居なくなっていれば、生きている別のプロセスに届ける
+        if peer is None or not peer.send(message):
+            for other in self._live_peers():
+                if other.send(message):
+                    break
+
+    def _owner_of(self, job_id: str) -> Optional[_Peer]:
+        with self._lock:
+            return self._owners.get(job_id)
+
+    def _live_peers(self) -> list:
+        with self._lock:
+            self._peers = [peer for peer in self._peers if peer.alive]
+            return list(self._peers)
+
+    def _broadcast(self, message: Dict[str, Any]):
+        for peer in self._live_peers():
+            peer.send(message)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                logger.warning(f"APIプロセスからの接続を受け付けられませんでした: {e}")
+                continue
+            peer = _Peer(conn)
+            with self._lock:
+                self._peers.append(peer)
+            logger.info("APIプロセスが接続しました。")
+            peer.send({"type": "status", **self._status()})
+            threading.Thread(target=self._read_loop, args=(peer,),
+                             name="worker-reader", daemon=True).start()
+
+    def _read_loop(self, peer: _Peer):
+        while peer.alive:
+            try:
+                message = peer.conn.recv()
+            except (EOFError, OSError):
+                peer.alive = False
+                break
+            if message.get("type") == "submit":
+                self._handle_submit(peer, message)
+        logger.info("APIプロセスとの接続が切断されました。")
+
+    def _handle_submit(self, peer: _Peer, message: Dict[str, Any]):
+        job = GenerationJob.from_message(message["job"])
+        with self._lock:
+            self._owners[job.job_id] = peer
+        reply = {"type": "submitted",
+                 "request_id": message["request_id"], "ok": True}
+        try:
+            self._worker.submit(job)
+        except QueueFullError as e:
+            with self._lock:
+                self._owners.pop(job.job_id, None)
+            reply.update(ok=False, error=str(e))
+        reply["qsize"] = self._worker.qsize
+        peer.send(reply)
+
+
+class RemoteInferenceWorker:
+    """
+    APIプロセス側から見た推論ワーカー。InferenceWorkerと同じsubmitの口を持ち、
+    ジョブはローカルのキュー（multiprocessing.connection）越しに推論ワーカープロセスへ渡される。
+    """
+
+    # 推論ワーカープロセスはキャンバスをディスクから読む
+    carries_canvas = False
+
+    def __init__(
+        self,
+        address: Address,
+        authkey: bytes,
+        on_event: Callable[[GenerationJob, dict], Awaitable[None]],
+        on_result: Callable[[JobResult], Awaitable[None]],
+        submit_timeout: float = 5.0,
+        reconnect_interval: float = 1.0,
+    ):
+        self._address = address
+        self._authkey = authkey
+        self._on_event = on_event
+        self._on_result = on_result
+        self._submit_timeout = submit_timeout
+        self._reconnect_interval = reconnect_interval
+        self._peer: Optional[_Peer] = None
+        self._pending: Dict[str, Tuple[threading.Event, Dict[str, Any]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped = threading.Event()
+        self.status: Dict[str, Any] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._peer is not None and self._peer.alive
+
+    @property
+    def qsize(self) -> int:
+        return self.status.get("qsize", 0) if self.connected else 0
+
+    @property
+    def pipeline_state(self) -> str:
+        return self.status.get("pipeline_state", "unavailable") if self.connected else "unavailable"
+
+    @property
+    def pipeline_error(self) -> Optional[str]:
+        return self.status.get("error") if self.connected else "推論ワーカーに接続できません。"
+
+    def health(self) -> list:
+        return self.status.get("workers", []) if self.connected else []
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._connect_loop,
+                         name="remote-worker", daemon=True).start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._peer:
+            self._peer.alive = False
+            self._peer.conn.close()
+
+    def submit(self, job: GenerationJob) -> GenerationJob:
+        """ジョブを推論ワーカープロセスへ送り、受理されるまで待つ"""
+        peer = self._peer
+        if peer is None or not peer.alive:
+            raise WorkerUnavailableError("推論ワーカーに接続できません。")
+        request_id = uuid.uuid4().hex
+        done = threading.Event()
+        reply: Dict[str, Any] = {}
+        self._pending[request_id] = (done, reply)
+        try:
+            if not peer.send({"type": "submit", "request_id": request_id, "job": job.to_message()}):
+                raise WorkerUnavailableError("推論ワーカーに接続できません。")
+            if not done.wait(self._submit_timeout):
+                raise WorkerUnavailableError("推論ワーカーが応答しません。")
+        finally:
+            self._pending.pop(request_id, None)
+        if not reply.get("ok"):
+            raise QueueFullError(reply.get("error") or "ジョブキューが満杯です。")
+        logger.info(
+            f"ジョブを推論ワーカーに送信しました: job_id={job.job_id}, qsize={reply.get('qsize')}")
+        return job
+
+    def _connect_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn = Client(self._address, authkey=self._authkey)
+            except Exception:
+                time.sleep(self._reconnect_interval)
+                continue
+            self._peer = _Peer(conn)
+            logger.info(f"推論ワーカーに接続しました: address={self._address}")
+            self._read_loop(self._peer)
+            logger.warning("推論ワーカーとの接続が切断されました。再接続します。")
+
+    def _read_loop(self, peer: _Peer):
+        while peer.alive:
+            try:
+                message = peer.conn.recv()
+            except (EOFError, OSError):
+                peer.alive = False
+                break
+            kind = message.get("type")
+            if kind == "status":
+                self.status = message
+            elif kind == "submitted":
+                pending = self._pending.get(message["request_id"])
+                if pending:
+                    pending[1].update(message)
+                    pending[0].set()
+            elif kind == "event":
+                job = GenerationJob.from_message(message["job"])
+                asyncio.run_coroutine_threadsafe(
+                    self._on_event(job, message["payload"]), self._loop)
+            elif kind == "result":
+                result = JobResult(
+                    job=GenerationJob.from_message(message["job"]),
+                    filename=message["filename"],
+                    notification=message["notification"],
+                    error=message["error"],
+                )
+                asyncio.run_coroutine_threadsafe(
+                    self._on_result(result), self._loop)
@@ -0,0 +1,121 @@
+# backend/app/result_cache.py
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(image: Image.Image) -> str:
+    """デコード済みキャンバスの画素のダイジェスト"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def compute_result_key(canvas_digest: str, prompt: str, negative_prompt: str, params: Dict[str, Any]) -> str:
+    """
+    キャンバスのダイジェストとプロンプト・サンプリングパラメータから結果キャッシュのキーを作る。
+    キャンバスのダイジェストはデコード済みの画素（image_digest）か、
+    再エンコードせずに保存したPNGファイルのバイト列のsha256。
+    """
+    digest = hashlib.sha256()
+    digest.update(canvas_digest.encode())
+    digest.update(json.dumps(
+        {"prompt": prompt, "negative_prompt": negative_prompt, **params},
+        sort_keys=True, ensure_ascii=False).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    生成結果のコンテンツアドレス型キャッシュ。
+    キーが同じリクエストには既存の生成画像ファイル名を返し、
+    生成中のジョブと同じキーのリクエストはそのジョブに相乗り（coalesce）させる。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._results: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def lookup(self, key: str) -> Optional[str]:
+        """キャッシュ済みの生成画像ファイル名を返す（無ければNone）"""
+        with self._lock:
+            filename = self._results.get(key)
+            if filename is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+            return filename
+
+    def forget(self, key: str):
+        """ファイルが失われた場合などにエントリを削除する"""
+        with self._lock:
+            self._results.pop(key, None)
+
+    def begin(self, key: str, job) -> Optional[Any]:
+        """
+        ジョブの開始を登録する。同じキーのジョブが既に生成中ならそのジョブに相乗りさせて
+        元のジョブを返し、そうでなければjobを生成中として登録してNoneを返す。
+        """
+        with self._lock:
+            primary = self._inflight.get(key)
+            if primary is not None:
+                primary.followers.append(job)
+                self.coalesced += 1
+                return primary
+            self._inflight[key] = job
+            self.misses += 1
+            return None
+
+    def followers_of(self, key: Optional[str]) -> List[Any]:
+        """生成中のジョブに相乗りしているジョブのリストを返す"""
+        with self._lock:
+            primary = self._inflight.get(key) if key else None
+            return list(primary.followers) if primary else []
+
+    def complete(self, key: Optional[str], filename: str) -> List[Any]:
+        """生成結果を登録し、相乗りしていたジョブのリストを返す"""
+        if not key:
+            return []
+        with self._lock:
+            primary = self._inflight.pop(key, None)
+            self._results[key] = filename
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+            return list(primary.followers) if primary else []
+
+    def fail(self, key: Optional[str]) -> List[Any]:
+        """生成中の登録を取り消し、相乗りしていたジョブのリストを返す"""
+        if not key:
+            return []
+        with self._lock:
+            primary = self._inflight.pop(key, None)
+            return list(primary.followers) if primary else []
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self._results),
+                "inflight": len(self._inflight),
+            }
+
+
+result_cache = ResultCache(max_entries=settings.result_cache_max_entries)
@@ -1,15 +1,20 @@
 # backend/app/schemas.py
 
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, computed_field
+
+from . import derivatives
+from .config import settings
 
 
 class TopicBase(BaseModel):
     name: str
     prompt: str
     negative_prompt: Optional[str] = None
+    profile: Optional[str] = None
+    weight: float = Field(1.0, ge=0)
 
     class Config:
         from_attributes = True  # Pydantic v2用に変更
@@ -38,11 +43,25 @@ class DeviceCreate(DeviceBase):
     pass
 
 
+class DeviceSummary(DeviceBase):
+    """デバイス一覧用の要約（画像そのものは含めず、集計値だけを持つ）"""
+    created_at: Optional[datetime] = None
+    image_count: int = 0
+    latest_request_time: Optional[datetime] = None
+
+
+class ListDevicesResponse(BaseModel):
+    devices: List[DeviceSummary] = []
+    # 次のページを取得するためのカーソル（最後のページではNone）
+    next_cursor: Optional[str] = None
+
+
 class ImageBase(BaseModel):
     id: str
     device_id: str
     topic_id: str
     canvas_image_filename: Optional[str] = None
+    canvas_updated_at: Optional[datetime] = None
     generated_image_filename: Optional[str] = None
     request_time: datetime
     negative_prompt: Optional[str] = None
@@ -60,6 +79,17 @@ class ImageCreate(BaseModel):
 class ImageResponse(ImageBase):
     topic: TopicResponse
 
+    # 一覧表示用のサムネイルのURL（長辺のサイズ → URL）
+    @computed_field
+    @property
+    def generated_thumbnail_urls(self) -> Dict[str, str]:
+        return derivatives.thumbnail_urls("generated", self.generated_image_filename)
+
+    @computed_field
+    @property
+    def canvas_thumbnail_urls(self) -> Dict[str, str]:
+        return derivatives.thumbnail_urls("canvas", self.canvas_image_filename, self.canvas_updated_at)
+
     class Config:
         from_attributes = True
 
@@ -93,22 +123,49 @@ class DeviceVerifyResponse(DeviceResponse):
     pass
 
 
+class RegisterDevicesRequest(BaseModel):
+    count: int = Field(..., ge=1, le=settings.max_register_devices)
+
+
+class RegisterDevicesResponse(BaseModel):
+    devices: List[DeviceResponse] = []
+
+
 class SaveCanvasRequest(BaseModel):
     device_id: str
     image_id: str
     image_data: str
     negative_prompt: Optional[str] = ""
+    profile: Optional[str] = None
 
 
 class SaveCanvasResponse(BaseModel):
     success: bool
     file_name: str
     generated_image_url: Optional[str] = None
+    job_id: Optional[str] = None
+    # 先に処理されるジョブの数と、完了までの見込み時間（秒）・見込み時刻（生成結果キャッシュにヒットした場合はNone）
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+    estimated_completion_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
 
+class JobResponse(BaseModel):
+    """画像エントリの最新の生成ジョブの状態（queued / running / succeeded / failed）"""
+    job_id: str
+    image_id: str
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    generated_image_filename: Optional[str] = None
+
+
 class GetLatestImageResponse(BaseModel):
     success: bool
     generatedImageUrl: Optional[str] = None
@@ -121,6 +178,30 @@ class GetImagesResponse(BaseModel):
     success: bool
     images: Optional[List[ImageResponse]] = None
     detail: Optional[str] = None
+    # 次のページを取得するためのカーソル（最後のページではNone）
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
+
+
+class CacheStatsResponse(BaseModel):
+    result_cache: Dict[str, int]
+    prompt_cache: Dict[str, int]
+    preprocess_cache: Dict[str, int] = {}
+    topic_cache: Dict[str, int] = {}
+
+
+class HealthResponse(BaseModel):
+    status: str
+
+
+class ReadinessResponse(BaseModel):
+    status: str
+    pipeline_state: str
+    queued_jobs: int = 0
+    detail: Optional[str] = None
+    # 推論ワーカー（推論プールではワーカープロセスごと）の状態
+    workers: List[Dict[str, Any]] = []
+    # 処理中のジョブの数とジョブ1件あたりの処理時間の移動平均（このプロセスで受け付けたジョブ）
+    admission: Dict[str, Any] = {}
@@ -0,0 +1,142 @@
+# backend/app/topic_cache.py
+
+import datetime
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedTopic:
+    """キャッシュに保持するお題（セッションから切り離した読み取り専用のコピー）"""
+    id: str
+    name: str
+    prompt: str
+    negative_prompt: Optional[str]
+    profile: Optional[str]
+    weight: float
+    created_at: Optional[datetime.datetime] = None
+
+
+def build_alias_table(weights: Sequence[float]) -> Tuple[List[float], List[int]]:
+    """
+    重み付き抽選用のエイリアス表（Vose の方法）を作る。
+    各スロット i は確率 prob[i] で i 自身を、それ以外で alias[i] を表す。
+    """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    # 残りは丸め誤差で1.0からわずかにずれたものなので、そのまま自分自身を選ばせる
+    return prob, alias
+
+
+class _Snapshot:
+    def __init__(self, topics: List[CachedTopic], version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        # 重みが0のお題は抽選の対象にしない
+        self.candidates = [t for t in topics if t.weight > 0]
+        self.topics = {t.id: t for t in topics}
+        weights = [t.weight for t in self.candidates]
+        self.uniform = len(set(weights)) <= 1
+        self.prob, self.alias = ([], []) if self.uniform else build_alias_table(weights)
+
+    def choose(self, rng: random.Random) -> Optional[CachedTopic]:
+        n = len(self.candidates)
+        if n == 0:
+            return None
+        i = rng.randrange(n)
+        if not self.uniform and rng.random() >= self.prob[i]:
+            i = self.alias[i]
+        return self.candidates[i]
+
+
+class TopicCache:
+    """
+    お題一覧をプロセス内に保持し、O(1) で一様または重み付きの抽選を行うキャッシュ。
+    お題の作成・更新時にinvalidate()でバージョンを進め、次の参照で読み直す。
+    他のプロセス（複数のAPIワーカーなど）での更新は、ttl秒ごとの読み直しで反映される（0なら期限なし）。
+    """
+
+    def __init__(self, ttl: int = 300, rng: Optional[random.Random] = None):
+        self.ttl = ttl
+        self._rng = rng or random.Random()
+        self._snapshot: Optional[_Snapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+        logger.info(f"お題キャッシュを無効化しました: version={self._version}")
+
+    def _current(self, db: Session) -> _Snapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and (
+                not self.ttl or time.monotonic() - snapshot.loaded_at < self.ttl):
+            self.hits += 1
+            return snapshot
+        version = self._version
+        topics = [
+            CachedTopic(id=t.id, name=t.name, prompt=t.prompt, negative_prompt=t.negative_prompt,
+                        profile=t.profile, weight=t.weight if t.weight is not None else 1.0,
+                        created_at=t.created_at)
+            for t in db.query(models.Topic).order_by(models.Topic.created_at, models.Topic.id)
+        ]
+        snapshot = _Snapshot(topics, version)
+        with self._lock:
+            self.loads += 1
+            # 読み込み中に無効化された場合は古い一覧を残さない（次の参照で読み直す）
+            if self._version == version:
+                self._snapshot = snapshot
+        logger.info(f"お題キャッシュを読み込みました: topics={len(topics)}, version={version}")
+        return snapshot
+
+    def topics(self, db: Session) -> List[CachedTopic]:
+        return list(self._current(db).topics.values())
+
+    def get(self, db: Session, topic_id: str) -> Optional[CachedTopic]:
+        return self._current(db).topics.get(topic_id)
+
+    def choose(self, db: Session) -> Optional[CachedTopic]:
+        """お題を重みに比例した確率で1つ選ぶ（重みが全て等しければ一様）。対象が無ければNone"""
+        return self._current(db).choose(self._rng)
+
+    def stats(self) -> Dict[str, int]:
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "loads": self.loads,
+            "version": self._version,
+            "entries": len(snapshot.topics) if snapshot else 0,
+        }
+
+
+topic_cache = TopicCache(ttl=settings.topic_cache_ttl)
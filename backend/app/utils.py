@@ -1,16 +1,64 @@
 # backend/app/utils.py
 
+import asyncio
 import base64
+import hashlib
 import logging
 import os
+import struct
+import threading
 import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
 
-from PIL import Image
+from PIL import Image, features
+
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# シグネチャ（8バイト）＋IHDRチャンク（長さ4・種別4・データ13・CRC4バイト）
+PNG_HEADER_SIZE = 33
+# キャンバスのアップロードを受信しながら書き込むとき、スレッドに渡す1回分の大きさ
+STREAM_WRITE_SIZE = 1024 * 1024
+
+
+# 保存形式ごとのPILのフォーマット名と拡張子
+IMAGE_FORMATS: Dict[str, Tuple[str, str]] = {
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+    "avif": ("AVIF", ".avif"),
+}
+
+# 画像のエンコードと書き込みを推論スレッドやリクエストの処理とは別に行うスレッドと、書き込み中のファイル
+_encoder = ThreadPoolExecutor(max_workers=settings.encode_workers, thread_name_prefix="image-encoder")
+_pending_writes: "dict[str, Future]" = {}
+_pending_lock = threading.Lock()
+
+
+class InvalidCanvasError(ValueError):
+    """アップロードされたキャンバスが不正なPNGの場合に送出される"""
+
+
+class CanvasTooLargeError(InvalidCanvasError):
+    """アップロードされたキャンバスがサイズ上限を超えた場合に送出される"""
+
+
+@dataclass
+class StoredCanvas:
+    """再エンコードせずに保存したキャンバスの情報"""
+    path: Path
+    digest: str
+    width: int
+    height: int
+    size: int
+
 
 def save_image(image_data: str, save_dir: str) -> Image.Image:
     """
@@ -29,16 +77,200 @@ def save_image(image_data: str, save_dir: str) -> Image.Image:
         raise
 
 
+def resolve_format(name: str) -> str:
+    """保存形式名を検証し、このPillowで書き出せない形式（AVIFなど）はWebPにフォールバックする"""
+    name = name.lower()
+    if name == "jpg":
+        name = "jpeg"
+    if name not in IMAGE_FORMATS:
+        logger.warning(f"不明な画像形式です: {name}。PNGで保存します。")
+        return "png"
+    if name in ("webp", "avif") and not features.check(name):
+        fallback = "webp" if name == "avif" and features.check("webp") else "png"
+        logger.warning(f"このPillowは{name}の書き出しに対応していません。{fallback}で保存します。")
+        return fallback
+    return name
+
+
+def save_options(fmt: str, quality: int) -> Dict[str, Any]:
+    """保存形式ごとのPillowのsaveオプション"""
+    if fmt == "png":
+        return {"compress_level": settings.png_compress_level}
+    if fmt == "webp":
+        return {"quality": quality, "method": 4}
+    if fmt == "avif":
+        return {"quality": quality, "speed": 8}
+    return {"quality": quality}
+
+
+def write_image(image: Image.Image, path, fmt: str, quality: int) -> Path:
+    """
+    画像をエンコードして書き出す。一時ファイルに書いてfsyncしてから置き換えるため、
+    戻った時点でファイルは完全に書き込まれており、書き込み途中のファイルが読まれることもない。
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    pil_format = IMAGE_FORMATS[fmt][0]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    try:
+        with open(temp_path, "wb") as f:
+            image.save(f, format=pil_format, **save_options(fmt, quality))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def encode_async(func: Callable, *args) -> Future:
+    """エンコードを伴う処理をエンコード用のスレッドプールで実行する"""
+    return _encoder.submit(func, *args)
+
+
+def canvas_filename(image_id: str) -> str:
+    """キャンバス画像のファイル名（拡張子はCANVAS_FORMAT）"""
+    return f"{image_id}{IMAGE_FORMATS[canvas_format][1]}"
+
+
+def save_canvas_async(image: Image.Image, path) -> Future:
+    """
+    キャンバス画像のエンコードと書き込みをエンコード用のスレッドプールに任せる。
+    形式はCANVAS_FORMAT（デフォルトは線が劣化しないPNG）。
+    """
+    path = str(path)
+
+    def write():
+        try:
+            write_image(image, path, canvas_format, settings.canvas_quality)
+            logger.info(f"キャンバス画像を保存しました: {path}")
+        except Exception as e:
+            logger.exception(f"キャンバス画像の保存に失敗しました: {e}")
+            raise
+        finally:
+            with _pending_lock:
+                if _pending_writes.get(path) is future:
+                    del _pending_writes[path]
+
+    with _pending_lock:
+        future = _encoder.submit(write)
+        _pending_writes[path] = future
+    return future
+
+
+def wait_canvas_written(path, timeout: float = 30.0):
+    """キャンバス画像の非同期の書き込みが残っていれば完了を待つ"""
+    with _pending_lock:
+        future = _pending_writes.get(str(path))
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            # 失敗はsave_canvas_asyncでログに残している。呼び出し側はファイルの有無で判断する
+            pass
+
+
 def save_generated_image(image: Image.Image, save_dir: str) -> Path:
     """
-    生成された画像を指定されたディレクトリに保存し、ファイルパスを返す。
+    生成された画像をIMAGE_FORMAT・IMAGE_QUALITYでエンコードして指定されたディレクトリに保存し、ファイルパスを返す。
     """
     try:
-        filename = f"generated_{uuid.uuid4().hex}.png"
-        file_path = Path(save_dir) / filename
-        image.save(file_path, format="PNG")
+        filename = f"generated_{uuid.uuid4().hex}{IMAGE_FORMATS[image_format][1]}"
+        file_path = write_image(image, Path(save_dir) / filename,
+                                image_format, settings.image_quality)
         logger.info(f"生成画像を保存しました: {file_path}")
         return file_path
     except Exception as e:
         logger.exception(f"生成画像の保存に失敗しました: {e}")
         return None
+
+
+# 生成画像とキャンバス画像の保存形式（起動時に一度だけ検証する）
+image_format = resolve_format(settings.image_format)
+canvas_format = resolve_format(settings.canvas_format)
+thumbnail_format = resolve_format(settings.thumbnail_format)
+
+
+def read_png_size(header: bytes) -> Tuple[int, int]:
+    """
+    PNGのシグネチャとIHDRチャンクだけを検証し、(幅, 高さ) を返す。
+    画像本体はデコードしない。
+    """
+    if len(header) < PNG_HEADER_SIZE or header[:8] != PNG_SIGNATURE:
+        raise InvalidCanvasError("PNG画像ではありません。")
+    length, chunk_type = struct.unpack(">I4s", header[8:16])
+    if chunk_type != b"IHDR" or length != 13:
+        raise InvalidCanvasError("PNGのIHDRチャンクが不正です。")
+    crc = struct.unpack(">I", header[29:33])[0]
+    if zlib.crc32(header[12:29]) != crc:
+        raise InvalidCanvasError("PNGのIHDRチャンクのCRCが一致しません。")
+    width, height = struct.unpack(">II", header[16:24])
+    if width == 0 or height == 0:
+        raise InvalidCanvasError("PNGの幅または高さが0です。")
+    return width, height
+
+
+def _write_chunks(f, digest, chunks: List[bytes]):
+    for chunk in chunks:
+        digest.update(chunk)
+        f.write(chunk)
+
+
+def _finish_file(f, digest, chunks: List[bytes]):
+    """残りのチャンクを書き込み、ファイルの内容をディスクに書き出す"""
+    _write_chunks(f, digest, chunks)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+async def store_png_stream(chunks: AsyncIterator[bytes], path: Path,
+                           max_bytes: int, max_side: int) -> StoredCanvas:
+    """
+    PNGのバイト列をデコード・再エンコードせずにそのままファイルへ書き出す。
+    ヘッダーと寸法だけを検証し、書き込みながらsha256を計算する。
+    受信したチャンクはSTREAM_WRITE_SIZEずつまとめ、ハッシュの計算とファイルの読み書きはスレッドで行う（イベントループを止めない）。
+    一時ファイルに書いてfsyncしてから置き換えるため、途中で失敗しても既存のファイルは壊れない。
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+    buffered: List[bytes] = []
+    buffered_size = 0
+    try:
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise CanvasTooLargeError(
+                        f"キャンバス画像が大きすぎます（上限 {max_bytes} バイト）。")
+                if len(header) < PNG_HEADER_SIZE:
+                    header += chunk[:PNG_HEADER_SIZE - len(header)]
+                    if len(header) == PNG_HEADER_SIZE:
+                        # 先頭だけで判定できるので、不正なデータは最後まで受信しない
+                        read_png_size(header)
+                buffered.append(chunk)
+                buffered_size += len(chunk)
+                if buffered_size >= STREAM_WRITE_SIZE:
+                    await asyncio.to_thread(_write_chunks, f, digest, buffered)
+                    buffered, buffered_size = [], 0
+            width, height = read_png_size(header)
+            if width > max_side or height > max_side:
+                raise CanvasTooLargeError(
+                    f"キャンバス画像の寸法が大きすぎます: {width}x{height}（上限 {max_side}）")
+            await asyncio.to_thread(_finish_file, f, digest, buffered)
+        finally:
+            f.close()
+        await asyncio.to_thread(os.replace, temp_path, path)
+    except BaseException:
+        # キャンセル中でも確実に消せるよう、ここだけはその場で削除する
+        temp_path.unlink(missing_ok=True)
+        raise
+    logger.info(f"キャンバス画像を再エンコードせずに保存しました: {path}, {width}x{height}, {size}バイト")
+    return StoredCanvas(path=path, digest=digest.hexdigest(), width=width, height=height, size=size)
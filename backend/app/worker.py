@@ -0,0 +1,231 @@
+# backend/app/worker.py
+
+import asyncio
+import logging
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from .batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """ジョブキューが満杯でジョブを受け付けられない場合に送出される"""
+
+
+@dataclass
+class GenerationJob:
+    image_id: str
+    device_id: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # 推論ワーカーのクラッシュなどで再投入された回数
+    attempts: int = 0
+    # リクエストで指定された生成プロファイル名（未指定ならお題・サーバーの設定に従う）
+    profile: Optional[str] = None
+    # 結果キャッシュのキーと、このジョブに相乗りしているジョブ
+    cache_key: Optional[str] = None
+    followers: List["GenerationJob"] = field(default_factory=list)
+    # キャンバスのダイジェスト（前処理結果のキャッシュのキー）
+    canvas_digest: Optional[str] = None
+    # 前処理済みのキャンバス。同一プロセス内の推論ワーカーにはディスクを経由せずに渡す
+    canvas: Optional[Any] = field(default=None, repr=False, compare=False)
+
+    def to_message(self) -> Dict[str, Any]:
+        """プロセス間でやり取りするための辞書に変換する（相乗りジョブとキャンバスは含めない）"""
+        return {f.name: getattr(self, f.name) for f in fields(self)
+                if f.name not in _LOCAL_FIELDS}
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "GenerationJob":
+        return cls(**message)
+
+
+# プロセス内でのみ意味を持ち、to_message() で送らないフィールド
+_LOCAL_FIELDS = ("followers", "canvas")
+
+
+@dataclass
+class JobResult:
+    """ジョブの処理結果。成功時はfilenameとnotification、失敗時はerrorが入る"""
+    job: GenerationJob
+    filename: Optional[str] = None
+    notification: Optional[dict] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class PendingResult:
+    """
+    生成画像のエンコードと保存が終わるとJobResultで完了するFutureと、そのジョブ。
+    Futureが例外で終わってもジョブの失敗として返せるよう、ジョブを一緒に持つ。
+    """
+    job: GenerationJob
+    future: Future
+
+    def result(self) -> JobResult:
+        """完了したFutureの結果を返す（例外で終わっていればジョブの失敗）"""
+        try:
+            return self.future.result()
+        except Exception as e:
+            logger.exception(f"生成画像の保存中にエラーが発生しました: job_id={self.job.job_id}, error={e}")
+            return JobResult(job=self.job, error="生成画像の保存に失敗しました。")
+
+
+class InferenceWorker:
+    """
+    画像生成パイプラインを専有する単一スレッドの推論ワーカー。
+    ジョブは上限付きのasyncio.Queueに積まれ、MicroBatcherでまとめられた後、
+    イベントループを塞がないよう専用スレッド上で順番に処理される。
+    生成中の進捗はon_event、各ジョブの結果はon_resultに渡される。
+    """
+
+    # 同じプロセスで動くので、ジョブに持たせた前処理済みのキャンバスをそのまま使える
+    carries_canvas = True
+
+    def __init__(
+        self,
+        handler: Callable[[List[GenerationJob], Callable[[GenerationJob, dict], None]], List[JobResult]],
+        on_event: Callable[[GenerationJob, dict], Awaitable[None]],
+        on_result: Callable[[JobResult], Awaitable[None]],
+        maxsize: int = 32,
+        batcher: Optional[MicroBatcher] = None,
+        loader=None,
+    ):
+        self._handler = handler
+        self._on_event = on_event
+        self._on_result = on_result
+        self._maxsize = maxsize
+        self._batcher = batcher or MicroBatcher()
+        self._loader = loader
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        # 生成画像の保存を待って結果を配送するタスク（完了するまで参照を持っておく）
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def pipeline_state(self) -> str:
+        return self._loader.state.value if self._loader else "ready"
+
+    @property
+    def pipeline_error(self) -> Optional[str]:
+        return self._loader.error if self._loader else None
+
+    def health(self) -> List[Dict[str, Any]]:
+        """推論スレッドの状態を返す"""
+        return [{"index": 0, "state": self.pipeline_state, "qsize": self.qsize}]
+
+    async def start(self):
+        """キューと推論スレッドを準備し、ディスパッチループを開始する"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="inference")
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"推論ワーカーを開始しました: maxsize={self._maxsize}")
+
+    async def stop(self):
+        """ディスパッチループを停止し、推論スレッドを終了する"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("推論ワーカーを停止しました。")
+
+    async def run_exclusive(self, func: Callable, *args):
+        """パイプラインを専有する推論スレッド上で任意の処理を実行する（事前計算など）"""
+        if self._executor is None:
+            raise RuntimeError("推論ワーカーが開始されていません。")
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    def emit_threadsafe(self, job: GenerationJob, payload: dict):
+        """推論スレッドから進捗イベントを送る（送信完了は待たない）"""
+        asyncio.run_coroutine_threadsafe(
+            self._on_event(job, payload), self._loop)
+
+    def submit(self, job: GenerationJob) -> GenerationJob:
+        """
+        ジョブをキューに追加する。イベントループ上からでも、
+        スレッドプールで動く同期ハンドラからでも呼び出せる。
+        キューが満杯の場合はQueueFullErrorを送出する。
+        """
+        if self._queue is None or self._loop is None:
+            raise RuntimeError("推論ワーカーが開始されていません。")
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._put(job)
+        else:
+            future = asyncio.run_coroutine_threadsafe(
+                self._put_async(job), self._loop)
+            future.result()
+        logger.info(
+            f"ジョブをキューに追加しました: job_id={job.job_id}, image_id={job.image_id}, qsize={self.qsize}")
+        return job
+
+    def _put(self, job: GenerationJob):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError("ジョブキューが満杯です。")
+
+    async def _put_async(self, job: GenerationJob):
+        self._put(job)
+
+    async def _run(self):
+        # パイプラインの読み込みが終わるまでジョブはキューに溜めておく
+        if self._loader:
+            await self._loader.wait_ready()
+        while True:
+            jobs = await self._batcher.collect(self._queue)
+            try:
+                await self._process(jobs)
+            except Exception as e:
+                logger.exception(
+                    f"ジョブ処理中にエラーが発生しました: job_ids={[job.job_id for job in jobs]}, error={e}")
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+    async def _process(self, jobs: List[GenerationJob]):
+        logger.info(
+            f"ジョブを開始します: job_ids={[job.job_id for job in jobs]}")
+        results = await self._loop.run_in_executor(
+            self._executor, self._handler, jobs, self.emit_threadsafe)
+        for result in results:
+            if isinstance(result, PendingResult):
+                # 生成画像のエンコード中でも推論スレッドは次のバッチに進み、保存が終わり次第（失敗しても）通知する
+                task = self._loop.create_task(self._deliver_when_done(result))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                await self._deliver(result)
+
+    async def _deliver_when_done(self, pending: PendingResult):
+        await asyncio.wait((asyncio.wrap_future(pending.future),))
+        await self._deliver(pending.result())
+
+    async def _deliver(self, result: JobResult):
+        if result.error:
+            logger.error(
+                f"ジョブが失敗しました: job_id={result.job.job_id}, error={result.error}")
+        await self._on_result(result)
@@ -0,0 +1,128 @@
+# backend/app/worker_main.py
+
+import asyncio
+import functools
+import logging
+
+from . import generation
+from .batcher import MicroBatcher
+from .config import settings
+from .model_loader import model_loader
+from .pool import InferencePool
+from .remote import WorkerServer, parse_address
+from .worker import InferenceWorker, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+def build_inference_worker(on_event, on_result):
+    """
+    パイプラインを専有する推論ワーカーを組み立てる（all / worker の役割で使う）。
+    WORKER_DEVICESが設定されていれば、デバイスごとのワーカープロセスからなる推論プールを返す。
+    """
+    if settings.worker_devices:
+        return InferencePool(
+            settings.worker_devices,
+            on_event=on_event,
+            on_result=on_result,
+            maxsize=settings.job_queue_size,
+            window=settings.batch_window_ms / 1000,
+            max_batch_size=settings.max_batch_size,
+            heartbeat_timeout=settings.worker_heartbeat_timeout,
+            max_attempts=settings.job_max_attempts,
+        )
+    # 同時に届いたジョブをまとめるバッチスケジューラ
+    batcher = MicroBatcher(
+        window=settings.batch_window_ms / 1000,
+        max_batch_size=settings.max_batch_size,
+    )
+    return InferenceWorker(
+        handler=functools.partial(
+            generation.run_generation_batch, batcher=batcher),
+        on_event=on_event,
+        on_result=on_result,
+        maxsize=settings.job_queue_size,
+        batcher=batcher,
+        loader=model_loader,
+    )
+
+
+async def start_inference(worker):
+    """推論ワーカーを起動し、パイプラインの読み込みと埋め込みの事前計算をバックグラウンドで始める"""
+    # 推論ワーカーはイベントループ上で起動する必要がある
+    await worker.start()
+    # 推論プールでは各ワーカープロセスが自分でパイプラインを読み込み、事前計算する
+    if not isinstance(worker, InferencePool):
+        # パイプラインは推論スレッド上でバックグラウンドに読み込む（起動は待たせない）
+        model_loader.start(worker.run_exclusive)
+        if settings.prompt_cache_prewarm:
+            # 全お題のプロンプト埋め込みを推論スレッド上で事前計算する
+            asyncio.create_task(prewarm_prompt_embeddings(worker))
+    # 新しいジョブを受け付ける前に、前回のプロセスが残した未完了のジョブを読み込んでおく
+    await recover_jobs(worker)
+
+
+async def recover_jobs(worker):
+    """
+    前回のプロセスの終了時に待機中・処理中だったジョブを読み込み、キューに空きができ次第再投入する。
+    読み込みは起動中に済ませ、再投入はバックグラウンドで行う。
+    """
+    try:
+        jobs = await asyncio.to_thread(generation.load_unfinished_jobs, settings.job_max_attempts)
+    except Exception as e:
+        logger.exception(f"未完了のジョブを読み込めませんでした: {e}")
+        return
+    if not jobs:
+        return
+    logger.info(f"未完了のジョブを再投入します: count={len(jobs)}")
+
+    async def resubmit():
+        for job in jobs:
+            while True:
+                try:
+                    worker.submit(job)
+                    break
+                except QueueFullError:
+                    await asyncio.sleep(1)
+
+    asyncio.create_task(resubmit())
+
+
+async def prewarm_prompt_embeddings(worker: InferenceWorker):
+    await model_loader.wait_ready()
+    if not model_loader.is_ready:
+        return
+    try:
+        await worker.run_exclusive(generation.prewarm_embeddings)
+    except Exception as e:
+        logger.exception(f"プロンプト埋め込みの事前計算に失敗しました: {e}")
+
+
+def worker_status(worker) -> dict:
+    return {
+        "pipeline_state": worker.pipeline_state,
+        "error": worker.pipeline_error,
+        "qsize": worker.qsize,
+        "workers": worker.health(),
+    }
+
+
+async def main():
+    """推論ワーカープロセス（APP_ROLE=worker）のエントリポイント"""
+    server = WorkerServer(
+        parse_address(settings.worker_address),
+        settings.require_worker_authkey(),
+        status=lambda: worker_status(worker),
+    )
+    worker = build_inference_worker(server.on_event, server.on_result)
+    server.attach(worker)
+    await start_inference(worker)
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    from .init_db import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+# backend/benchmarks/bench_async_handlers.py
+"""
+軽いリクエスト（/verify-device と /images/{device_id}）を大量に同時に送った時のレイテンシを、
+変更前の同期ハンドラ（同期セッションを使いスレッドプールで実行される）と、app.main の非同期ハンドラで比較する負荷試験。
+
+    cd backend && python -m benchmarks.bench_async_handlers [--requests 1000] [--concurrency 100] [--slow 30]
+
+キャンバスのデコードやサムネイルの作成のようにスレッドプールを占有する遅い同期リクエストを
+--slow 本同時に流し続け、その間に軽いリクエストがスレッドの空きを待たされるかどうかを見る。
+一時的なSQLiteデータベースを使い、HTTPクライアントはASGIアプリを直接呼び出す（ネットワークを介さない）。
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+_tmp = tempfile.TemporaryDirectory()
+# app のモジュールを読み込む前に、データベースを一時ディレクトリに向ける
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(_tmp.name) / 'bench.db'}"
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI, HTTPException, Query  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import crud, database, schemas  # noqa: E402
+from app.init_db import init_db  # noqa: E402
+from app.main import app as async_app  # noqa: E402
+
+SLOW_SECONDS = 0.2
+
+
+def slow_sync_work():
+    """スレッドプールを占有する重い処理の代わり"""
+    time.sleep(SLOW_SECONDS)
+    return {"ok": True}
+
+
+def build_legacy_app() -> FastAPI:
+    """変更前の main.py と同じ、同期セッションを使う同期ハンドラ"""
+    legacy = FastAPI()
+
+    def get_db():
+        db = database.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @legacy.post("/verify-device", response_model=schemas.DeviceVerifyResponse)
+    def verify_device(request: schemas.DeviceVerifyRequest, db: Session = Depends(get_db)):
+        db_device = crud.get_device(db, request.device_id)
+        if not db_device:
+            raise HTTPException(status_code=404)
+        latest_image = crud.get_latest_image(db, request.device_id)
+        device_response = schemas.DeviceVerifyResponse.from_orm(db_device)
+        device_response.images = [schemas.ImageResponse.from_orm(latest_image)]
+        return device_response
+
+    @legacy.get("/images/{device_id}", response_model=schemas.GetImagesResponse)
+    def get_images(device_id: str, limit: int = Query(20), db: Session = Depends(get_db)):
+        if not crud.get_device(db, device_id):
+            raise HTTPException(status_code=404)
+        images, next_cursor = crud.get_images_page(db, device_id, limit)
+        return schemas.GetImagesResponse(
+            success=True, images=[schemas.ImageResponse.from_orm(i) for i in images],
+            next_cursor=next_cursor)
+
+    legacy.add_api_route("/bench-slow", slow_sync_work)
+    return legacy
+
+
+def seed(n_devices: int, n_images: int) -> list:
+    init_db()
+    with database.SessionLocal() as db:
+        topic = crud.get_topics(db)[0]
+        device_ids = []
+        for _ in range(n_devices):
+            device = crud.create_device(db)
+            for _ in range(n_images):
+                crud.create_image(db, schemas.ImageCreate(device_id=device.id, topic_id=topic.id))
+            device_ids.append(device.id)
+        db.commit()
+    return device_ids
+
+
+async def run_load(app: FastAPI, device_ids: list, n_requests: int, concurrency: int, n_slow: int):
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    latencies = []
+    failures = 0
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def slow_loop():
+            while not stop.is_set():
+                await client.get("/bench-slow")
+
+        async def light(i: int):
+            nonlocal failures
+            device_id = random.choice(device_ids)
+            started = time.perf_counter()
+            if i % 2:
+                response = await client.post("/verify-device", json={"device_id": device_id})
+            else:
+                response = await client.get(f"/images/{device_id}", params={"limit": 20})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures += 1
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i: int):
+            async with semaphore:
+                await light(i)
+
+        slow_tasks = [asyncio.create_task(slow_loop()) for _ in range(n_slow)]
+        # 遅いリクエストがスレッドプールを埋めるのを待ってから計測を始める
+        await asyncio.sleep(SLOW_SECONDS)
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*slow_tasks)
+    return latencies, failures, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--slow", type=int, default=30)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--images", type=int, default=20)
+    args = parser.parse_args()
+
+    device_ids = seed(args.devices, args.images)
+    async_app.add_api_route("/bench-slow", slow_sync_work)
+    apps = [("sync", build_legacy_app()), ("async", async_app)]
+
+    print(f"{args.requests} light requests, concurrency {args.concurrency}, "
+          f"{args.slow} concurrent slow requests ({SLOW_SECONDS * 1000:.0f} ms each)")
+    print(f"{'handlers':<9} {'req/s':>7} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for name, app in apps:
+        latencies, failures, elapsed = asyncio.run(
+            run_load(app, device_ids, args.requests, args.concurrency, args.slow))
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{name:<9} {args.requests / elapsed:>7.0f} {quantiles[49] * 1000:>9.1f} "
+              f"{quantiles[98] * 1000:>9.1f} {failures:>7}")
+    asyncio.run(database.async_engine.dispose())
+    database.engine.dispose()
+    _tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
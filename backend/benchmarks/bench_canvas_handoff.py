@@ -0,0 +1,83 @@
+# backend/benchmarks/bench_canvas_handoff.py
+"""
+save_canvas から画像生成ジョブへのキャンバスの受け渡しを、従来のディスク経由とメモリ経由で比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_canvas_handoff [--size 1024] [--repeat 20]
+
+ディスク経由: リクエスト内でPNGを書き出し、ジョブ側でファイルを開き直してデコード・RGB変換・リサイズする
+メモリ経由: リクエスト内でアダプターの入力に揃え、書き込みはバックグラウンド（utils.save_canvas_async）、
+            ジョブ側はディスクを読まない（generation.prepare_canvas の結果をそのまま使う）
+どちらもBase64のデコードまでは共通なので、その後の処理だけを計測する。
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from app import utils
+from app.generation import prepare_canvas
+from app.profiles import resolve_profile
+
+from .bench_canvas_upload import make_canvas
+
+
+def disk_handoff(image: Image.Image, path: Path, profile):
+    started = time.perf_counter()
+    image.save(path)
+    request_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with Image.open(path) as opened:
+        opened.load()
+        prepare_canvas(opened, profile)
+    return request_time, time.perf_counter() - started
+
+
+def memory_handoff(image: Image.Image, path: Path, profile):
+    started = time.perf_counter()
+    future = utils.save_canvas_async(image, path)
+    prepare_canvas(image, profile)
+    request_time = time.perf_counter() - started
+    # 次の計測に影響しないよう書き込みの完了を待つ（リクエストの処理時間には含めない）
+    future.result()
+    return request_time, 0.0
+
+
+def measure(func, image: Image.Image, path: Path, profile, repeat: int):
+    func(image, path, profile)  # ウォームアップ
+    runs = [func(image, path, profile) for _ in range(repeat)]
+    return (statistics.median(r[0] for r in runs),
+            statistics.median(r[1] for r in runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--profile", default="standard")
+    args = parser.parse_args()
+
+    profile = resolve_profile(args.profile)
+    with Image.open(BytesIO(make_canvas(args.size))) as decoded:
+        image = decoded.convert("RGB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "canvas.png"
+        disk = measure(disk_handoff, image, path, profile, args.repeat)
+        memory = measure(memory_handoff, image, path, profile, args.repeat)
+
+    print(f"canvas {args.size}x{args.size} -> {profile.width}x{profile.height} ({profile.name})")
+    print(f"{'handoff':<8} {'request (ms)':>13} {'job (ms)':>10} {'total (ms)':>11}")
+    for name, (request_time, job_time) in (("disk", disk), ("memory", memory)):
+        print(f"{name:<8} {request_time * 1000:>13.2f} {job_time * 1000:>10.2f} "
+              f"{(request_time + job_time) * 1000:>11.2f}")
+    print(f"saved per request: {(sum(disk) - sum(memory)) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# backend/benchmarks/bench_canvas_upload.py
+"""
+キャンバス保存処理の従来経路（Base64のデータURLを含むJSON）とバイナリアップロード経路を比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_canvas_upload [--size 1024] [--repeat 20]
+
+従来経路: JSONのパース → Base64デコード → PNGデコード → RGB変換 → PNG再エンコードして保存 → 画素のハッシュ
+バイナリ経路: PNGのバイト列をそのままストリームで書き出し、ヘッダーと寸法のみ検証（utils.store_png_stream）
+MLライブラリや推論ワーカーは使わず、リクエスト1件あたりの保存処理の時間とペイロードサイズだけを計測する。
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from app import utils
+from app.result_cache import image_digest
+
+
+def make_canvas(size: int) -> bytes:
+    """手描きのキャンバスに近い、白地に線を引いたRGBAのPNGを作る"""
+    rng = random.Random(0)
+    image = Image.new("RGBA", (size, size), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        points = [(rng.randrange(size), rng.randrange(size)) for _ in range(8)]
+        draw.line(points, fill=(0, 0, 0, 255), width=rng.randint(2, 12))
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def legacy_path(body: bytes, save_dir: Path):
+    request = json.loads(body)
+    image = utils.save_image(request["image_data"], str(save_dir))
+    image.save(save_dir / "legacy.png")
+    image_digest(image)
+
+
+async def _chunks(data: bytes, chunk_size: int = 64 * 1024):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def binary_path(body: bytes, save_dir: Path):
+    asyncio.run(utils.store_png_stream(
+        _chunks(body), save_dir / "binary.png", max_bytes=64 * 1024 * 1024, max_side=8192))
+
+
+def measure(func, body: bytes, save_dir: Path, repeat: int) -> float:
+    func(body, save_dir)  # ウォームアップ
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(body, save_dir)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    png = make_canvas(args.size)
+    data_url = "data:image/png;base64," + base64.b64encode(png).decode()
+    legacy_body = json.dumps({"device_id": "d", "image_id": "i", "image_data": data_url}).encode()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        save_dir = Path(tmp)
+        legacy = measure(legacy_path, legacy_body, save_dir, args.repeat)
+        binary = measure(binary_path, png, save_dir, args.repeat)
+
+    print(f"canvas {args.size}x{args.size}, PNG {len(png) / 1024:.1f} KiB")
+    print(f"{'path':<8} {'payload (KiB)':>14} {'median (ms)':>12}")
+    print(f"{'json':<8} {len(legacy_body) / 1024:>14.1f} {legacy * 1000:>12.2f}")
+    print(f"{'binary':<8} {len(png) / 1024:>14.1f} {binary * 1000:>12.2f}")
+    print(f"speedup  x{legacy / binary:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# backend/benchmarks/bench_db_concurrency.py
+"""
+読み込みと書き込みが混在する負荷で、従来のエンジン（ロールバックジャーナル・既定のプール）と
+database.build_engine で作るエンジン（WAL・synchronous=NORMAL などのプラグマ、調整したプール）を比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_db_concurrency [--threads 16] [--seconds 5] [--write-ratio 0.2]
+
+一時的なSQLiteデータベースに履歴を作り、複数のスレッドから /images/{device_id} 相当の読み込み
+（crud.get_images_page）と、/get-new-topic と生成完了に相当する書き込み（crud.create_image と
+crud.update_generated_image）を繰り返す。調整後のエンジンで「database is locked」などのエラーが
+起きた場合は終了コード1で終わる。
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base, build_engine
+
+
+def legacy_engine(url: str):
+    """変更前の database.py と同じ設定のエンジン"""
+    return create_engine(url, connect_args={"check_same_thread": False}, pool_pre_ping=True)
+
+
+def seed(engine, n_devices: int, n_images: int):
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        topic = models.Topic(id=str(uuid.uuid4()), name="topic", prompt="prompt")
+        devices = [models.Device(id=str(uuid.uuid4())) for _ in range(n_devices)]
+        session.add_all([topic] + devices)
+        session.add_all(
+            models.Image(id=str(uuid.uuid4()), device_id=d.id, topic_id=topic.id)
+            for d in devices for _ in range(n_images))
+        session.commit()
+        return topic.id, [d.id for d in devices]
+
+
+def run(engine, topic_id: str, device_ids: list, threads: int, seconds: float, write_ratio: float):
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    latencies = {"read": [], "write": []}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed_value: int):
+        rng = random.Random(seed_value)
+        local = {"read": [], "write": []}
+        while time.perf_counter() < deadline:
+            kind = "write" if rng.random() < write_ratio else "read"
+            device_id = rng.choice(device_ids)
+            started = time.perf_counter()
+            db = Session()
+            try:
+                if kind == "read":
+                    crud.get_images_page(db, device_id, 20)
+                else:
+                    image = crud.create_image(db, schemas.ImageCreate(
+                        device_id=device_id, topic_id=topic_id))
+                    db.commit()
+                    crud.update_generated_image(db, image.id, f"generated_{image.id}.webp")
+                    db.commit()
+                local[kind].append(time.perf_counter() - started)
+            except (OperationalError, PoolTimeoutError) as e:
+                db.rollback()
+                with lock:
+                    errors.append(str(e).splitlines()[0])
+            finally:
+                db.close()
+        with lock:
+            for k, values in local.items():
+                latencies[k].extend(values)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, errors
+
+
+def p95(values: list) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=20)[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--images", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, {args.seconds:g}s, write ratio {args.write_ratio}")
+    print(f"{'engine':<8} {'reads/s':>8} {'writes/s':>9} {'read p95 (ms)':>14} "
+          f"{'write p95 (ms)':>15} {'errors':>7}")
+    failed = False
+    for name, factory in (("legacy", legacy_engine), ("tuned", build_engine)):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+            engine = factory(url)
+            Base.metadata.create_all(engine)
+            topic_id, device_ids = seed(engine, args.devices, args.images)
+            latencies, errors = run(engine, topic_id, device_ids, args.threads,
+                                    args.seconds, args.write_ratio)
+            engine.dispose()
+        reads, writes = latencies["read"], latencies["write"]
+        print(f"{name:<8} {len(reads) / args.seconds:>8.0f} {len(writes) / args.seconds:>9.0f} "
+              f"{p95(reads) * 1000:>14.1f} {p95(writes) * 1000:>15.1f} {len(errors):>7}")
+        if errors:
+            print(f"  {errors[0]}")
+            failed = failed or name == "tuned"
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# backend/benchmarks/bench_encode.py
+"""
+生成画像の保存形式（PNG / WebP / JPEG / AVIF）ごとのエンコード時間とファイルサイズを比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_encode [--size 1024] [--quality 90] [--repeat 5]
+
+utils.write_image（一時ファイルへの書き込み・fsync・置き換えまで）を計測する。
+生成画像の代わりに、なめらかなグラデーションにノイズを重ねた画像を使う。
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, features
+
+from app import utils
+
+
+def make_image(size: int) -> Image.Image:
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = np.stack([x, y, (x + y) / 2], axis=-1) * 255
+    noise = rng.normal(0, 12, base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), "RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    image = make_image(args.size)
+    print(f"image {args.size}x{args.size}, quality {args.quality}")
+    print(f"{'format':<8} {'median (ms)':>12} {'size (KiB)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, (_, ext) in utils.IMAGE_FORMATS.items():
+            if fmt in ("webp", "avif") and not features.check(fmt):
+                print(f"{fmt:<8} {'unsupported':>12}")
+                continue
+            path = Path(tmp) / f"bench{ext}"
+            times = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                utils.write_image(image, path, fmt, args.quality)
+                times.append(time.perf_counter() - started)
+            print(f"{fmt:<8} {statistics.median(times) * 1000:>12.1f} "
+                  f"{path.stat().st_size / 1024:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
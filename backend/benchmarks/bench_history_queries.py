@@ -0,0 +1,97 @@
+# backend/benchmarks/bench_history_queries.py
+"""
+画像履歴（/images/{device_id}）の1ページあたりのSQL文の数と処理時間を、履歴の長さを変えて計測するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_history_queries [--sizes 10 100 1000] [--limit 20]
+
+一時的なSQLiteデータベースにデバイスと画像を作り、crud.get_images_page と ImageResponse への変換までを
+実行して発行されたSQL文を数える。履歴の長さやページの位置によって文の数が変わる（N+1になる）場合は
+終了コード1で終わる。
+"""
+
+import argparse
+import datetime
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base
+
+
+def seed(session, n_images: int) -> str:
+    topics = [models.Topic(id=str(uuid.uuid4()), name=f"topic-{i}", prompt=f"prompt {i}")
+              for i in range(5)]
+    device = models.Device(id=str(uuid.uuid4()))
+    session.add_all(topics + [device])
+    base = datetime.datetime(2024, 1, 1)
+    session.add_all(
+        models.Image(id=str(uuid.uuid4()), device_id=device.id, topic_id=topics[i % 5].id,
+                     # 同じ時刻の画像が並んでもidで順序が決まることを確かめる
+                     request_time=base + datetime.timedelta(seconds=i // 3))
+        for i in range(n_images)
+    )
+    session.commit()
+    return device.id
+
+
+def walk_pages(session, device_id: str, limit: int, statements: list):
+    """全ページをたどり、ページごとのSQL文の数と処理時間を返す"""
+    pages = []
+    cursor = None
+    seen = set()
+    while True:
+        statements.clear()
+        started = time.perf_counter()
+        images, cursor = crud.get_images_page(session, device_id, limit, cursor)
+        [schemas.ImageResponse.model_validate(img) for img in images]
+        pages.append((len(statements), time.perf_counter() - started))
+        ids = {img.id for img in images}
+        assert not ids & seen, "ページ間で画像が重複しています"
+        seen |= ids
+        session.expunge_all()
+        if cursor is None:
+            return pages, len(seen)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    counts = set()
+    print(f"{'images':>7} {'pages':>6} {'SQL/page':>9} {'ms/page':>8}")
+    for n_images in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            Base.metadata.create_all(engine)
+            statements: list = []
+            event.listen(engine, "before_cursor_execute",
+                         lambda *a, **k: statements.append(a[2]))
+            session = sessionmaker(bind=engine)()
+            device_id = seed(session, n_images)
+            session.expunge_all()
+            pages, total = walk_pages(session, device_id, args.limit, statements)
+            session.close()
+            engine.dispose()
+
+        assert total == n_images, f"取得件数が一致しません: {total} != {n_images}"
+        per_page = {count for count, _ in pages}
+        counts |= per_page
+        ms = sum(t for _, t in pages) / len(pages) * 1000
+        print(f"{n_images:>7} {len(pages):>6} {'/'.join(map(str, sorted(per_page))):>9} {ms:>8.2f}")
+
+    if len(counts) != 1:
+        print(f"1ページあたりのSQL文の数が一定ではありません: {sorted(counts)}")
+        sys.exit(1)
+    print(f"OK: 1ページあたり {counts.pop()} 文（履歴の長さによらず一定）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# backend/benchmarks/bench_list_devices.py
+"""
+/list-devices の従来の実装（全デバイスと全画像・お題をリレーション経由で読み込む）と、
+集計クエリによるページング・NDJSONストリーミングのメモリ使用量と時間を比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_list_devices [--devices 10000] [--images 20] [--skip-legacy]
+
+一時的なSQLiteデータベースにデバイスと画像を作り、tracemallocで各方式のピークメモリを計測する。
+"""
+
+import argparse
+import datetime
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base
+
+
+def seed(engine, n_devices: int, n_images: int):
+    base = datetime.datetime(2024, 1, 1)
+    topic_ids = [str(uuid.uuid4()) for _ in range(10)]
+    with engine.begin() as conn:
+        conn.execute(insert(models.Topic), [
+            {"id": t, "name": f"topic-{i}", "prompt": f"prompt {i}"} for i, t in enumerate(topic_ids)])
+        for start in range(0, n_devices, 1000):
+            devices = [{"id": str(uuid.uuid4()), "created_at": base + datetime.timedelta(seconds=i)}
+                       for i in range(start, min(start + 1000, n_devices))]
+            conn.execute(insert(models.Device), devices)
+            conn.execute(insert(models.Image), [
+                {"id": str(uuid.uuid4()), "device_id": d["id"], "topic_id": topic_ids[j % 10],
+                 "canvas_image_filename": None,
+                 "request_time": d["created_at"] + datetime.timedelta(minutes=j)}
+                for d in devices for j in range(n_images)])
+
+
+def legacy(session):
+    devices = session.query(models.Device).all()
+    return len([schemas.DeviceResponse.model_validate(d).model_dump_json() for d in devices])
+
+
+def paginated(session):
+    devices, _ = crud.get_device_summaries(session, 100)
+    return len([d.model_dump_json() for d in devices])
+
+
+def ndjson(session):
+    count = 0
+    for summary in crud.iter_device_summaries(session):
+        summary.model_dump_json()
+        count += 1
+    return count
+
+
+def measure(func, Session):
+    session = Session()
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = func(session)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    session.close()
+    return count, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(engine)
+        seed(engine, args.devices, args.images)
+        Session = sessionmaker(bind=engine)
+
+        print(f"{args.devices} devices x {args.images} images")
+        print(f"{'method':<12} {'devices':>8} {'seconds':>8} {'peak (MiB)':>11}")
+        methods = [("page(100)", paginated), ("ndjson", ndjson)]
+        if not args.skip_legacy:
+            methods.insert(0, ("legacy", legacy))
+        for name, func in methods:
+            count, elapsed, peak = measure(func, Session)
+            print(f"{name:<12} {count:>8} {elapsed:>8.2f} {peak:>11.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
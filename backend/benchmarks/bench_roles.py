@@ -0,0 +1,71 @@
+# backend/benchmarks/bench_roles.py
+"""
+役割（api / worker / all）ごとのコールドスタート時間とRSSを計測するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_roles [--repeat 3] [--load-model]
+
+各役割を別プロセスで起動し、モジュールのインポートにかかった時間と最大RSSを表示する。
+--load-model を付けると worker / all では実際にパイプラインの読み込みまで計測する。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - started
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb,
+                   "torch_loaded": "torch" in sys.modules}}))
+"""
+
+ROLES = {
+    # APIのみ: MLライブラリを一切インポートしない
+    "api": ("api", "import app.main"),
+    # 推論ワーカー: ワーカー本体と画像生成モジュール
+    "worker": ("worker", "import app.worker_main\nimport app.image_generater as g{load}"),
+    # API＋推論を1プロセスで動かす従来の構成
+    "all": ("all", "import app.main\nimport app.image_generater as g{load}"),
+}
+
+
+def run_role(role: str, load_model: bool) -> dict:
+    app_role, body = ROLES[role]
+    body = body.format(load="\ng.load_pipeline()" if load_model else "")
+    env = dict(os.environ, APP_ROLE=app_role)
+    # api / worker の役割はプロセス間接続の秘密鍵が無いと起動しない
+    env.setdefault("WORKER_AUTHKEY", "bench-roles")
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(body=body)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--load-model", action="store_true")
+    parser.add_argument("--roles", nargs="*", default=list(ROLES))
+    args = parser.parse_args()
+
+    print(f"{'role':<8} {'start (s)':>10} {'RSS (MB)':>10} {'torch':>6}")
+    for role in args.roles:
+        try:
+            runs = [run_role(role, args.load_model) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{role:<8} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        seconds = statistics.median(r["seconds"] for r in runs)
+        rss = statistics.median(r["rss_mb"] for r in runs)
+        print(f"{role:<8} {seconds:>10.2f} {rss:>10.1f} {str(runs[0]['torch_loaded']):>6}")
+
+
+if __name__ == "__main__":
+    main()
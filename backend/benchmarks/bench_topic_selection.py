@@ -0,0 +1,124 @@
+# backend/benchmarks/bench_topic_selection.py
+"""
+お題の抽選（/register-device・/get-new-topic）について、毎回全お題を読み込む従来の方法と
+topic_cache による抽選の1回あたりの時間とSQL文の数を比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_topic_selection [--topics 10 100 1000] [--draws 20000]
+
+一時的なSQLiteデータベースにお題を作り、以下を確かめる。満たさない場合は終了コード1で終わる。
+- キャッシュの読み込み後はSQL文を発行しない
+- 重みに比例した頻度で選ばれる（重み0のお題は選ばれない）
+- crud.update_topic で重みを変えると次の抽選から反映される
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base
+from app.topic_cache import TopicCache
+
+
+def seed(session, n_topics: int):
+    session.add_all(
+        models.Topic(id=str(uuid.uuid4()), name=f"topic-{i}", prompt=f"prompt {i}",
+                     weight=float(i % 4))
+        for i in range(n_topics)
+    )
+    session.commit()
+
+
+def legacy(session):
+    return random.choice(session.query(models.Topic).all())
+
+
+def check_distribution(counts: Counter, weights: dict, draws: int) -> list:
+    """各お題の出現頻度が期待値から大きく外れていないかを調べ、問題のあったお題の説明を返す"""
+    total = sum(weights.values())
+    errors = []
+    for topic_id, weight in weights.items():
+        expected = draws * weight / total
+        got = counts.get(topic_id, 0)
+        if weight == 0 and got:
+            errors.append(f"重み0のお題が選ばれました: {topic_id} x{got}")
+        # 二項分布の標準偏差の6倍を許容範囲とする
+        elif weight and abs(got - expected) > 6 * (expected * (1 - weight / total)) ** 0.5 + 1:
+            errors.append(f"頻度が期待値から外れています: {topic_id} {got} (期待値 {expected:.0f})")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--topics", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--draws", type=int, default=20000)
+    args = parser.parse_args()
+
+    errors = []
+    print(f"{'topics':>7} {'legacy (us)':>12} {'cached (us)':>12} {'SQL/draw':>9}")
+    for n_topics in args.topics:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            Base.metadata.create_all(engine)
+            statements: list = []
+            event.listen(engine, "before_cursor_execute",
+                         lambda *a, **k: statements.append(a[2]))
+            session = sessionmaker(bind=engine)()
+            seed(session, n_topics)
+
+            legacy_draws = min(args.draws, 2000)
+            started = time.perf_counter()
+            for _ in range(legacy_draws):
+                legacy(session)
+            legacy_us = (time.perf_counter() - started) / legacy_draws * 1e6
+
+            cache = TopicCache(ttl=0, rng=random.Random(0))
+            cache.choose(session)
+            statements.clear()
+            started = time.perf_counter()
+            counts = Counter(cache.choose(session).id for _ in range(args.draws))
+            cached_us = (time.perf_counter() - started) / args.draws * 1e6
+            sql_per_draw = len(statements) / args.draws
+            print(f"{n_topics:>7} {legacy_us:>12.1f} {cached_us:>12.2f} {sql_per_draw:>9.3f}")
+
+            if statements:
+                errors.append(f"{n_topics}件: キャッシュ済みの抽選でSQL文が発行されました ({len(statements)}文)")
+            weights = {t.id: t.weight for t in session.query(models.Topic)}
+            errors += [f"{n_topics}件: {e}" for e in check_distribution(counts, weights, args.draws)]
+            session.close()
+            engine.dispose()
+
+    # update_topic による無効化（アプリ全体で共有するtopic_cacheを使う）
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        a = crud.create_topic(session, schemas.TopicCreate(name="a", prompt="a", weight=1))
+        b = crud.create_topic(session, schemas.TopicCreate(name="b", prompt="b", weight=0))
+        session.commit()
+        before = {crud.get_random_topic(session).id for _ in range(200)}
+        crud.update_topic(session, a.id, schemas.TopicCreate(name="a", prompt="a", weight=0))
+        crud.update_topic(session, b.id, schemas.TopicCreate(name="b", prompt="b", weight=1))
+        session.commit()
+        after = {crud.get_random_topic(session).id for _ in range(200)}
+        if before != {a.id} or after != {b.id}:
+            errors.append("update_topic による重みの変更が抽選に反映されていません")
+        session.close()
+        engine.dispose()
+
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: キャッシュ済みの抽選はSQL文を発行せず、重みに比例して選ばれる")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# backend/benchmarks/bench_ws_fanout.py
+"""
+1つのデバイスに複数のWebSocket接続があり、そのうち1本が遅い（送信に時間がかかる）場合に、
+他の接続へ通知が届くまでの時間を、接続を順番に送る方法と hub.NotificationHub で比較するベンチマーク。
+
+    cd backend && python -m benchmarks.bench_ws_fanout [--connections 50] [--messages 20] [--slow-ms 200]
+
+実際のソケットの代わりに、送信にかかる時間を指定できる偽のWebSocketを使う。以下を満たさない場合は終了コード1で終わる。
+- 遅い接続があっても、他の接続への配送が遅い接続の送信時間に引きずられない
+- 切断中に送られた通知が、last_seq を渡した再接続で欠けずに順番どおり再送される
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from app.hub import NotificationHub
+
+
+class FakeWebSocket:
+    """送信ごとにdelay秒かかるWebSocketの代わり"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append((time.perf_counter(), json.loads(text)))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def sequential(sockets, messages: int):
+    """変更前の ConnectionManager.send_message と同じく、接続を1本ずつ待って送る"""
+    sent_at = []
+    for i in range(messages):
+        sent_at.append(time.perf_counter())
+        for ws in sockets:
+            await ws.send_text(json.dumps({"type": "completed", "n": i}))
+    return sent_at
+
+
+async def fanout(hub: NotificationHub, device_id: str, messages: int):
+    sent_at = []
+    for i in range(messages):
+        sent_at.append(time.perf_counter())
+        await hub.deliver(device_id, {"type": "completed", "n": i})
+    return sent_at
+
+
+def delivery_latencies(sockets, sent_at) -> list:
+    """速い接続それぞれについて、送信を始めてから受け取るまでの時間"""
+    latencies = []
+    for ws in sockets:
+        messages = [m for m in ws.received if m[1].get("type") == "completed"]
+        latencies += [received - sent_at[m["n"]] for received, m in messages]
+    return latencies
+
+
+async def run(args) -> list:
+    errors = []
+    slow_delay = args.slow_ms / 1000
+
+    fast = [FakeWebSocket() for _ in range(args.connections - 1)]
+    sent_at = await sequential([FakeWebSocket(slow_delay), *fast], args.messages)
+    legacy = delivery_latencies(fast, sent_at)
+
+    hub = NotificationHub(heartbeat_interval=0, send_timeout=60, queue_size=args.messages + 1)
+    fast = [FakeWebSocket() for _ in range(args.connections - 1)]
+    for ws in [FakeWebSocket(slow_delay), *fast]:
+        await hub.connect("device", ws)
+    sent_at = await fanout(hub, "device", args.messages)
+    await asyncio.sleep(0.05)
+    tuned = delivery_latencies(fast, sent_at)
+
+    for name, values in (("sequential", legacy), ("hub", tuned)):
+        print(f"{name:<11} p50 {statistics.median(values) * 1000:>8.2f} ms  "
+              f"max {max(values) * 1000:>8.2f} ms")
+    if len(tuned) != len(fast) * args.messages:
+        errors.append(f"届いていない通知があります: {len(tuned)} / {len(fast) * args.messages}")
+    elif max(tuned) >= slow_delay:
+        errors.append("遅い接続の送信が他の接続への配送を遅らせています")
+
+    # 切断中の通知の再送
+    ws = FakeWebSocket()
+    connection = await hub.connect("resume", ws)
+    await hub.deliver("resume", {"type": "completed", "n": 0})
+    await asyncio.sleep(0.01)
+    last_seq = ws.received[-1][1]["seq"]
+    await hub.disconnect(connection)
+    for i in range(1, 4):
+        await hub.deliver("resume", {"type": "completed", "n": i})
+        await hub.deliver("resume", {"type": "progress", "step": i})
+    ws = FakeWebSocket()
+    await hub.connect("resume", ws, last_seq=last_seq)
+    await asyncio.sleep(0.01)
+    replayed = [m.get("n") for _, m in ws.received if m["type"] == "completed"]
+    if replayed != [1, 2, 3]:
+        errors.append(f"再送された通知が正しくありません: {replayed}")
+    await hub.stop()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--slow-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.connections} connections (1 slow, {args.slow_ms:g} ms/send), {args.messages} messages")
+    errors = asyncio.run(run(args))
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: 遅い接続があっても他の接続へすぐに配送され、切断中の通知は再接続時に再送される")
+
+
+if __name__ == "__main__":
+    main()
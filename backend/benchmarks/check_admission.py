@@ -0,0 +1,126 @@
+# backend/benchmarks/check_admission.py
+"""
+混雑時（多数のデバイスが一斉にキャンバスを送る場合）に admission.AdmissionController が
+処理中のジョブの数を制限し、受け付けたジョブに妥当な完了見込み時間を返すかを確かめるスクリプト。
+
+    cd backend && python -m benchmarks.check_admission [--devices 40] [--rounds 3] [--job-ms 40] [--batch 4]
+
+実際の推論の代わりに、ジョブをまとめて job-ms × バッチの大きさ だけかけて処理する偽の推論ワーカーを使う。
+以下を満たさない場合は終了コード1で終わる。
+- 処理中のジョブの数が全体・デバイスごとの上限を超えない
+- 上限を超えたリクエストはRetry-After（1秒以上）付きで断られる
+- 移動平均が実際のジョブ1件あたりの処理時間に近づき、完了見込み時間の誤差の中央値が小さい
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+
+from app.admission import AdmissionController, AdmissionRejectedError
+
+# 完了見込み時間の誤差（実際の待ち時間に対する割合）の中央値の上限
+MAX_ETA_ERROR = 0.35
+
+
+class FakeWorker:
+    """キューからジョブを最大batch件ずつ取り出し、job_seconds × 件数 だけかけて処理する推論ワーカーの代わり"""
+
+    def __init__(self, controller: AdmissionController, job_seconds: float, batch: int):
+        self.controller = controller
+        self.job_seconds = job_seconds
+        self.batch = batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.completed = {}
+
+    async def run(self):
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.batch and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            await asyncio.sleep(self.job_seconds * len(jobs))
+            for job_id in jobs:
+                self.controller.complete(job_id, succeeded=True)
+                self.completed[job_id] = time.monotonic()
+
+
+async def run(args) -> list:
+    errors = []
+    job_seconds = args.job_ms / 1000
+    controller = AdmissionController(
+        max_in_flight=args.max_in_flight, max_per_device=args.per_device,
+        initial_job_seconds=1, window=32)
+    worker = FakeWorker(controller, job_seconds, args.batch)
+    task = asyncio.create_task(worker.run())
+
+    devices = [f"device-{i}" for i in range(args.devices)]
+    accepted = {}
+    retry_after = []
+    peak = 0
+    for round_ in range(args.rounds):
+        # 全てのデバイスがほぼ同時に2回ずつ送る（2回目はデバイスごとの上限に当たりうる）
+        for _ in range(2):
+            for device_id in devices:
+                job_id = uuid.uuid4().hex
+                try:
+                    ticket = controller.admit(job_id, device_id)
+                except AdmissionRejectedError as e:
+                    retry_after.append(e.retry_after)
+                    continue
+                accepted[job_id] = (time.monotonic(), ticket, round_)
+                worker.queue.put_nowait(job_id)
+                stats = controller.stats()
+                peak = max(peak, stats["in_flight"])
+        # 次の波は前の波がはけてから
+        while controller.stats()["in_flight"]:
+            await asyncio.sleep(job_seconds)
+    task.cancel()
+
+    stats = controller.stats()
+    print(f"accepted {len(accepted)}, rejected {len(retry_after)}, peak in-flight {peak}, "
+          f"job_seconds {stats['job_seconds']:.3f} (actual {job_seconds:.3f})")
+    if peak > args.max_in_flight:
+        errors.append(f"処理中のジョブが上限を超えました: {peak} > {args.max_in_flight}")
+    if not retry_after:
+        errors.append("上限を超えたリクエストが断られていません")
+    elif min(retry_after) < 1:
+        errors.append(f"Retry-Afterが1秒未満です: {min(retry_after)}")
+    if stats["in_flight"] or stats["devices"]:
+        errors.append(f"登録が解除されていないジョブがあります: {stats}")
+
+    # 最初の波は計測前の初期値で見積もるので、2回目以降の波の見込み時間の誤差を調べる
+    eta_errors = []
+    for job_id, (admitted_at, ticket, round_) in accepted.items():
+        if round_ == 0:
+            continue
+        actual = worker.completed[job_id] - admitted_at
+        eta_errors.append(abs(ticket.eta_seconds - actual) / actual)
+    if eta_errors:
+        median = statistics.median(eta_errors)
+        print(f"ETA error: median {median * 100:.1f}%, max {max(eta_errors) * 100:.1f}%")
+        if median > MAX_ETA_ERROR:
+            errors.append(f"完了見込み時間の誤差が大きすぎます: {median * 100:.1f}%")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--job-ms", type=float, default=40)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=36)
+    parser.add_argument("--per-device", type=int, default=1)
+    args = parser.parse_args()
+
+    errors = asyncio.run(run(args))
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: 処理中のジョブは上限以内に保たれ、完了見込み時間は実際の処理時間に近い")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# backend/benchmarks/check_batcher.py
+"""
+推論ワーカー（worker.InferenceWorker）の batcher.MicroBatcher が、同時に届いたジョブをまとめ、
+単独のジョブは待ち時間（window）が過ぎたら待たずに処理するかを確かめるスクリプト。
+
+    cd backend && python -m benchmarks.check_batcher [--window-ms 100] [--batch 4] [--burst 9] [--job-ms 50]
+
+実際の推論の代わりに、呼ばれるたびに受け取ったバッチの大きさを記録し、job-ms だけ待って画像を返す
+偽のパイプラインを使う。以下を満たさない場合は終了コード1で終わる。
+- 一斉に届いたジョブがバッチにまとめられ、どのバッチもmax_batch_sizeを超えない
+- パラメータの異なるジョブは同じパイプライン呼び出しにまとめられない
+- 単独のジョブは、windowが過ぎたら大きさ1のバッチとして処理される
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from PIL import Image
+
+from app.batcher import GenerationParams, GenerationRequest, MicroBatcher
+from app.worker import GenerationJob, InferenceWorker, JobResult
+
+PARAMS = GenerationParams(num_inference_steps=4, guidance_scale=7.5,
+                          adapter_conditioning_scale=0.9, width=64, height=64,
+                          scheduler="euler_a")
+
+
+class FakePipeline:
+    """呼び出しごとのバッチの大きさと各画像の幅を記録し、job_seconds 待って画像を返すパイプラインの代わり"""
+
+    class Output:
+        def __init__(self, images):
+            self.images = images
+
+    def __init__(self, job_seconds: float):
+        self.job_seconds = job_seconds
+        self.calls = []
+
+    def __call__(self, image, **kwargs):
+        self.calls.append((len(image), image[0].width))
+        time.sleep(self.job_seconds)
+        return self.Output([Image.new("RGB", (8, 8)) for _ in image])
+
+
+def make_handler(pipe: FakePipeline, batcher: MicroBatcher, params: dict):
+    """generation.run_generation_batch と同じ順序（グループ化してから1グループずつ生成）でジョブを処理する"""
+
+    def handler(jobs, emit):
+        requests = []
+        for job in jobs:
+            job_params = params[job.job_id]
+            requests.append(GenerationRequest(
+                job=job, prompt="p", negative_prompt="",
+                image=Image.new("RGB", (job_params.width, job_params.height)), params=job_params))
+        results = []
+        for batch in batcher.group(requests):
+            for request, _ in batcher.run(pipe, batch):
+                results.append(JobResult(job=request.job, filename=f"{request.job.job_id}.png"))
+        return results
+
+    return handler
+
+
+async def run(args) -> list:
+    errors = []
+    window = args.window_ms / 1000
+    pipe = FakePipeline(args.job_ms / 1000)
+    batcher = MicroBatcher(window=window, max_batch_size=args.batch)
+    params = {}
+    completed = {}
+
+    async def on_event(job, payload):
+        pass
+
+    async def on_result(result):
+        completed[result.job.job_id] = time.monotonic()
+
+    worker = InferenceWorker(make_handler(pipe, batcher, params), on_event, on_result,
+                             maxsize=args.burst * 2, batcher=batcher)
+    await worker.start()
+
+    def submit(count: int, job_params: GenerationParams) -> list:
+        jobs = [GenerationJob(image_id=f"image-{i}", device_id=f"device-{i}") for i in range(count)]
+        for job in jobs:
+            params[job.job_id] = job_params
+            worker.submit(job)
+        return jobs
+
+    async def drain(jobs: list, timeout: float):
+        deadline = time.monotonic() + timeout
+        while not all(job.job_id in completed for job in jobs):
+            if time.monotonic() > deadline:
+                errors.append(f"処理されないジョブがあります: {sum(j.job_id not in completed for j in jobs)}件")
+                return
+            await asyncio.sleep(0.005)
+
+    try:
+        # 一斉に届いたジョブ
+        burst = submit(args.burst, PARAMS)
+        await drain(burst, timeout=10)
+        sizes = [size for size, _ in pipe.calls]
+        print(f"burst of {args.burst}: batch sizes {sizes}")
+        if sum(sizes) != args.burst:
+            errors.append(f"生成枚数がジョブ数と一致しません: {sum(sizes)} != {args.burst}")
+        if max(sizes) > args.batch:
+            errors.append(f"バッチがmax_batch_sizeを超えました: {max(sizes)} > {args.batch}")
+        if sizes[0] != min(args.burst, args.batch):
+            errors.append(f"一斉に届いたジョブがまとめられていません: 最初のバッチ {sizes[0]}件")
+
+        # 同じwindowに届いた、解像度の異なるジョブ
+        pipe.calls.clear()
+        other = GenerationParams(**{**PARAMS.__dict__, "width": 128})
+        mixed = submit(2, PARAMS) + submit(2, other)
+        await drain(mixed, timeout=10)
+        print(f"mixed params: calls {pipe.calls}")
+        if any(size != 2 for size, _ in pipe.calls) or {w for _, w in pipe.calls} != {64, 128}:
+            errors.append(f"パラメータごとにまとめられていません: {pipe.calls}")
+
+        # 単独のジョブ
+        pipe.calls.clear()
+        submitted = time.monotonic()
+        lone = submit(1, PARAMS)
+        await drain(lone, timeout=10)
+        latency = completed[lone[0].job_id] - submitted
+        limit = window + args.job_ms / 1000 + args.slack_ms / 1000
+        print(f"lone job: batch sizes {[size for size, _ in pipe.calls]}, latency {latency * 1000:.0f} ms "
+              f"(window {args.window_ms:.0f} ms, limit {limit * 1000:.0f} ms)")
+        if [size for size, _ in pipe.calls] != [1]:
+            errors.append(f"単独のジョブが大きさ1のバッチで処理されていません: {pipe.calls}")
+        if latency < window:
+            errors.append(f"windowが過ぎる前に処理されました: {latency * 1000:.0f} ms")
+        elif latency > limit:
+            errors.append(f"windowが過ぎても処理されませんでした: {latency * 1000:.0f} ms")
+    finally:
+        await worker.stop()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--window-ms", type=float, default=100)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--burst", type=int, default=9)
+    parser.add_argument("--job-ms", type=float, default=50)
+    # 単独のジョブの待ち時間に許す、window＋生成時間からの超過分
+    parser.add_argument("--slack-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    errors = asyncio.run(run(args))
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: 一斉に届いたジョブはmax_batch_size以内のバッチにまとめられ、単独のジョブはwindow経過後に処理された")
+
+
+if __name__ == "__main__":
+    main()
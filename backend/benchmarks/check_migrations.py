@@ -0,0 +1,119 @@
+# backend/benchmarks/check_migrations.py
+"""
+生成プロファイル（topics.profile）やお題の重み（topics.weight）などの列が追加される前に作られた既存のデータベース（app.db）が、
+起動時の init_db（migrations.upgrade）で今のスキーマに更新され、そのまま使えるかを確かめるスクリプト。
+
+    cd backend && python -m benchmarks.check_migrations
+
+一時ディレクトリに最初の版のスキーマ（devices / topics / images のみ）でデータベースを作ってお題と画像を入れ、
+init_db を2回呼んでから以下を満たさない場合は終了コード1で終わる。
+- モデルに定義された全ての列がテーブルにある
+- スキーマバージョンが最新のマイグレーションの番号になる（2回目の起動では何もしない）
+- 既存のお題はプロファイル未指定（サーバーのデフォルト）・重み1として読め、画像エントリも読める
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import uuid
+
+from sqlalchemy import (Column, DateTime, ForeignKey, MetaData, String, Table, Text,
+                        UniqueConstraint, create_engine, inspect)
+
+# 最初の版（生成プロファイルの追加前）のスキーマ
+legacy = MetaData()
+Table("devices", legacy,
+      Column("id", String, primary_key=True, index=True, unique=True),
+      Column("created_at", DateTime))
+Table("topics", legacy,
+      Column("id", String, primary_key=True, index=True, unique=True),
+      Column("name", String(100), unique=True, nullable=False),
+      Column("prompt", Text, nullable=False),
+      Column("negative_prompt", Text, nullable=True),
+      Column("created_at", DateTime))
+Table("images", legacy,
+      Column("id", String, primary_key=True, index=True, unique=True),
+      Column("device_id", String, ForeignKey("devices.id"), nullable=False),
+      Column("topic_id", String, ForeignKey("topics.id"), nullable=False),
+      Column("canvas_image_filename", String, nullable=True),
+      Column("generated_image_filename", String, nullable=True),
+      Column("request_time", DateTime),
+      Column("negative_prompt", Text, nullable=True),
+      UniqueConstraint("device_id", "id", name="unique_device_image"))
+
+
+def create_legacy_database(url: str) -> dict:
+    """最初の版のスキーマでデータベースを作り、お題・デバイス・画像を1件ずつ入れる"""
+    now = datetime.datetime.utcnow()
+    ids = {"device": str(uuid.uuid4()), "topic": str(uuid.uuid4()), "image": str(uuid.uuid4())}
+    engine = create_engine(url)
+    legacy.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(legacy.tables["devices"].insert().values(id=ids["device"], created_at=now))
+        conn.execute(legacy.tables["topics"].insert().values(
+            id=ids["topic"], name="ロボット", prompt="robot", negative_prompt="", created_at=now))
+        conn.execute(legacy.tables["images"].insert().values(
+            id=ids["image"], device_id=ids["device"], topic_id=ids["topic"], request_time=now))
+    engine.dispose()
+    return ids
+
+
+def run(ids: dict) -> list:
+    from app import crud, database, migrations, models
+    from app.init_db import init_db
+    from app.profiles import resolve_profile
+
+    errors = []
+    init_db()
+    with database.engine.connect() as conn:
+        version = migrations.current_version(conn)
+        columns = {table.name: {c["name"] for c in inspect(conn).get_columns(table.name)}
+                   for table in models.Base.metadata.sorted_tables}
+    latest = migrations.MIGRATIONS[-1].version
+    print(f"schema version {version} (latest {latest})")
+    if version != latest:
+        errors.append(f"スキーマバージョンが最新になっていません: {version} != {latest}")
+    for table in models.Base.metadata.sorted_tables:
+        missing = {c.name for c in table.columns} - columns.get(table.name, set())
+        if missing:
+            errors.append(f"{table.name} に列がありません: {sorted(missing)}")
+
+    # 2回目の起動（マイグレーションは適用済み）
+    if migrations.upgrade(database.engine) != latest:
+        errors.append("2回目の起動でスキーマバージョンが変わりました")
+
+    with database.SessionLocal() as db:
+        topics = crud.get_topics(db)
+        if len(topics) != 1:
+            errors.append(f"既存のお題が読めません（初期データで上書きされた可能性）: {len(topics)}件")
+        for topic in topics:
+            print(f"topic {topic.name}: profile={topic.profile!r}, "
+                  f"resolved={resolve_profile(None, topic.profile).name}, weight={topic.weight!r}")
+            if topic.profile is not None:
+                errors.append(f"既存のお題にプロファイルが設定されています: {topic.profile}")
+            if topic.weight != 1:
+                errors.append(f"既存のお題の重みが既定値（1）になっていません: {topic.weight}")
+        image = crud.get_image_by_id(db, ids["image"])
+        if image is None or image.topic is None:
+            errors.append("既存の画像エントリが読めません")
+    return errors
+
+
+def main():
+    # 設定はインポート時に読まれるので、appを読み込む前にデータベースの場所を決める
+    tmp = tempfile.mkdtemp(prefix="check-migrations-")
+    os.chdir(tmp)
+    url = f"sqlite:///{tmp}/app.db"
+    os.environ["DATABASE_URL"] = url
+    ids = create_legacy_database(url)
+
+    errors = run(ids)
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: 既存のデータベースは起動時に今のスキーマへ更新され、既存のお題と画像エントリが読める")
+
+
+if __name__ == "__main__":
+    main()
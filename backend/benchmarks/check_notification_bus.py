@@ -0,0 +1,174 @@
+# backend/benchmarks/check_notification_bus.py
+"""
+複数のuvicornプロセスで通知バスを共有し、あるプロセスで送った通知が別のプロセスに接続しているWebSocketへ
+届くことを確かめる検証スクリプト（実際のHTTPサーバーとWebSocketを使う）。
+
+    cd backend && python -m benchmarks.check_notification_bus [--bus sqlite] [--workers 2] [--messages 200]
+    cd backend && python -m benchmarks.check_notification_bus --bus redis://localhost:6379/0
+
+--bus には sqlite（一時ファイルを使う）か NOTIFY_BUS_URL と同じ形式のURLを指定する。
+各プロセスは hub.NotificationHub.serve でWebSocketを受け付け、/publish で通知バスへ送る。
+以下を満たさない場合は終了コード1で終わる。
+- どのプロセスで送った通知も、全てのプロセスに接続しているクライアントへ順番どおり届く
+- 切断中に送られた通知が、別のプロセスへの last_seq 付きの再接続で再送される
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PUBLISH_TIMEOUT = 10
+
+
+def build_app():
+    from fastapi import FastAPI, Query, WebSocket
+
+    from app.bus import notification_bus
+    from app.hub import notification_hub
+
+    app = FastAPI()
+
+    @app.on_event("startup")
+    async def startup():
+        notification_hub.start()
+        await notification_bus.start(notification_hub.deliver)
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await notification_bus.stop()
+        await notification_hub.stop()
+
+    @app.post("/publish/{device_id}")
+    async def publish(device_id: str, payload: dict):
+        await notification_bus.publish(device_id, payload)
+        return {"pid": os.getpid()}
+
+    @app.get("/ready")
+    async def ready():
+        return {"pid": os.getpid()}
+
+    @app.websocket("/ws/{device_id}")
+    async def ws(websocket: WebSocket, device_id: str, last_seq: int = Query(None)):
+        await notification_hub.serve(device_id, websocket, last_seq)
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_servers(n: int, bus_url: str) -> list:
+    servers = []
+    for _ in range(n):
+        port = free_port()
+        env = {**os.environ, "NOTIFY_BUS_URL": bus_url, "NOTIFY_POLL_MS": "10"}
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.check_notification_bus", "--serve", str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        servers.append((process, port))
+    return servers
+
+
+async def wait_ready(client, ports: list):
+    deadline = time.monotonic() + 30
+    for port in ports:
+        while True:
+            try:
+                await client.get(f"http://127.0.0.1:{port}/ready")
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"サーバーが起動しませんでした: port={port}")
+                await asyncio.sleep(0.1)
+
+
+async def receive(ws, kind: str = "completed") -> dict:
+    while True:
+        message = json.loads(await asyncio.wait_for(ws.recv(), PUBLISH_TIMEOUT))
+        if message["type"] == kind:
+            return message
+
+
+async def run(args, ports: list) -> list:
+    import httpx
+    import websockets
+
+    errors = []
+    async with httpx.AsyncClient() as client:
+        await wait_ready(client, ports)
+        device = "device-1"
+        sockets = [await websockets.connect(f"ws://127.0.0.1:{port}/ws/{device}") for port in ports]
+        for ws in sockets:
+            await receive(ws, "hello")
+
+        # 各プロセスから順番に送り、全てのプロセスの接続に届くことと届くまでの時間を調べる
+        latencies = []
+        for i in range(args.messages):
+            port = ports[i % len(ports)]
+            started = time.perf_counter()
+            await client.post(f"http://127.0.0.1:{port}/publish/{device}", json={"type": "completed", "n": i})
+            for ws in sockets:
+                message = await receive(ws)
+                if message["n"] != i:
+                    errors.append(f"通知の順番が正しくありません: {message['n']} (期待値 {i})")
+                    return errors
+            latencies.append(time.perf_counter() - started)
+        print(f"{len(ports)} processes, {args.messages} messages: "
+              f"p50 {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+
+        # 最初のプロセスとの接続を切り、切断中に送った通知を別のプロセスへの再接続で受け取る
+        last_seq = message["seq"]
+        for ws in sockets:
+            await ws.close()
+        for i in range(3):
+            await client.post(f"http://127.0.0.1:{ports[0]}/publish/{device}", json={"type": "completed", "n": i})
+        await asyncio.sleep(0.5)
+        async with websockets.connect(f"ws://127.0.0.1:{ports[-1]}/ws/{device}?last_seq={last_seq}") as ws:
+            hello = await receive(ws, "hello")
+            replayed = [(await receive(ws))["n"] for _ in range(3)]
+        if hello["truncated"] or replayed != [0, 1, 2]:
+            errors.append(f"再接続時の再送が正しくありません: hello={hello}, replayed={replayed}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bus", default="sqlite")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        import uvicorn
+        uvicorn.run(build_app(), host="127.0.0.1", port=args.serve, log_level="warning")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bus_url = f"sqlite:///{Path(tmp) / 'bus.db'}" if args.bus == "sqlite" else args.bus
+        servers = start_servers(args.workers, bus_url)
+        try:
+            errors = asyncio.run(run(args, [port for _, port in servers]))
+        finally:
+            for process, _ in servers:
+                process.terminate()
+                process.wait()
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: どのプロセスで送った通知も全てのプロセスの接続に届き、別のプロセスへの再接続で再送される")
+
+
+if __name__ == "__main__":
+    main()
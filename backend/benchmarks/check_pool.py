@@ -0,0 +1,169 @@
+# backend/benchmarks/check_pool.py
+"""
+推論プール（pool.InferencePool）が、生成中のワーカープロセスが落ちても割り当てていたジョブを失わずに
+処理し切るかを確かめるスクリプト。GPUがなくても動くよう、一定時間待って小さな画像を返す偽のパイプラインを
+PIPELINE_FACTORY に指定し、spawnしたワーカープロセスをCPU上で複数立てる。
+
+    cd backend && python -m benchmarks.check_pool [--workers 2] [--jobs 8] [--job-ms 800]
+
+データベースと画像の保存先は一時ディレクトリに作る。ジョブを投入し、処理を始めたワーカープロセスの1つを
+SIGKILLで落とす。以下を満たさない場合は終了コード1で終わる。
+- 全てのジョブの結果がちょうど1回ずつ、エラーなしで返る
+- 落としたワーカープロセスが再起動される
+- 落としたプロセスが処理中だったジョブは試行回数が1つ増え、待たせていたジョブは試行として数えられない
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class FakePipeline:
+    """job_seconds 待ってから、渡されたキャンバスと同じ枚数の小さな画像を返すパイプラインの代わり"""
+
+    class Output:
+        def __init__(self, images):
+            self.images = images
+
+    def __init__(self, job_seconds: float):
+        self.job_seconds = job_seconds
+
+    def __call__(self, image, **kwargs):
+        from PIL import Image
+        time.sleep(self.job_seconds)
+        return self.Output([Image.new("RGB", (64, 64), "white") for _ in image])
+
+
+def fake_pipeline(device: str) -> FakePipeline:
+    """PIPELINE_FACTORY に指定する偽のパイプラインの生成関数（ワーカープロセス内で呼ばれる）"""
+    return FakePipeline(float(os.environ.get("FAKE_PIPELINE_MS", "800")) / 1000)
+
+
+def seed_jobs(count: int) -> list:
+    """画像エントリとキャンバス、ジョブの記録を作り、GenerationJob のリストを返す"""
+    from PIL import Image
+    from app import crud, database, schemas
+    from app.init_db import init_db
+    from app.worker import GenerationJob
+
+    init_db()
+    jobs = []
+    with database.SessionLocal() as db:
+        topic = crud.get_topics(db)[0]
+        for i in range(count):
+            device = crud.create_device(db)
+            db_image = crud.create_image(db, schemas.ImageCreate(
+                device_id=device.id, topic_id=topic.id))
+            filename = f"canvas-{i}.png"
+            Image.new("RGB", (256, 256), "white").save(database.saved_images_dir / filename)
+            db_image.canvas_image_filename = filename
+            job = GenerationJob(image_id=db_image.id, device_id=device.id)
+            db.add(crud.new_job(job))
+            jobs.append(job)
+        db.commit()
+    return jobs
+
+
+async def run(args) -> list:
+    from app.pool import InferencePool
+
+    errors = []
+    jobs = seed_jobs(args.jobs)
+    results = defaultdict(list)
+    done = asyncio.Event()
+
+    async def on_event(job, payload):
+        pass
+
+    async def on_result(result):
+        results[result.job.job_id].append(result)
+        if len(results) == len(jobs):
+            done.set()
+
+    pool = InferencePool(
+        [f"cpu:{i}" for i in range(args.workers)], on_event, on_result,
+        maxsize=len(jobs), window=0.05, max_batch_size=2,
+        heartbeat_timeout=30, max_attempts=3, monitor_interval=0.2)
+    await pool.start()
+    try:
+        deadline = time.monotonic() + args.timeout
+        while any(h["state"] != "ready" for h in pool.health()):
+            if time.monotonic() > deadline:
+                return ["ワーカープロセスの読み込みが終わりません"]
+            await asyncio.sleep(0.1)
+
+        for job in jobs:
+            pool.submit(job)
+
+        # 処理を始めたプロセスを、バッチの途中で落とす
+        while not any(slot.started for slot in pool._slots):
+            await asyncio.sleep(0.01)
+        victim = next(slot for slot in pool._slots if slot.started)
+        killed_started = set(victim.started)
+        killed_waiting = victim.inflight - victim.started
+        victim.process.kill()
+        print(f"killed worker {victim.index} (pid {victim.process.pid}): "
+              f"{len(killed_started)} running, {len(killed_waiting)} waiting")
+
+        try:
+            await asyncio.wait_for(done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            errors.append(f"結果が返らないジョブがあります: {len(jobs) - len(results)}件")
+        # 重複して返る結果がないか、少し待ってから確かめる
+        await asyncio.sleep(args.job_ms / 1000)
+    finally:
+        await pool.stop()
+
+    health = pool.health()
+    print(f"results {len(results)}/{len(jobs)}, restarts {[h['restarts'] for h in health]}")
+    for job in jobs:
+        delivered = results.get(job.job_id, [])
+        if len(delivered) > 1:
+            errors.append(f"結果が{len(delivered)}回返りました: job_id={job.job_id}")
+        for result in delivered:
+            if result.error or not result.filename:
+                errors.append(f"ジョブが失敗しました: job_id={job.job_id}, error={result.error}")
+        expected = 1 if job.job_id in killed_started else 0
+        if delivered and delivered[0].job.attempts != expected:
+            errors.append(
+                f"試行回数が{delivered[0].job.attempts}です（期待値 {expected}）: job_id={job.job_id}")
+    if health[victim.index]["restarts"] < 1:
+        errors.append(f"落としたワーカープロセスが再起動されていません: worker={victim.index}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--job-ms", type=float, default=800)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    # 設定はインポート時に読まれ、spawnしたワーカープロセスにも引き継がれるので、appを読み込む前に決める
+    tmp = tempfile.mkdtemp(prefix="check-pool-")
+    os.chdir(tmp)
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{tmp}/app.db",
+        "PIPELINE_FACTORY": "benchmarks.check_pool:fake_pipeline",
+        "FAKE_PIPELINE_MS": str(args.job_ms),
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")])),
+    })
+
+    errors = asyncio.run(run(args))
+    if errors:
+        print("\n".join(errors))
+        sys.exit(1)
+    print("OK: 落ちたワーカープロセスのジョブは再投入され、全てのジョブが1回ずつ完了した")
+
+
+if __name__ == "__main__":
+    main()
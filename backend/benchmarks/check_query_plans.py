@@ -0,0 +1,203 @@
+# backend/benchmarks/check_query_plans.py
+"""
+頻繁に実行されるクエリがインデックスを使っているかを、SQLiteの EXPLAIN QUERY PLAN で確かめるスクリプト。
+
+    cd backend && python -m benchmarks.check_query_plans [--devices 200] [--images 50] [--deep-images 5000]
+
+インデックスの無い変更前のスキーマでデータベースを作り、migrations.upgrade で既存のデータベースに
+インデックスが追加されることも合わせて確かめる。crud の関数が実際に発行したSQL文ごとに実行計画を取り、
+以下のいずれかに当たれば終了コード1で終わる。
+- images・devices・jobs テーブルのインデックスを使わない全件走査や、並べ替えのための一時B木が含まれる
+- カーソル付きのページで、カーソルの列の範囲条件によるインデックス検索（SEARCH）になっていない、
+  またはインデックス順の走査（SCAN）が含まれる
+- 履歴の末尾近くのカーソル（深いページ）で、SQLiteが実行した命令数が先頭ページより大きく増える
+"""
+
+import argparse
+import datetime
+import sqlite3
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, migrations, models
+
+# 変更前（マイグレーション導入前）のスキーマ
+LEGACY_SCHEMA = """
+CREATE TABLE devices (id VARCHAR NOT NULL PRIMARY KEY, created_at DATETIME);
+CREATE TABLE topics (id VARCHAR NOT NULL PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE,
+                     prompt TEXT NOT NULL, negative_prompt TEXT, created_at DATETIME);
+CREATE TABLE images (id VARCHAR NOT NULL PRIMARY KEY, device_id VARCHAR NOT NULL REFERENCES devices (id),
+                     topic_id VARCHAR NOT NULL REFERENCES topics (id), canvas_image_filename VARCHAR,
+                     generated_image_filename VARCHAR, request_time DATETIME, negative_prompt TEXT,
+                     CONSTRAINT unique_device_image UNIQUE (device_id, id));
+"""
+
+
+# カーソル付きのページで、インデックス検索に含まれているべき範囲条件
+CURSOR_RANGES = {"images": "(request_time,id)<", "devices": "(created_at,id)>"}
+# 深いページの命令数として許す、先頭ページの命令数に対する倍率
+DEEP_PAGE_STEP_RATIO = 2
+# 命令数を数える単位（プログレスハンドラを呼ぶ間隔）
+STEP_UNIT = 100
+
+
+def is_bad_step(step: str, cursor_table: Optional[str] = None) -> bool:
+    """
+    インデックスを使わない全件走査と、並べ替えのための一時B木を検出する。
+    先頭ページの「SCAN ... USING (COVERING) INDEX」はインデックス順の走査がLIMITで打ち切られるので許容するが、
+    カーソル付きのページでは走査はカーソルより前の行を読み飛ばすことになるので、どの走査も許容しない。
+    """
+    if step.startswith(("SCAN images", "SCAN devices", "SCAN jobs")):
+        return cursor_table is not None or "USING" not in step
+    return step.startswith("USE TEMP B-TREE FOR ORDER BY")
+
+
+def has_cursor_range(plan: List[str], table: str) -> bool:
+    """カーソルのテーブルを、カーソルの列の範囲条件でインデックス検索しているか"""
+    return any(step.startswith(f"SEARCH {table} ") and CURSOR_RANGES[table] in step for step in plan)
+
+
+def count_steps(conn: sqlite3.Connection, statement: str, parameters) -> int:
+    """文を最後まで実行し、SQLiteの仮想マシンが実行した命令数をSTEP_UNIT単位で返す"""
+    steps = 0
+
+    def tick():
+        nonlocal steps
+        steps += 1
+        return 0
+
+    conn.set_progress_handler(tick, STEP_UNIT)
+    try:
+        conn.execute(statement, parameters).fetchall()
+    finally:
+        conn.set_progress_handler(None, STEP_UNIT)
+    return steps
+
+
+def seed(engine, n_devices: int, n_images: int, n_deep: int) -> tuple:
+    """
+    デバイスごとにn_images件の画像と描き直し2回分のジョブを入れる。深いページを確かめるため、
+    1つのデバイスにはn_deep件の長い履歴を持たせる。(長い履歴のデバイスID, 画像ID) を返す。
+    """
+    base = datetime.datetime(2024, 1, 1)
+    topic_id = str(uuid.uuid4())
+    device_ids = [str(uuid.uuid4()) for _ in range(n_devices)]
+    deep_device_id = device_ids[n_devices // 2]
+    images = [
+        {"id": str(uuid.uuid4()), "device_id": d, "topic_id": topic_id,
+         "request_time": base + datetime.timedelta(minutes=j)}
+        for d in device_ids for j in range(n_deep if d == deep_device_id else n_images)]
+    with engine.begin() as conn:
+        conn.execute(insert(models.Topic), [{"id": topic_id, "name": "topic", "prompt": "prompt"}])
+        conn.execute(insert(models.Device), [
+            {"id": d, "created_at": base + datetime.timedelta(seconds=i)} for i, d in enumerate(device_ids)])
+        conn.execute(insert(models.Image), images)
+        # 画像エントリごとに描き直し2回分のジョブ（ほとんどは完了済み）
+        conn.execute(insert(models.Job), [
+            {"id": str(uuid.uuid4()), "image_id": image["id"], "device_id": image["device_id"],
+             "status": models.JOB_QUEUED if i % 97 == 0 else models.JOB_SUCCEEDED,
+             "created_at": image["request_time"] + datetime.timedelta(seconds=k)}
+            for i, image in enumerate(images) for k in range(2)])
+        conn.exec_driver_sql("ANALYZE")
+    return deep_device_id, images[len(images) // 2]["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--images", type=int, default=50)
+    # 深いページを確かめるデバイスの画像数
+    parser.add_argument("--deep-images", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'legacy.db'}")
+        with engine.begin() as conn:
+            for statement in LEGACY_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.exec_driver_sql(statement)
+        version = migrations.upgrade(engine)
+        print(f"schema version: {version}")
+        device_id, image_id = seed(engine, args.devices, args.images, args.deep_images)
+
+        # 末尾近くの（前のページの行が最も多い）カーソル
+        with engine.connect() as conn:
+            image_rows = conn.execute(
+                select(models.Image.request_time, models.Image.id)
+                .where(models.Image.device_id == device_id)
+                .order_by(models.Image.request_time, models.Image.id)).all()
+            device_rows = conn.execute(
+                select(models.Device.created_at, models.Device.id)
+                .order_by(models.Device.created_at, models.Device.id)).all()
+        image_cursor = crud.encode_cursor(*image_rows[20])
+        device_cursor = crud.encode_cursor(*device_rows[-51])
+
+        captured = []
+        event.listen(engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, parameters, *a: captured.append((statement, parameters)))
+        session = sessionmaker(bind=engine)()
+        queries = {
+            "get_latest_image": lambda: crud.get_latest_image(session, device_id),
+            "get_images_by_device": lambda: crud.get_images_by_device(session, device_id),
+            "get_images_page": lambda: crud.get_images_page(session, device_id, 20),
+            "get_images_page (deep cursor)": lambda: crud.get_images_page(session, device_id, 20, image_cursor),
+            "get_device_summaries": lambda: crud.get_device_summaries(session, 50),
+            "get_device_summaries (deep cursor)": lambda: crud.get_device_summaries(session, 50, device_cursor),
+            "get_unfinished_jobs": lambda: crud.get_unfinished_jobs(session),
+            "latest_job_query": lambda: session.execute(crud.latest_job_query(image_id)).first(),
+        }
+        # カーソル付きのページ: 名前 -> (先頭ページの名前, カーソルで絞り込むテーブル)
+        cursor_pages = {
+            "get_images_page (deep cursor)": ("get_images_page", "images"),
+            "get_device_summaries (deep cursor)": ("get_device_summaries", "devices"),
+        }
+
+        failures = []
+        steps = {}
+        with engine.connect() as conn:
+            raw = conn.connection.driver_connection
+            for name, run in queries.items():
+                captured.clear()
+                session.expunge_all()
+                run()
+                cursor_table = cursor_pages.get(name, (None, None))[1]
+                for statement, parameters in list(captured):
+                    # お題のselectinloadなど主キーでの参照は対象外
+                    table = next((t for t in ("images", "devices", "jobs") if f"FROM {t}" in statement), None)
+                    if table is None:
+                        continue
+                    plan = [row[-1] for row in raw.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+                    checked_table = cursor_table if table == cursor_table else None
+                    bad = [step for step in plan if is_bad_step(step, checked_table)]
+                    if checked_table and not has_cursor_range(plan, checked_table):
+                        bad.append(f"{checked_table} のカーソルの範囲条件によるSEARCHがありません")
+                    if table == cursor_table or name in {first for first, _ in cursor_pages.values()}:
+                        steps.setdefault(name, {})[table] = count_steps(raw, statement, parameters)
+                    print(f"{'NG' if bad else 'OK'} {name}: {' / '.join(plan)}")
+                    if bad:
+                        failures.append(f"{name}: {', '.join(bad)}")
+
+        for name, (first, table) in cursor_pages.items():
+            deep, top = steps[name][table], steps[first][table]
+            print(f"{name}: {deep * STEP_UNIT} steps (first page {top * STEP_UNIT})")
+            if deep > top * DEEP_PAGE_STEP_RATIO + 1:
+                failures.append(f"{name}: 深いページの命令数が先頭ページの{DEEP_PAGE_STEP_RATIO}倍を超えました "
+                                f"({deep * STEP_UNIT} > {top * STEP_UNIT})")
+        session.close()
+        engine.dispose()
+
+    if failures:
+        print("インデックスを使っていない、またはカーソルの位置から範囲検索していないクエリがあります:\n"
+              + "\n".join(failures))
+        sys.exit(1)
+    print("OK: 全てのクエリがインデックスを使い、カーソル付きのページは深さによらずカーソルの位置から範囲検索する")
+
+
+if __name__ == "__main__":
+    main()
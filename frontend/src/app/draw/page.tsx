@@ -28,6 +28,7 @@ export default function DrawingPage() {
   const [isConfirmDialogOpen, setIsConfirmDialogOpen] = useState(false)
   const [currentTopic, setCurrentTopic] = useState<string>('')
   const [error, setError] = useState<string | null>(null)
+  const [queueMessage, setQueueMessage] = useState<string | null>(null)
   const canvasRef = useRef<HTMLCanvasElement>(null)
   const contextRef = useRef<CanvasRenderingContext2D | null>(null)
   const isSavedRef = useRef(false)
@@ -103,33 +104,66 @@ export default function DrawingPage() {
       const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8000'
       const wsProtocol = backendUrl.startsWith('https') ? 'wss' : 'ws'
       const wsUrl = `${wsProtocol}://${backendUrl.replace(/^https?:\/\//, '')}/ws/${deviceId}`
-      const websocket = new WebSocket(wsUrl)
-      // setWs(websocket) // 未使用のため削除
+      // 最後に受け取った通知の番号。再接続時に渡すと、切断中に送られた通知が再送される
+      let lastSeq: number | null = null
+      let websocket: WebSocket
+      let reconnectTimer: ReturnType<typeof setTimeout> | undefined
+      let closedByPage = false
 
-      websocket.onopen = () => {
-        console.log('WebSocket接続が確立しました。')
-      }
+      const connect = () => {
+        websocket = new WebSocket(lastSeq === null ? wsUrl : `${wsUrl}?last_seq=${lastSeq}`)
 
-      websocket.onmessage = (event) => {
-        const data = JSON.parse(event.data)
-        console.log('通知を受信:', data)
-        if (data.generatedImageUrl) {
-          // setGeneratedImageUrl(data.generatedImageUrl) // 未使用のため削除
-          // setCanvasImageUrl(data.canvasImageUrl) // 未使用のため削除
-          // 結果ページに遷移（generatedImageUrlも渡す）
-          router.push(`/result?canvasImageUrl=${encodeURIComponent(data.canvasImageUrl)}&generatedImageUrl=${encodeURIComponent(data.generatedImageUrl)}&deviceId=${encodeURIComponent(deviceId)}&topic=${encodeURIComponent(data.topic)}`)
+        websocket.onopen = () => {
+          console.log('WebSocket接続が確立しました。')
         }
-      }
 
-      websocket.onclose = () => {
-        console.log('WebSocket接続が閉じられました。')
-      }
+        websocket.onmessage = (event) => {
+          const data = JSON.parse(event.data)
+          if (data.type === 'ping') {
+            // サーバーのハートビートに応答する（応答が無い接続は切断される）
+            websocket.send('pong')
+            return
+          }
+          if (data.type === 'hello') {
+            // 再送しきれない場合（サーバーの再起動など）は、サーバーの現在の番号から数え直す
+            if (lastSeq === null || data.truncated) lastSeq = data.seq
+            return
+          }
+          if (typeof data.seq === 'number') lastSeq = data.seq
+          console.log('通知を受信:', data)
+          if (data.type === 'failed') {
+            // 生成に失敗した場合は待ち状態の表示をやめ、HTTPエラーと同じようにエラーを表示する
+            console.error('画像の生成に失敗しました:', data.error)
+            setQueueMessage(null)
+            setError(data.error || '画像の生成に失敗しました')
+            return
+          }
+          if (data.generatedImageUrl) {
+            // setGeneratedImageUrl(data.generatedImageUrl) // 未使用のため削除
+            // setCanvasImageUrl(data.canvasImageUrl) // 未使用のため削除
+            // 結果ページに遷移（generatedImageUrlも渡す）
+            router.push(`/result?canvasImageUrl=${encodeURIComponent(data.canvasImageUrl)}&generatedImageUrl=${encodeURIComponent(data.generatedImageUrl)}&deviceId=${encodeURIComponent(deviceId)}&topic=${encodeURIComponent(data.topic)}`)
+          }
+        }
+
+        websocket.onclose = () => {
+          console.log('WebSocket接続が閉じられました。')
+          if (!closedByPage) {
+            // 生成中に切断されても完了通知を受け取れるよう、少し待って再接続する
+            reconnectTimer = setTimeout(connect, 1000)
+          }
+        }
 
-      websocket.onerror = (error) => {
-        console.error('WebSocketエラー:', error)
+        websocket.onerror = (error) => {
+          console.error('WebSocketエラー:', error)
+        }
       }
 
+      connect()
+
       return () => {
+        closedByPage = true
+        clearTimeout(reconnectTimer)
         websocket.close()
       }
     }
@@ -208,13 +242,24 @@ export default function DrawingPage() {
         })
         if (response.data.success) {
           console.log('キャンバス画像が保存されました:', response.data.file_name)
+          setError(null)
+          if (response.data.queue_position != null && response.data.eta_seconds != null) {
+            setQueueMessage(
+              `あと${response.data.queue_position}人待ち・およそ${Math.ceil(response.data.eta_seconds)}秒でできあがります`)
+          }
           // 生成画像がWebSocket経由で通知されるため、結果ページへの遷移はWebSocketのメッセージで行う
         } else {
           console.error('キャンバス画像の保存に失敗しました')
           setError('キャンバス画像の保存に失敗しました')
         }
       } catch (error: unknown) { // 'any' を 'unknown' に変更
-        if (axios.isAxiosError(error)) {
+        const retryAfter = axios.isAxiosError(error) ? Number(error.response?.headers['retry-after']) : NaN
+        if (retryAfter > 0) {
+          // 混雑中・準備中は Retry-After の秒数だけ待って描いた絵を送り直す
+          setError(`混み合っています。${retryAfter}秒後にもう一度送ります`)
+          isSavedRef.current = false
+          setTimeout(saveCanvasImage, retryAfter * 1000)
+        } else if (axios.isAxiosError(error)) {
           console.error('キャンバス画像の保存中にエラーが発生しました:', error.message)
           setError('キャンバス画像の保存中にエラーが発生しました')
         } else {
@@ -233,6 +278,7 @@ export default function DrawingPage() {
           <h2 className="text-xl font-semibold text-center mb-6 text-blue-500">お題：「{currentTopic}」</h2>
 
           {error && <p className="text-red-500 mb-4 text-center">{error}</p>}
+          {queueMessage && <p className="text-blue-500 mb-4 text-center">{queueMessage}</p>}
 
           <div className="relative mb-4">
             <canvas
@@ -14,6 +14,24 @@ interface ImageEntry {
     canvas_image_filename: string
     generated_image_filename?: string
     negative_prompt?: string
+    // 長辺のサイズ（"256" / "512"）ごとのサムネイルのURL
+    generated_thumbnail_urls?: Record<string, string>
+    canvas_thumbnail_urls?: Record<string, string>
+}
+
+const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8000'
+
+// 一覧ではフルサイズの画像ではなくサムネイルを表示する
+const thumbnailUrl = (image: ImageEntry, size: string = '512') => {
+    const thumbnail = image.generated_image_filename
+        ? image.generated_thumbnail_urls?.[size]
+        : image.canvas_thumbnail_urls?.[size]
+    if (thumbnail) {
+        return `${backendUrl}${thumbnail}`
+    }
+    return image.generated_image_filename
+        ? `http://localhost:8000/generated-images/${image.generated_image_filename}`
+        : `http://localhost:8000/saved-images/${image.canvas_image_filename}`
 }
 
 export default function HistoryPage() {
@@ -22,35 +40,40 @@ export default function HistoryPage() {
     const [error, setError] = useState<string | null>(null)
     const [selectedImage, setSelectedImage] = useState<string | null>(null)
 
-    useEffect(() => {
-        const fetchImages = async () => {
-            const deviceId = localStorage.getItem('device_id')
-            if (!deviceId) {
-                setError('デバイスIDが存在しません。トップページからデバイスを登録してください。')
-                return
-            }
+    const [nextCursor, setNextCursor] = useState<string | null>(null)
+
+    // cursorを指定すると続きのページを取得して末尾に追加する
+    const fetchImages = async (cursor: string | null = null) => {
+        const deviceId = localStorage.getItem('device_id')
+        if (!deviceId) {
+            setError('デバイスIDが存在しません。トップページからデバイスを登録してください。')
+            return
+        }
+
+        setLoading(true)
+        setError(null)
+        try {
+            const response = await axios.get(`${backendUrl}/images/${deviceId}`, {
+                params: cursor ? { cursor } : {},
+            })
+            console.log('Response from /images:', response.data)
 
-            setLoading(true)
-            setError(null)
-            try {
-                const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8000'
-                const response = await axios.get(`${backendUrl}/images/${deviceId}`)
-                console.log('Response from /images:', response.data)
-
-                if (response.data.success && response.data.images) {
-                    setImages(response.data.images)
-                } else {
-                    setError(response.data.detail || '画像の取得に失敗しました。')
-                }
-            } catch (error: any) { // eslint-disable-line @typescript-eslint/no-explicit-any
-                // eslintのエラー無視
-                setError('画像の取得中にエラーが発生しました。')
-                console.error('Error fetching images:', error)
-            } finally {
-                setLoading(false)
+            if (response.data.success && response.data.images) {
+                setImages(prev => cursor ? [...prev, ...response.data.images] : response.data.images)
+                setNextCursor(response.data.next_cursor ?? null)
+            } else {
+                setError(response.data.detail || '画像の取得に失敗しました。')
             }
+        } catch (error: any) { // eslint-disable-line @typescript-eslint/no-explicit-any
+            // eslintのエラー無視
+            setError('画像の取得中にエラーが発生しました。')
+            console.error('Error fetching images:', error)
+        } finally {
+            setLoading(false)
         }
+    }
 
+    useEffect(() => {
         fetchImages()
     }, [])
 
@@ -67,7 +90,7 @@ export default function HistoryPage() {
             <div className="max-w-4xl mx-auto">
                 <h1 className="text-3xl font-bold mb-6 text-center">画像履歴</h1>
 
-                {loading && <p className="text-center">読み込み中...</p>}
+                {loading && images.length === 0 && <p className="text-center">読み込み中...</p>}
                 {error && <p className="text-red-500 text-center mb-4">{error}</p>}
 
                 {!loading && !error && images.length === 0 && (
@@ -85,7 +108,7 @@ export default function HistoryPage() {
                         }}>
                             <div className="relative aspect-square">
                                 <Image
-                                    src={image.generated_image_filename ? `http://localhost:8000/generated-images/${image.generated_image_filename}` : `http://localhost:8000/saved-images/${image.canvas_image_filename}`}
+                                    src={thumbnailUrl(image)}
                                     alt={`Image ${image.id}`}
                                     fill
                                     sizes="(max-width: 768px) 100vw, (max-width: 1200px) 50vw, 33vw"
@@ -100,6 +123,18 @@ export default function HistoryPage() {
                         </Card>
                     ))}
                 </div>
+
+                {nextCursor && (
+                    <div className="text-center mt-6">
+                        <button
+                            onClick={() => fetchImages(nextCursor)}
+                            disabled={loading}
+                            className="px-4 py-2 bg-white rounded-lg shadow-md text-gray-700 disabled:opacity-50"
+                        >
+                            {loading ? '読み込み中...' : 'もっと見る'}
+                        </button>
+                    </div>
+                )}
             </div>
 
             {/* モーダルで画像を表示 */}